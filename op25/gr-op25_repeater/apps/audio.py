@@ -48,7 +48,8 @@ import sys
 import time
 
 from optparse import OptionParser
-from sockaudio import socket_audio
+from sockaudio import socket_audio, mixer_audio, stream_gate, parse_streams, MIX_DUCK_GAIN, GATE_LEVEL_DB
+from audio_shm import shm_audio
 
 def signal_handler(signal, frame):
    sys.stderr.write("audio.py shutting down\n")
@@ -61,13 +62,26 @@ parser.add_option("-u", "--wireshark-port", type="int", default=23456, help="Wir
 parser.add_option("-2", "--two-channel", action="store_true", default=False, help="single or two channel audio")
 parser.add_option("-x", "--audio-gain", type="float", default="1.0", help="audio gain (default = 1.0)")
 parser.add_option("-s", "--stdout", action="store_true", default=False, help="write to stdout instead of audio device")
+parser.add_option("-m", "--mix", type="string", default=None, help="mix udp streams: port[:gain[:priority]],...")
+parser.add_option("-D", "--duck-gain", type="float", default=MIX_DUCK_GAIN, help="gain of lower priority streams while mixing (default = %s)" % MIX_DUCK_GAIN)
+parser.add_option("-J", "--no-jitter-buffer", action="store_true", default=False, help="write udp frames directly to the audio device")
+parser.add_option("-G", "--gate", type="float", default=None, help="drop silence more than GATE seconds after audio or end of call")
+parser.add_option("-L", "--gate-level", type="float", default=GATE_LEVEL_DB, help="level (dBFS) below which frames count as silence (default = %s)" % GATE_LEVEL_DB)
+parser.add_option("-S", "--shm", type="string", default=None, help="read the shared memory ring of a 'shm://NAME' destination instead of udp")
  
 (options, args) = parser.parse_args()
 if len(args) != 0:
    parser.print_help()
    sys.exit(1)
 
-audio_handler = socket_audio("0.0.0.0", options.wireshark_port, options.audio_output, options.two_channel, options.audio_gain, options.stdout)
+gate = stream_gate(options.gate_level, options.gate) if options.gate is not None else None
+
+if options.shm is not None:
+   audio_handler = shm_audio(options.shm, options.audio_output, options.two_channel, options.audio_gain, options.stdout, jitter_buffer=not options.no_jitter_buffer, gate=gate)
+elif options.mix is not None:
+   audio_handler = mixer_audio("0.0.0.0", parse_streams(options.mix), options.audio_output, options.audio_gain, options.stdout, duck_gain=options.duck_gain)
+else:
+   audio_handler = socket_audio("0.0.0.0", options.wireshark_port, options.audio_output, options.two_channel, options.audio_gain, options.stdout, jitter_buffer=not options.no_jitter_buffer, gate=gate)
 
 if __name__ == "__main__":
    signal.signal(signal.SIGINT, signal_handler)
@@ -0,0 +1,445 @@
+#
+# OP25 Stream Audio Encoder
+#
+# This file is part of OP25
+#
+# OP25 is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# OP25 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OP25; see the file COPYING. If not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Boston, MA
+# 02110-1301, USA.
+
+"""
+Encode op25 udp audio for streaming without a sound server in the loop.
+
+PCM frames are taken straight from the udp audio, either tapped from a
+sockaudio player running in the same process or received directly, and
+are paced in real time by a dedicated thread which fills the gaps between
+transmissions with silence.  MP3 is encoded in-process when the 'lameenc'
+module is installed and pushed to Icecast with a minimal source client;
+otherwise an ffmpeg child is fed the raw 8kHz PCM on its stdin.
+
+With a stream gate the idle periods between calls are not encoded: the
+stream either pauses or, for the in-process encoder, repeats a block of
+comfort noise which was encoded once when the stream went idle.
+"""
+
+import sys
+import os
+import time
+import socket
+import signal
+import base64
+import threading
+import subprocess
+import numpy as np
+from collections import deque
+from log_ts import log_ts
+from sockaudio import socket_audio, stream_gate, PCM_RATE, GATE_HANG_SEC, GATE_LEVEL_DB
+
+try:
+    from urllib.parse import urlsplit, unquote
+except ImportError:
+    from urlparse import urlsplit
+    from urllib import unquote
+
+try:
+    import lameenc
+except ImportError:
+    lameenc = None
+
+ENCODERS = {
+    "mp3":  ("libmp3lame", "audio/mpeg"),
+    "aac":  ("aac",        "audio/aac"),
+    "opus": ("libopus",    "audio/ogg"),
+    "flac": ("flac",       "audio/flac"),
+}
+
+ENC_QUEUE_FRAMES = 50       # frames queued ahead of the encoder before the oldest are discarded (1 sec)
+ENC_PREBUFFER = 2           # frames queued before a transmission starts playing
+ENC_FRAME_SAMPLES = 160     # samples of silence written per tick while idle
+ENC_MAX_LAG = 1.0           # seconds behind schedule before the clock is reset
+ENC_RESTART_DELAY = 1.5     # seconds between encoder restarts
+ENC_COMFORT_SEC = 1.0       # duration of the pre-encoded comfort noise block
+ENC_COMFORT_LEVEL = 20      # rms amplitude of the comfort noise (about -64 dBFS)
+GATE_MODES = ("off", "pause", "comfort")
+
+def parse_bitrate(bitrate):
+    bitrate = str(bitrate).lower()
+    if bitrate.endswith('k'):
+        return int(float(bitrate[:-1]))
+    return int(bitrate) // 1000
+
+class icecast_client(object):
+    """Icecast source client using HTTP PUT (Icecast 2.4 and later)"""
+    def __init__(self, url, content_type, name="OP25"):
+        u = urlsplit(url)
+        self.host = u.hostname
+        self.port = u.port or 8000
+        self.mount = u.path or "/"
+        self.auth = base64.b64encode(("%s:%s" % (unquote(u.username or "source"), unquote(u.password or ""))).encode()).decode()
+        self.content_type = content_type
+        self.name = name
+        self.sock = None
+
+    def open(self):
+        self.sock = socket.create_connection((self.host, self.port), timeout=10)
+        req = ("PUT %s HTTP/1.1\r\n"
+               "Host: %s:%d\r\n"
+               "Authorization: Basic %s\r\n"
+               "User-Agent: OP25\r\n"
+               "Content-Type: %s\r\n"
+               "Ice-Name: %s\r\n"
+               "Ice-Public: 0\r\n"
+               "Expect: 100-continue\r\n\r\n") % (self.mount, self.host, self.port, self.auth, self.content_type, self.name)
+        self.sock.sendall(req.encode())
+        resp = b''
+        while b'\r\n\r\n' not in resp:
+            data = self.sock.recv(1024)
+            if not data:
+                break
+            resp += data
+        status = resp.split(b'\r\n')[0].decode('ascii', 'replace')
+        fields = status.split()
+        if len(fields) < 2 or fields[1] not in ('100', '200'):
+            self.close()
+            raise IOError("icecast refused source connection: %s" % status)
+        self.sock.settimeout(None)
+
+    def write(self, data):
+        self.sock.sendall(data)
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except socket.error:
+                pass
+            self.sock = None
+
+class file_output(object):
+    def __init__(self, filename):
+        self.filename = filename
+        self.f = None
+
+    def open(self):
+        self.f = open(self.filename, "ab")
+
+    def write(self, data):
+        self.f.write(data)
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+class lame_encoder(object):
+    """MP3 encoded in-process by lameenc"""
+    def __init__(self, opts, output):
+        self.channels = opts.stream_channels
+        self.bitrate = parse_bitrate(opts.stream_bitrate)
+        self.output = output
+        self.enc = None
+        self.comfort = None
+        self.idle_samples = 0
+
+    def new_encoder(self):
+        enc = lameenc.Encoder()
+        enc.set_bit_rate(self.bitrate)
+        enc.set_in_sample_rate(PCM_RATE)
+        enc.set_channels(self.channels)
+        enc.set_quality(2)
+        return enc
+
+    def open(self):
+        self.enc = self.new_encoder()
+        self.output.open()
+
+    def write(self, pcm):
+        if self.enc is None:        # resuming after comfort noise
+            self.enc = self.new_encoder()
+        data = self.enc.encode(pcm)
+        if len(data):
+            self.output.write(data)
+
+    def write_idle(self, nsamples):
+        # mp3 streams may be joined at frame boundaries, so the live encoder is
+        # flushed and a separately encoded block is repeated until audio resumes
+        if self.comfort is None:
+            noise = np.random.RandomState(0).normal(0, ENC_COMFORT_LEVEL, int(ENC_COMFORT_SEC * PCM_RATE) * self.channels)
+            enc = self.new_encoder()
+            self.comfort = bytes(enc.encode(noise.astype(np.int16).tobytes())) + bytes(enc.flush())
+        if self.enc is not None:
+            self.output.write(self.enc.flush())
+            self.enc = None
+            self.idle_samples = 0
+        self.idle_samples -= nsamples
+        if self.idle_samples < 0:
+            self.output.write(self.comfort)
+            self.idle_samples += int(ENC_COMFORT_SEC * PCM_RATE)
+
+    def close(self):
+        try:
+            if self.enc is not None:
+                self.output.write(self.enc.flush())
+        except (IOError, OSError, socket.error):
+            pass
+        self.enc = None
+        self.output.close()
+
+class ffmpeg_encoder(object):
+    """Any ffmpeg codec and output, fed raw PCM through a pipe"""
+    def __init__(self, opts):
+        self.opts = opts
+        self.proc = None
+        self.log_handle = None
+
+    def command(self):
+        opts = self.opts
+        acodec, default_ct = ENCODERS.get(opts.stream_format, ("libmp3lame", "audio/mpeg"))
+        dest = opts.stream_url
+        out_opts = []
+        if dest.startswith("icecast://"):
+            out_opts += ["-content_type", opts.stream_content_type or default_ct]
+        elif dest.startswith("file:"):
+            dest = dest[len("file:"):]
+        cmd = ["ffmpeg", "-hide_banner", "-loglevel", "warning",
+               "-f", "s16le", "-ar", str(PCM_RATE), "-ac", str(opts.stream_channels), "-i", "pipe:0",
+               "-ac", str(opts.stream_channels),
+               "-ar", str(opts.stream_rate),
+               "-c:a", acodec]
+        if opts.stream_format in ("mp3", "aac", "opus"):
+            cmd += ["-b:a", opts.stream_bitrate]
+        cmd += out_opts + ["-f", opts.stream_format, dest]
+        return cmd
+
+    def open(self):
+        stdout = stderr = None
+        if self.opts.stream_log:
+            self.log_handle = open(self.opts.stream_log, "ab", buffering=0)
+            stdout = stderr = self.log_handle
+        self.proc = subprocess.Popen(self.command(), bufsize=0, stdin=subprocess.PIPE, stdout=stdout, stderr=stderr, preexec_fn=os.setsid)
+
+    def write(self, pcm):
+        if self.proc.poll() is not None:
+            raise IOError("ffmpeg exited with status %d" % self.proc.returncode)
+        self.proc.stdin.write(pcm)
+
+    def write_idle(self, nsamples):     # ffmpeg has no cheaper way to keep its output going
+        self.write(bytes(bytearray(2 * self.opts.stream_channels * nsamples)))
+
+    def close(self):
+        if self.proc is not None:
+            try:
+                self.proc.stdin.close()
+                self.proc.wait(timeout=5)
+            except Exception:
+                try:
+                    os.killpg(os.getpgid(self.proc.pid), signal.SIGKILL)
+                except Exception:
+                    pass
+            self.proc = None
+        if self.log_handle:
+            try: self.log_handle.close()
+            except Exception: pass
+            self.log_handle = None
+
+def make_encoder(opts):
+    content_type = opts.stream_content_type or ENCODERS.get(opts.stream_format, ENCODERS["mp3"])[1]
+    if opts.stream_format == "mp3" and lameenc is not None:
+        if opts.stream_url.startswith("icecast://"):
+            return lame_encoder(opts, icecast_client(opts.stream_url, content_type))
+        if opts.stream_url.startswith("file:"):
+            return lame_encoder(opts, file_output(opts.stream_url[len("file:"):]))
+    return ffmpeg_encoder(opts)
+
+class encoder_sink(object):
+    """Paces udp audio frames into an encoder in real time, writing silence while idle.
+
+    When 'stream_gate' is 'pause' or 'comfort', idle periods after the gate
+    closes are skipped or filled by the encoder's comfort noise instead.
+    Implements the sockaudio pcm interface so that it may be attached to a
+    player with socket_audio.add_sink() or used as the pcm of encoder_audio.
+    """
+    def __init__(self, opts):
+        self.opts = opts
+        self.channels = opts.stream_channels
+        self.frames = deque(maxlen=ENC_QUEUE_FRAMES)
+        self.lock = threading.Lock()
+        self.playing = False
+        self.ending = False
+        self.silence = bytes(bytearray(2 * self.channels * ENC_FRAME_SAMPLES))
+        self.encoder = None
+        self.keep_running = False
+        self.thread = None
+        self.gate_mode = opts.stream_gate
+        self.gate = stream_gate(opts.stream_gate_level, opts.stream_hang) if self.gate_mode != "off" else None
+        self.stats = {'frames': 0, 'dropped': 0, 'restarts': 0, 'idle_sec': 0.0}
+
+    def start(self):
+        self.keep_running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.keep_running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    # sockaudio pcm interface
+    def open(self, hwdev):
+        self.start()
+        return 0
+
+    def setup(self, pcm_format, pcm_channels, pcm_rate, pcm_buffer_size):
+        return 0
+
+    def close(self):
+        self.stop()
+        return 0
+
+    def check(self):
+        return 0
+
+    def dump(self):
+        return
+
+    def delay(self):
+        with self.lock:
+            return sum(len(f) for f in self.frames) // (2 * self.channels)
+
+    def write(self, pcm):       # pcm is interleaved stereo S16_LE
+        arr = np.frombuffer(pcm, dtype=np.int16) if not isinstance(pcm, np.ndarray) else pcm
+        if self.gate is not None:
+            with self.lock:
+                if not self.gate.frame(arr):
+                    return 0
+        if self.channels == 1:
+            arr = ((arr[0::2].astype(np.int32) + arr[1::2]) >> 1).astype(np.int16)
+        with self.lock:
+            if len(self.frames) == self.frames.maxlen:
+                self.stats['dropped'] += 1
+            self.frames.append(arr.tobytes())
+            self.ending = False
+        return 0
+
+    def drain(self):
+        with self.lock:
+            self.ending = True
+            if self.gate is not None:
+                self.gate.end()
+        return 0
+
+    def drop(self):
+        with self.lock:
+            if self.gate is not None:
+                self.gate.end()
+            self.frames.clear()
+            self.playing = False
+            self.ending = False
+        return 0
+
+    def next_frame(self):
+        with self.lock:
+            if not self.playing and (len(self.frames) >= ENC_PREBUFFER or (self.ending and len(self.frames))):
+                self.playing = True
+            if self.playing and len(self.frames):
+                self.stats['frames'] += 1
+                return self.frames.popleft()
+            if self.ending:
+                self.playing = False
+                self.ending = False
+            if self.gate is not None and not self.gate.is_open():
+                return None     # idle
+        return self.silence
+
+    def run(self):
+        next_t = time.time()
+        while self.keep_running:
+            if self.encoder is None:
+                try:
+                    encoder = make_encoder(self.opts)
+                    encoder.open()
+                    self.encoder = encoder
+                    sys.stderr.write("%s Streaming %s to %s (%s)\n" % (log_ts.get(), self.opts.stream_format, self.opts.stream_url, encoder.__class__.__name__))
+                except Exception as e:
+                    sys.stderr.write("%s Unable to start stream encoder: %s\n" % (log_ts.get(), e))
+                    if not self.opts.stream_restart:
+                        break
+                    self.stats['restarts'] += 1
+                    time.sleep(ENC_RESTART_DELAY)
+                    continue
+                next_t = time.time()
+            now = time.time()
+            if next_t > now:
+                time.sleep(next_t - now)
+            elif now - next_t > ENC_MAX_LAG:    # stalled (e.g. network); resume from now
+                next_t = now
+            frame = self.next_frame()
+            try:
+                if frame is None:
+                    self.stats['idle_sec'] += ENC_FRAME_SAMPLES / float(PCM_RATE)
+                    if self.gate_mode == "comfort":
+                        self.encoder.write_idle(ENC_FRAME_SAMPLES)
+                else:
+                    self.encoder.write(frame)
+            except Exception as e:
+                sys.stderr.write("%s Stream encoder failed: %s\n" % (log_ts.get(), e))
+                self.encoder.close()
+                self.encoder = None
+                if not self.opts.stream_restart:
+                    break
+                self.stats['restarts'] += 1
+                time.sleep(ENC_RESTART_DELAY)
+                continue
+            if frame is None:
+                next_t += ENC_FRAME_SAMPLES / float(PCM_RATE)
+            else:
+                next_t += len(frame) / float(2 * self.channels * PCM_RATE)
+        if self.encoder is not None:
+            self.encoder.close()
+            self.encoder = None
+        self.keep_running = False
+
+    def get_stats(self):
+        with self.lock:
+            d = dict(self.stats)
+            d['queued'] = len(self.frames)
+            if self.gate is not None:
+                d.update(self.gate.get_stats())
+        return d
+
+# Receives op25 udp audio directly when no player in this process listens on the port
+class encoder_audio(socket_audio):
+    def __init__(self, udp_host, udp_port, sink, **kwds):
+        self.sink = sink
+        # one udp stream; socket_audio duplicates it into both channels and the sink downmixes for mono
+        socket_audio.__init__(self, udp_host, udp_port, "stream", False, 1.0, False, "OP25", jitter_buffer = False, **kwds)
+
+    def create_pcm(self, pcm_device):
+        self.pcm = self.sink
+        return pcm_device
+
+class encoder_thread(threading.Thread):
+    def __init__(self, udp_host, udp_port, sink, **kwds):
+        threading.Thread.__init__(self, **kwds)
+        self.daemon = True
+        self.sock_audio = encoder_audio(udp_host, udp_port, sink)
+        self.start()
+
+    def run(self):
+        self.sock_audio.run()
+
+    def stop(self):
+        self.sock_audio.stop()
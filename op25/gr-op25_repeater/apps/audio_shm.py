@@ -0,0 +1,197 @@
+#
+# OP25 Shared Memory Audio Transport
+#
+# This file is part of OP25
+#
+# OP25 is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# OP25 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OP25; see the file COPYING. If not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Boston, MA
+# 02110-1301, USA.
+
+"""
+Reader for the shared memory audio ring written by op25_audio.
+
+A channel whose destination is 'shm://<name>' stores each audio frame and
+flag in /dev/shm/op25-<name> instead of sending a udp datagram (layout in
+lib/op25_audio.h).  Every reader keeps its own position in the ring, so
+any number of consumers can follow one receiver; a reader that falls more
+than a ring length (about 5 seconds) behind loses the oldest frames and
+counts them.  Readers wake up on a short poll interval and take all frames
+written since, rather than making a system call per frame.
+"""
+
+import os
+import sys
+import mmap
+import time
+import threading
+import numpy as np
+from log_ts import log_ts
+from sockaudio import socket_audio
+
+SHM_DIR = "/dev/shm"
+SHM_MAGIC = 0x3532504f
+SHM_VERSION = 2
+SHM_HEADER_SIZE = 128
+SHM_SLOT_DATA = 512
+SHM_BUSY = (1 << 64) - 1
+SHM_POLL = 0.01             # seconds between polls of an idle ring
+
+SLOT_DTYPE = np.dtype([('seq', '<u8'), ('len', '<u4'), ('reserved', '<u4'), ('data', 'u1', SHM_SLOT_DATA)])
+
+def shm_path(name):
+    return os.path.join(SHM_DIR, "op25-%s" % name)
+
+def parse_destination(dest):
+    """Return the ring name of a 'shm://<name>' destination, else None."""
+    if dest.startswith('shm://'):
+        return dest[len('shm://'):]
+    return None
+
+class shm_reader(object):
+    def __init__(self, name, channels = (0,)):
+        self.name = name
+        self.channels = list(channels)
+        self.mm = None
+        self.read_seq = {}
+        self.stats = {'frames': 0, 'lost': 0}
+
+    def attach(self):
+        # the ring is created by the writer; returns False until it exists
+        try:
+            with open(shm_path(self.name), 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError):
+            return False
+        hdr = np.frombuffer(mm, dtype='<u4', count=6)
+        if hdr[0] != SHM_MAGIC or hdr[1] != SHM_VERSION or hdr[4] != SLOT_DTYPE.itemsize:
+            mm.close()
+            return False
+        nchannels, nslots = int(hdr[2]), int(hdr[3])
+        self.mm = mm
+        self.nslots = nslots
+        self.write_seq = np.frombuffer(mm, dtype='<u8', count=nchannels, offset=24)
+        self.slots = np.frombuffer(mm, dtype=SLOT_DTYPE, count=nchannels * nslots, offset=SHM_HEADER_SIZE).reshape(nchannels, nslots)
+        for ch in self.channels:
+            self.read_seq[ch] = int(self.write_seq[ch])     # start with live audio
+        sys.stderr.write("%s Reading audio from shared memory ring %s\n" % (log_ts.get(), shm_path(self.name)))
+        return True
+
+    def close(self):
+        if self.mm is not None:
+            self.write_seq = None
+            self.slots = None
+            self.mm.close()
+            self.mm = None
+
+    def read(self, ch, max_frames = None):
+        """Return the payloads written to channel 'ch' since the last read."""
+        if self.mm is None and not self.attach():
+            return []
+        head = int(self.write_seq[ch])
+        seq = self.read_seq[ch]
+        if head < seq:                      # writer restarted with a new ring
+            seq = head
+        if head - seq > self.nslots:
+            self.stats['lost'] += head - seq - self.nslots
+            seq = head - self.nslots
+        if max_frames is not None:
+            head = min(head, seq + max_frames)
+        out = []
+        slots = self.slots[ch]
+        while seq < head:
+            slot = slots[seq % self.nslots]
+            s1 = int(slot['seq'])
+            if s1 == SHM_BUSY or s1 < seq:      # claimed but not yet published
+                break
+            data = slot['data'][:slot['len']].tobytes()
+            if s1 != seq or slot['seq'] != seq:    # overwritten while copying
+                self.stats['lost'] += 1
+            else:
+                out.append(data)
+            seq += 1
+        self.read_seq[ch] = seq
+        self.stats['frames'] += len(out)
+        return out
+
+    def ready(self, ch):
+        # True if the next frame of channel 'ch' is published (or was already overwritten)
+        seq = self.read_seq[ch]
+        if int(self.write_seq[ch]) == seq:
+            return False
+        s1 = int(self.slots[ch][seq % self.nslots]['seq'])
+        return s1 != SHM_BUSY and s1 >= seq
+
+    def wait(self, timeout):
+        """Block until any channel has frames or the timeout expires."""
+        deadline = time.time() + timeout
+        while True:
+            if self.mm is not None or self.attach():
+                for ch in self.channels:
+                    if self.ready(ch):
+                        return True
+            if time.time() >= deadline:
+                return False
+            time.sleep(SHM_POLL)
+
+    def get_stats(self):
+        return dict(self.stats)
+
+# sockaudio player reading a shared memory ring instead of udp sockets
+class shm_audio(socket_audio):
+    def __init__(self, shm_name, pcm_device, two_channels = False, audio_gain = 1.0, dest_stdout = False, instance_name = "OP25", jitter_buffer = True, **kwds):
+        self.shm_name = shm_name
+        self.pending = ([], [])
+        socket_audio.__init__(self, None, None, pcm_device, two_channels, audio_gain, dest_stdout, instance_name, jitter_buffer, **kwds)
+
+    def setup_sockets(self, udp_host, udp_port):
+        self.reader = shm_reader(self.shm_name, (0, 1))
+        if not self.reader.attach():
+            sys.stderr.write("%s Waiting for shared memory ring %s\n" % (log_ts.get(), shm_path(self.shm_name)))
+
+    def close_sockets(self):
+        self.reader.close()
+
+    def get_ports(self):
+        return []
+
+    def receive(self, timeout):
+        # one payload per channel per call, as a udp player would receive them
+        if not (self.pending[0] or self.pending[1]):
+            if not self.reader.wait(timeout):
+                return None, None
+            self.pending = (self.reader.read(0), self.reader.read(1))
+        in_a = self.pending[0].pop(0) if self.pending[0] else None
+        in_b = self.pending[1].pop(0) if self.pending[1] else None
+        return in_a, in_b
+
+    def get_stats(self):
+        stats = socket_audio.get_stats(self)
+        stats.update(self.reader.get_stats())
+        return stats
+
+class shm_thread(threading.Thread):
+    def __init__(self, shm_name, pcm_device, two_channels = False, audio_gain = 1.0, dest_stdout = False, instance_name = "OP25", jitter_buffer = True, **kwds):
+        threading.Thread.__init__(self)     # kwds are player options, e.g. gate
+        self.daemon = True
+        self.sock_audio = shm_audio(shm_name, pcm_device, two_channels, audio_gain, dest_stdout, instance_name, jitter_buffer, **kwds)
+        self.start()
+
+    def run(self):
+        self.sock_audio.run()
+
+    def stop(self):
+        self.sock_audio.stop()
+
+    def get_stats(self):
+        return self.sock_audio.get_stats()
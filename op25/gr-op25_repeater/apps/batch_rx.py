@@ -0,0 +1,254 @@
+#!/bin/sh
+#
+# OP25 Batch Capture Decoder
+# 
+# This file is part of OP25
+# 
+# OP25 is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+# 
+# OP25 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public
+# License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with OP25; see the file COPYING. If not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Boston, MA
+# 02110-1301, USA.
+
+"true" '''\'
+DEFAULT_PYTHON2=/usr/bin/python
+DEFAULT_PYTHON3=/usr/bin/python3
+if [ -f op25_python ]; then
+    OP25_PYTHON=$(cat op25_python)
+else
+    OP25_PYTHON="/usr/bin/python"
+fi
+
+if [ -x $OP25_PYTHON ]; then
+    echo Using Python $OP25_PYTHON >&2
+    exec $OP25_PYTHON "$0" "$@"
+elif [ -x $DEFAULT_PYTHON2 ]; then
+    echo Using Python $DEFAULT_PYTHON2 >&2
+    exec $DEFAULT_PYTHON2 "$0" "$@"
+elif [ -x $DEFAULT_PYTHON3 ]; then
+    echo Using Python $DEFAULT_PYTHON3 >&2
+    exec $DEFAULT_PYTHON3 "$0" "$@"
+else
+    echo Unable to find Python >&2
+fi
+exit 127
+'''
+
+"""
+Batch decoder for directories of captures.
+
+Each IQ (including DSD format) or raw symbol capture is decoded by its own
+unthrottled multi_rx flowgraph in a pool of worker processes.  Per-file
+call logs, audio and stderr logs are written to the output directory and
+the aggregate throughput is reported at the end of the run.
+
+Example usage:
+./batch_rx.py -c iq_example.json -o decoded -j 4 captures/
+"""
+
+import os
+import sys
+import time
+import json
+import copy
+import threading
+import traceback
+import multiprocessing
+from collections import deque
+from optparse import OptionParser
+from helper_funcs import from_dict
+
+_def_extensions = '.iq,.dsd,.raw,.cfile,.cu8,.cs16,.bin,.sym,.sigmf-meta'
+_def_symbol_extensions = ['.bin', '.sym']
+_def_drain_interval = 0.25      # seconds between call log writes
+_def_queue_drain_timeout = 5.0  # seconds to wait for python to finish pending messages at end of file
+
+def capture_kind(filename):
+    ext = os.path.splitext(filename)[1].lower()
+    return 'symbols' if ext in _def_symbol_extensions else 'iq'
+
+def find_captures(paths, extensions):
+    captures = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                filename = os.path.join(path, name)
+                if os.path.isfile(filename) and os.path.splitext(name)[1].lower() in extensions:
+                    captures.append(filename)
+        elif os.path.isfile(path):
+            captures.append(path)
+        else:
+            sys.stderr.write("Ignoring %s: not a file or directory\n" % path)
+    return captures
+
+def make_config(base, filename, outdir):
+    """
+    Derive a single file multi_rx config from the base config.  The first
+    device is used as the template for the capture; interactive sections
+    (audio, metadata, terminal) and plots are removed and channel audio is
+    redirected to per-file raw pcm output.
+    """
+    kind = capture_kind(filename)
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    cfg = copy.deepcopy(base)
+    for key in ['audio', 'metadata', 'terminal', 'recording']:
+        cfg.pop(key, None)
+
+    dev = cfg['devices'][0]
+    dev['throttle'] = False
+    dev.pop('iq_record', None)
+    if kind == 'iq':
+        dev['args'] = 'iqsrc'
+        dev['iq_file'] = filename
+        dev['iq_seek'] = 0
+    else:
+        dev['args'] = 'symbols'
+    cfg['devices'] = [dev]
+
+    chans = cfg['channels'] if kind == 'iq' else cfg['channels'][:1]  # a symbol capture holds a single channel
+    for idx, chan in enumerate(chans):
+        chan['device'] = dev['name']
+        chan['plot'] = ""
+        chan['destination'] = 'file://%s' % os.path.join(outdir, '%s.ch%d.raw' % (stem, idx))
+        chan.pop('raw_output', None)
+        chan.pop('raw_input', None)
+        if kind == 'symbols':
+            chan['raw_input'] = filename
+            chan['raw_seek'] = 0
+    cfg['channels'] = chans
+    return cfg
+
+def write_calls(tb, f):
+    if tb.trunking is None:
+        return 0
+    calls = json.loads(tb.trunk_rx.get_call_log())['log']
+    for call in calls:
+        f.write(json.dumps(call) + '\n')
+    f.flush()
+    return len(calls)
+
+def decode_file(job):
+    """Pool worker: decode one capture and return its statistics."""
+    filename, cfg, outdir, verbosity = job
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    result = {'file': filename, 'samples': 0, 'rate': 0, 'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'error': None}
+
+    # keep the C++ and python logs of concurrent workers apart
+    log_fd = os.open(os.path.join(outdir, stem + '.log'), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    os.dup2(log_fd, 2)
+
+    try:
+        import multi_rx     # gnuradio is only loaded in the workers
+        tb = multi_rx.rx_block(verbosity, config = cfg)
+        if tb.trunking is not None:
+            tb.trunk_rx.call_log = deque()  # unbounded; drained to disk below
+        done = threading.Event()
+        with open(os.path.join(outdir, stem + '.calls.json'), 'w') as calls_f:
+            def drain():
+                while not done.wait(_def_drain_interval):
+                    result['calls'] += write_calls(tb, calls_f)
+            drainer = threading.Thread(target=drain)
+            drainer.daemon = True
+
+            c0 = time.process_time()
+            t0 = time.time()
+            tb.start()
+            drainer.start()
+            tb.wait()
+            t_end = time.time() + _def_queue_drain_timeout
+            while not tb.rx_q.empty_p() and time.time() < t_end:
+                time.sleep(0.01)
+            result['wall'] = time.time() - t0
+            result['cpu'] = time.process_time() - c0
+            done.set()
+            drainer.join()
+            result['calls'] += write_calls(tb, calls_f)
+
+        if cfg['devices'][0]['args'] == 'iqsrc':
+            result['samples'] = tb.devices[0].src.iqsrc.nitems_written(0)
+            result['rate'] = tb.devices[0].sample_rate
+        else:
+            result['samples'] = tb.channels[0].raw_file.nitems_written(0)
+            result['rate'] = tb.channels[0].symbol_rate
+        tb.kill()
+    except:
+        result['error'] = traceback.format_exc()
+        sys.stderr.write(result['error'])
+    return result
+
+def main():
+    parser = OptionParser(usage="%prog [options] capture_file_or_dir ...")
+    parser.add_option("-c", "--config-file", type="string", default=None, help="multi_rx config file used as template")
+    parser.add_option("-o", "--output-dir", type="string", default="batch-out", help="directory for call logs, audio and logs")
+    parser.add_option("-j", "--jobs", type="int", default=multiprocessing.cpu_count(), help="number of worker processes")
+    parser.add_option("-x", "--extensions", type="string", default=_def_extensions, help="comma separated capture file extensions")
+    parser.add_option("-v", "--verbosity", type="int", default=0, help="message debug level")
+    (options, args) = parser.parse_args()
+
+    if options.config_file is None or len(args) == 0:
+        parser.print_help()
+        exit(1)
+
+    base = json.loads(open(options.config_file, encoding="utf-8-sig").read())
+    captures = find_captures(args, [e.strip().lower() for e in options.extensions.split(',')])
+    if len(captures) == 0:
+        sys.stderr.write("No capture files found\n")
+        exit(1)
+    if not os.path.isdir(options.output_dir):
+        os.makedirs(options.output_dir)
+
+    jobs = [(f, make_config(base, f, options.output_dir), options.output_dir, options.verbosity) for f in captures]
+    nworkers = max(1, min(options.jobs, len(jobs)))
+    sys.stdout.write("Decoding %d captures with %d workers\n" % (len(jobs), nworkers))
+    sys.stdout.write("%-40s %12s %10s %8s %8s %8s %6s\n" % ("file", "samples", "samples/s", "x rt", "wall", "cpu", "calls"))
+
+    # fresh interpreter per file: sample clock and flowgraph state are per process
+    ctx = multiprocessing.get_context('spawn')
+    pool = ctx.Pool(nworkers, maxtasksperchild=1)
+    results = []
+    t0 = time.time()
+    try:
+        for r in pool.imap_unordered(decode_file, jobs):
+            results.append(r)
+            name = os.path.basename(r['file'])
+            if r['error'] is not None:
+                sys.stdout.write("%-40s FAILED (see %s.log)\n" % (name, os.path.splitext(name)[0]))
+                continue
+            sps = r['samples'] / r['wall'] if r['wall'] > 0 else 0
+            xrt = (r['samples'] / float(r['rate'])) / r['wall'] if (r['wall'] > 0 and r['rate'] > 0) else 0
+            sys.stdout.write("%-40s %12d %10.0f %8.1f %8.2f %8.2f %6d\n" % (name, r['samples'], sps, xrt, r['wall'], r['cpu'], r['calls']))
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        sys.stderr.write("Ctrl-C detected\n")
+    pool.join()
+    elapsed = time.time() - t0
+
+    ok = [r for r in results if r['error'] is None]
+    samples = sum([r['samples'] for r in ok])
+    cpu = sum([r['cpu'] for r in ok])
+    summary = {'files': len(jobs),
+               'decoded': len(ok),
+               'failed': len(results) - len(ok),
+               'workers': nworkers,
+               'elapsed': elapsed,
+               'samples': samples,
+               'samples_per_sec': samples / elapsed if elapsed > 0 else 0,
+               'samples_per_cpu_sec': samples / cpu if cpu > 0 else 0,
+               'calls': sum([r['calls'] for r in ok])}
+    with open(os.path.join(options.output_dir, 'batch-summary.json'), 'w') as f:
+        json.dump({'summary': summary, 'results': results}, f, indent=1)
+    sys.stdout.write("Decoded %d of %d captures in %.1f sec: %d samples, %.0f samples/s aggregate (%.0f samples per cpu second), %d calls\n" %
+                     (summary['decoded'], summary['files'], elapsed, samples, summary['samples_per_sec'], summary['samples_per_cpu_sec'], summary['calls']))
+
+if __name__ == "__main__":
+    main()
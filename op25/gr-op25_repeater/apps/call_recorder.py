@@ -0,0 +1,326 @@
+#
+# OP25 Per-call Audio Recorder
+#
+# This file is part of OP25
+#
+# OP25 is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# OP25 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OP25; see the file COPYING. If not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Boston, MA
+# 02110-1301, USA.
+
+"""
+Split each receiver's audio into one recording per call.
+
+Call boundaries come from the trunking module (a receiver tuning to a
+voice call, and the talkgroup expiring); the audio is the receiver's udp
+audio, taken from a local sockaudio player on the same port or received
+directly.  Frames are only collected in memory on the receiving thread;
+completed calls are handed to a pool of writer threads which encode them
+(FLAC or Opus, through the 'soundfile' module or ffmpeg, otherwise WAV)
+and write a JSON sidecar describing the call.
+"""
+
+import sys
+import os
+import time
+import json
+import wave
+import socket
+import select
+import threading
+import subprocess
+import numpy as np
+from log_ts import log_ts
+from helper_funcs import from_dict
+import sample_clock
+from sockaudio import PCM_RATE, MAX_SUPERFRAME_SIZE
+import audio_shm
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+try:
+    from shutil import which
+except ImportError:
+    which = lambda cmd: None
+
+_def_output_dir = "recordings/%Y%m%d"
+_def_format = "flac"
+_def_workers = 2
+_def_queue_len = 64             # completed calls waiting to be written
+_def_min_duration = 0.5         # seconds; shorter calls are discarded
+_def_max_duration = 600.0       # seconds; longer calls are split
+
+FORMATS = {'flac': ('FLAC', 'PCM_16', 'flac'),
+           'opus': ('OGG',  'OPUS',   'libopus'),
+           'wav':  ('WAV',  'PCM_16', None)}
+
+EXTENSIONS = {'flac': '.flac', 'opus': '.opus', 'wav': '.wav'}
+
+class call_segment(object):
+    def __init__(self, ev, rcvrtag):
+        self.ev = ev
+        self.rcvrtag = rcvrtag
+        self.start = ev['time']
+        self.end = None
+        self.end_reason = None
+        self.frames = []
+        self.nsamples = 0
+        self.rids = []
+
+    def add_frame(self, data):
+        self.frames.append(data)
+        self.nsamples += len(data) // 2
+
+    def add_rid(self, rid, rtag, ts):
+        if rid and (len(self.rids) == 0 or self.rids[-1]['rid'] != rid):
+            self.rids.append({'rid': rid, 'rtag': rtag, 'time': ts})
+
+    def duration(self):
+        return float(self.nsamples) / PCM_RATE
+
+    def get_meta(self):
+        return {'sysid':      self.ev['sysid'],
+                'rcvr':       self.ev['rcvr'],
+                'rcvrtag':    self.rcvrtag,
+                'freq':       self.ev['freq'],
+                'slot':       self.ev['slot'],
+                'tgid':       self.ev['tgid'],
+                'tgtag':      self.ev['tgtag'],
+                'rids':       self.rids,
+                'start':      self.start,
+                'end':        self.end,
+                'end_reason': self.end_reason,
+                'duration':   round(self.duration(), 3)}
+
+class call_recorder(object):
+    def __init__(self, config, debug = 0):
+        self.debug = debug
+        self.output_dir = str(from_dict(config, 'output_dir', _def_output_dir))
+        self.format = str(from_dict(config, 'format', _def_format)).lower()
+        if self.format not in FORMATS:
+            sys.stderr.write("%s call recorder: unknown format '%s', using %s\n" % (log_ts.get(), self.format, _def_format))
+            self.format = _def_format
+        self.min_duration = float(from_dict(config, 'min_duration', _def_min_duration))
+        self.max_duration = float(from_dict(config, 'max_duration', _def_max_duration))
+        self.nworkers = max(1, int(from_dict(config, 'workers', _def_workers)))
+        self.encoder = self.select_encoder()
+        self.lock = threading.Lock()
+        self.q = queue.Queue(_def_queue_len)
+        self.channels = {}      # rcvr -> (rcvrtag, host, port)
+        self.ports = {}         # udp port (or 'shm://' destination) -> [rcvr, ...]
+        self.segments = {}      # rcvr -> call_segment being recorded
+        self.socks = {}         # socket -> udp port, for ports without a local player
+        self.shm_readers = {}   # 'shm://' destination -> shm_reader
+        self.workers = []
+        self.listener = None
+        self.keep_running = True
+        self.stats = {'calls': 0, 'discarded': 0, 'dropped': 0, 'failed': 0}
+
+    def select_encoder(self):
+        if self.format == 'wav':
+            return 'wave'
+        fmt, subtype, codec = FORMATS[self.format]
+        if soundfile is not None and subtype in soundfile.available_subtypes(fmt):
+            return 'soundfile'
+        if which("ffmpeg") is not None:
+            return 'ffmpeg'
+        sys.stderr.write("%s call recorder: neither soundfile nor ffmpeg can encode %s, recording WAV\n" % (log_ts.get(), self.format))
+        self.format = 'wav'
+        return 'wave'
+
+    def add_channel(self, rcvr, rcvrtag, host, port):
+        self.channels[rcvr] = (rcvrtag, host, port)
+        self.ports.setdefault(port, []).append(rcvr)
+
+    def start(self, players = []):
+        # share the frames of local players; listen on any other port ourselves
+        local = {}
+        for player in players:
+            for port in player.get_ports():
+                local[port] = player
+        for port in self.ports:
+            shm_name = audio_shm.parse_destination(str(port))
+            if shm_name is not None:    # shared memory rings allow any number of readers
+                self.shm_readers[port] = audio_shm.shm_reader(shm_name)
+                continue
+            if port in local:
+                local[port].add_port_listener(port, lambda data, port=port: self.udp_frame(port, data))
+                continue
+            host = self.channels[self.ports[port][0]][1]
+            try:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.bind((host, port))
+                self.socks[sock] = port
+            except socket.error as e:
+                sys.stderr.write("%s call recorder: unable to listen on %s:%d: %s\n" % (log_ts.get(), host, port, e))
+        if self.socks or self.shm_readers:
+            self.listener = threading.Thread(target=self.listen_thread)
+            self.listener.daemon = True
+            self.listener.start()
+        for i in range(self.nworkers):
+            t = threading.Thread(target=self.write_thread)
+            t.daemon = True
+            t.start()
+            self.workers.append(t)
+        sys.stderr.write("%s Recording calls of %d channel(s) to %s (%s, %s)\n" % (log_ts.get(), len(self.channels), self.output_dir, self.format, self.encoder))
+
+    def stop(self):
+        self.keep_running = False
+        with self.lock:
+            for rcvr in list(self.segments):
+                self.close_segment(rcvr, sample_clock.time(), "shutdown")
+        for t in self.workers:
+            self.q.put(None)
+        for t in self.workers:
+            t.join()
+        self.workers = []
+        if self.listener is not None:
+            self.listener.join()
+            self.listener = None
+
+    def listen_thread(self):
+        socks = list(self.socks)
+        timeout = audio_shm.SHM_POLL if self.shm_readers else 1.0
+        while self.keep_running:
+            if socks:
+                readable, _, _ = select.select(socks, [], [], timeout)
+            else:
+                readable = []
+                time.sleep(timeout)
+            for sock in readable:
+                self.udp_frame(self.socks[sock], sock.recv(MAX_SUPERFRAME_SIZE))
+            for dest in self.shm_readers:
+                for data in self.shm_readers[dest].read(0):
+                    self.udp_frame(dest, data)
+        for sock in socks:
+            sock.close()
+        for dest in self.shm_readers:
+            self.shm_readers[dest].close()
+
+    def udp_frame(self, port, data):
+        if len(data) <= 2:      # drain/drop flags; call boundaries come from trunking
+            return
+        with self.lock:
+            latest = None
+            for rcvr in self.ports.get(port, []):
+                seg = self.segments.get(rcvr)
+                if seg is not None and (latest is None or seg.start > latest.start):
+                    latest = seg        # receivers sharing a port: credit the most recent call
+            if latest is None:
+                return
+            latest.add_frame(data)
+            if latest.duration() >= self.max_duration:
+                rcvr = latest.ev['rcvr']
+                self.close_segment(rcvr, sample_clock.time(), "split")
+                ev = dict(latest.ev)
+                ev['time'] = sample_clock.time()
+                self.segments[rcvr] = call_segment(ev, latest.rcvrtag)
+
+    def call_event(self, ev):
+        # called on the trunking thread; no file i/o here
+        rcvr = ev['rcvr']
+        if rcvr not in self.channels:
+            return
+        with self.lock:
+            if rcvr in self.segments:
+                self.close_segment(rcvr, ev['time'], ev['reason'] if ev['event'] == "end" else "new call")
+            if ev['event'] == "start" and self.keep_running:
+                self.segments[rcvr] = call_segment(ev, self.channels[rcvr][0])
+
+    def call_entry(self, entry):
+        # call log entries carry the source radio id
+        with self.lock:
+            seg = self.segments.get(entry['rcvr'])
+            if seg is not None and seg.ev['tgid'] == entry['tgid']:
+                seg.add_rid(entry['rid'], entry['rtag'], entry['time'])
+
+    def close_segment(self, rcvr, ts, reason):      # lock must be held
+        seg = self.segments.pop(rcvr)
+        seg.end = ts
+        seg.end_reason = reason
+        if seg.duration() < self.min_duration:
+            self.stats['discarded'] += 1
+            return
+        try:
+            self.q.put_nowait(seg)
+            self.stats['calls'] += 1
+        except queue.Full:
+            self.stats['dropped'] += 1
+            sys.stderr.write("%s call recorder: writers behind, dropped call tgid %d on rcvr %d\n" % (log_ts.get(), seg.ev['tgid'], rcvr))
+
+    def write_thread(self):
+        while True:
+            seg = self.q.get()
+            if seg is None:
+                break
+            try:
+                self.write_segment(seg)
+            except Exception as e:
+                self.stats['failed'] += 1
+                sys.stderr.write("%s call recorder: unable to write call tgid %d: %s\n" % (log_ts.get(), seg.ev['tgid'], e))
+
+    def write_segment(self, seg):
+        path = time.strftime(self.output_dir, time.localtime(seg.start))
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError:     # created by another writer
+                if not os.path.isdir(path):
+                    raise
+        base = os.path.join(path, "tgid-%d-%s-%03d-rx%d" % (seg.ev['tgid'], time.strftime("%Y%m%d-%H%M%S", time.localtime(seg.start)), int((seg.start % 1) * 1000), seg.ev['rcvr']))
+        filename = base + EXTENSIONS[self.format]
+        pcm = np.frombuffer(b''.join(seg.frames), dtype=np.int16)
+        self.encode(filename, pcm)
+        meta = seg.get_meta()
+        meta['audio'] = os.path.basename(filename)
+        meta['format'] = self.format
+        tmp = base + '.json.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(meta, f, indent=4, sort_keys=True)
+        os.rename(tmp, base + '.json')
+        if self.debug >= 5:
+            sys.stderr.write("%s [%d] call recorded: %s (%.1f sec)\n" % (log_ts.get(), seg.ev['rcvr'], filename, seg.duration()))
+
+    def encode(self, filename, pcm):
+        fmt, subtype, codec = FORMATS[self.format]
+        if self.encoder == 'soundfile':
+            soundfile.write(filename, pcm, PCM_RATE, format=fmt, subtype=subtype)
+        elif self.encoder == 'ffmpeg':
+            proc = subprocess.Popen(["ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+                                     "-f", "s16le", "-ar", str(PCM_RATE), "-ac", "1", "-i", "pipe:0",
+                                     "-c:a", codec, filename], stdin=subprocess.PIPE)
+            proc.communicate(pcm.tobytes())
+            if proc.returncode != 0:
+                raise IOError("ffmpeg exited with status %d" % proc.returncode)
+        else:
+            w = wave.open(filename, 'wb')
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(PCM_RATE)
+            w.writeframes(pcm.tobytes())
+            w.close()
+
+    def get_stats(self):
+        with self.lock:
+            d = dict(self.stats)
+            d['active'] = len(self.segments)
+        d['queued'] = self.q.qsize()
+        return d
@@ -0,0 +1,358 @@
+#
+# OP25 Device Worker Processes
+#
+# This file is part of OP25
+#
+# OP25 is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# OP25 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OP25; see the file COPYING. If not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Boston, MA
+# 02110-1301, USA.
+
+"""
+Process-per-device support for multi_rx.
+
+With 'device_processes' enabled each device, together with its channels,
+runs its flowgraph in a worker process of its own.  Decoder (rx_q) and plot
+(ui) messages are forwarded over a local pipe to the controlling process,
+which runs trunking, metadata, audio and the terminal; channel commands
+(tuning, frame assembler control, plots) travel back the other way.
+
+Every command is acknowledged by the worker so that the control latency
+can be measured and reported.  The acknowledgement carries the return
+value of the channel method; tuning waits for it so that trunking learns
+when a worker could not tune its channel.
+"""
+
+import sys
+import time
+import threading
+import traceback
+import collections
+import multiprocessing
+from gnuradio import gr
+from helper_funcs import from_dict
+from log_ts import log_ts
+
+_def_status_interval = 1.0     # seconds between worker status updates
+_def_report_interval = 60.0    # seconds between latency reports
+_def_reply_timeout = 1.0       # seconds to wait for the result of a tune command
+
+# channel methods a controller may invoke in a worker
+WORKER_COMMANDS = ['tune', 'control', 'set_rate', 'toggle_plot', 'close_plots', 'adj_tune',
+                   'toggle_capture', 'set_debug', 'nbfm_control', 'dump_buffer', 'annotate_call']
+
+def pack_msg(msg):
+    return (msg.to_string(), msg.type(), msg.arg1(), msg.arg2())
+
+def unpack_msg(t):
+    return gr.message().make_from_string(t[0], t[1], t[2], t[3])
+
+class latency_stats(object):
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, latency):
+        self.count += 1
+        self.total += latency
+        if latency > self.max:
+            self.max = latency
+
+    def to_string(self):
+        if self.count == 0:
+            return "n=0"
+        return "n=%d avg=%.2fms max=%.2fms" % (self.count, 1000.0 * self.total / self.count, 1000.0 * self.max)
+
+class remote_channel(object):
+    """Controller side stand-in for a channel running in a device worker"""
+    def __init__(self, worker, msgq_id, config):
+        self.worker = worker
+        self.msgq_id = msgq_id
+        self.config = config
+        self.name = str(from_dict(config, 'name', ""))
+        self.frequency = int(from_dict(config, 'frequency', 0))
+        self.verbosity = worker.verbosity
+        self.status = {'ppm': 0.0, 'capture': False, 'error': None, 'plots': [], 'overruns': 0}
+
+    def tune(self, params):
+        result = self.worker.request(self.msgq_id, 'tune', params)
+        if result is None:      # no reply in time; assume the channel tuned
+            return True
+        return bool(result)
+
+    def control(self, params):
+        self.worker.call(self.msgq_id, 'control', params)
+
+    def set_rate(self, rate):
+        self.worker.call(self.msgq_id, 'set_rate', rate)
+
+    def toggle_plot(self, plot_type):
+        self.worker.call(self.msgq_id, 'toggle_plot', plot_type)
+
+    def close_plots(self):
+        self.worker.call(self.msgq_id, 'close_plots')
+
+    def adj_tune(self, adjustment):
+        self.worker.call(self.msgq_id, 'adj_tune', adjustment)
+
+    def toggle_capture(self):
+        self.worker.call(self.msgq_id, 'toggle_capture')
+
+    def set_debug(self, dbglvl):
+        self.verbosity = dbglvl
+        self.worker.call(self.msgq_id, 'set_debug', dbglvl)
+
+    def nbfm_control(self, action):
+        self.worker.call(self.msgq_id, 'nbfm_control', action)
+
+    def dump_buffer(self):
+        self.worker.call(self.msgq_id, 'dump_buffer')
+
+    def annotate_call(self, entry):
+        if self.worker.recording:
+            self.worker.call(self.msgq_id, 'annotate_call', entry)
+
+    def error_tracking(self):
+        pass            # performed by the worker and returned with its status
+
+    def get_error(self):
+        return self.status['error']
+
+    def get_ppm(self):
+        return self.status['ppm']
+
+    def is_capturing(self):
+        return self.status['capture']
+
+    def get_overruns(self):
+        return self.status['overruns']
+
+    def get_plot_files(self):
+        return self.status['plots']
+
+    def kill(self):
+        pass
+
+class device_worker(threading.Thread):
+    """Starts a device worker process and relays its messages to the controller queues"""
+    def __init__(self, dev_config, chan_configs, config, verbosity, rx_q, ui_in_q):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.name = str(dev_config['name'])
+        self.verbosity = verbosity
+        self.recording = str(from_dict(dev_config, 'iq_record', "")) != ""
+        self.rx_q = rx_q
+        self.ui_in_q = ui_in_q
+        self.channels = {}
+        self.seq = 0
+        self.replies = {}               # seq -> [event, result] of requests awaiting their ack
+        self.backlog = collections.deque()
+        self.send_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.msg_latency = latency_stats()
+        self.cmd_latency = latency_stats()
+        self.rtt_latency = latency_stats()
+        self.report_interval = float(from_dict(config, 'device_process_report', _def_report_interval))
+        self.next_report = time.time() + self.report_interval
+        self.keep_running = True
+
+        ctx = multiprocessing.get_context('spawn')
+        self.conn, child_conn = ctx.Pipe()
+        self.proc = ctx.Process(target=worker_main,
+                                name="op25-%s" % self.name,
+                                args=(child_conn, dev_config, chan_configs, config.get('terminal'), str(from_dict(config, 'tap_cache', "")), verbosity))
+        self.proc.daemon = True
+        self.proc.start()
+        child_conn.close()
+        sys.stderr.write("%s [%s] device worker started (pid %d) with %d channels\n" % (log_ts.get(), self.name, self.proc.pid, len(chan_configs)))
+        self.start()
+
+    def add_channel(self, msgq_id, config):
+        self.channels[msgq_id] = remote_channel(self, msgq_id, config)
+        return self.channels[msgq_id]
+
+    def call(self, msgq_id, method, *args):
+        with self.send_lock:
+            self.seq += 1
+            try:
+                self.conn.send(('call', self.seq, time.time(), msgq_id, method, args))
+            except (IOError, OSError, EOFError):
+                sys.stderr.write("%s [%s] device worker unavailable, dropping %s command\n" % (log_ts.get(), self.name, method))
+
+    def request(self, msgq_id, method, *args):
+        # like call(), but waits for the return value; None if the worker did not answer in time
+        reply = [threading.Event(), None]
+        with self.send_lock:
+            self.seq += 1
+            seq = self.seq
+            self.replies[seq] = reply
+            try:
+                self.conn.send(('call', seq, time.time(), msgq_id, method, args))
+            except (IOError, OSError, EOFError):
+                sys.stderr.write("%s [%s] device worker unavailable, dropping %s command\n" % (log_ts.get(), self.name, method))
+                del self.replies[seq]
+                return None
+        if not reply[0].wait(_def_reply_timeout):
+            sys.stderr.write("%s [%s] device worker did not answer %s command within %.1f sec\n" % (log_ts.get(), self.name, method, _def_reply_timeout))
+        with self.send_lock:
+            self.replies.pop(seq, None)
+        return reply[1]
+
+    def forward_rx(self):
+        # the thread waiting for a reply may be the one draining rx_q; messages that do not fit
+        # stay in the backlog for the next pass of run() instead of blocking this thread
+        while self.backlog and not self.rx_q.full_p():
+            self.rx_q.insert_tail(self.backlog.popleft())
+
+    def run(self):
+        while self.keep_running:
+            try:
+                if self.backlog and not self.conn.poll(0.05):  # held back messages go on once trunking catches up
+                    self.forward_rx()
+                    continue
+                m = self.conn.recv()
+            except (EOFError, IOError, OSError):
+                if self.keep_running:
+                    sys.stderr.write("%s [%s] device worker exited\n" % (log_ts.get(), self.name))
+                break
+            now = time.time()
+            if m[0] == 'rx':
+                msg = unpack_msg(m[1])
+                ts = msg.arg2()
+                if ts > 0:
+                    with self.stats_lock:
+                        self.msg_latency.add(now - ts)
+                self.backlog.append(msg)
+            elif m[0] == 'ui':
+                if not self.ui_in_q.full_p():
+                    self.ui_in_q.insert_tail(unpack_msg(m[1]))
+            elif m[0] == 'ack':
+                seq, t_sent, t_applied, result = m[1:]
+                with self.stats_lock:
+                    self.cmd_latency.add(t_applied - t_sent)
+                    self.rtt_latency.add(now - t_sent)
+                with self.send_lock:
+                    reply = self.replies.get(seq)
+                if reply is not None:
+                    reply[1] = result
+                    reply[0].set()
+            elif m[0] == 'status':
+                for msgq_id in m[1]:
+                    if msgq_id in self.channels:
+                        self.channels[msgq_id].status = m[1][msgq_id]
+            self.forward_rx()
+            if now >= self.next_report:
+                self.report()
+                self.next_report = now + self.report_interval
+
+    def get_stats(self):
+        with self.stats_lock:
+            return {'messages': self.msg_latency.to_string(),
+                    'commands': self.cmd_latency.to_string(),
+                    'round_trip': self.rtt_latency.to_string()}
+
+    def report(self):
+        with self.stats_lock:
+            sys.stderr.write("%s [%s] device worker latency: messages %s; commands %s; round trip %s\n" % (log_ts.get(), self.name, self.msg_latency.to_string(), self.cmd_latency.to_string(), self.rtt_latency.to_string()))
+            self.msg_latency.reset()
+            self.cmd_latency.reset()
+            self.rtt_latency.reset()
+
+    def stop(self):
+        if not self.keep_running:
+            return
+        self.keep_running = False
+        with self.send_lock:
+            try:
+                self.conn.send(('quit',))
+            except (IOError, OSError, EOFError):
+                pass
+        self.proc.join(5.0)
+        if self.proc.is_alive():
+            self.proc.terminate()
+
+def worker_main(conn, dev_config, chan_configs, terminal_config, tap_cache_file, verbosity):
+    """Entry point of a device worker process"""
+    import multi_rx     # deferred: the worker starts from a fresh interpreter
+    import tap_cache
+
+    send_lock = threading.Lock()
+    def send(m):
+        with send_lock:
+            conn.send(m)
+
+    try:
+        if tap_cache_file != "":
+            tap_cache.load(tap_cache_file)
+        tb = multi_rx.device_block(verbosity, dev_config, chan_configs, terminal_config)
+        tap_cache.save()
+    except:
+        sys.stderr.write("%s [%s] device worker failed to start:\n%s\n" % (log_ts.get(), dev_config['name'], traceback.format_exc()))
+        return
+
+    def forward(q, kind):
+        while True:
+            msg = q.delete_head()
+            if kind == 'rx':
+                tb.ring_check(msg)      # ring triggers are handled where the symbols are
+            try:
+                send((kind, pack_msg(msg)))
+            except (IOError, OSError, EOFError):
+                return
+
+    def status():
+        while True:
+            time.sleep(_def_status_interval)
+            d = {}
+            tb.device.check_overruns(time.time())
+            for chan in tb.channels:
+                chan.error_tracking()
+                d[chan.msgq_id] = {'ppm': chan.get_ppm(), 'capture': chan.is_capturing(), 'error': chan.get_error(), 'plots': chan.get_plot_files(), 'overruns': chan.get_overruns()}
+            try:
+                send(('status', d))
+            except (IOError, OSError, EOFError):
+                return
+
+    for target, args in [(forward, (tb.rx_q, 'rx')), (forward, (tb.ui_in_q, 'ui')), (status, ())]:
+        t = threading.Thread(target=target, args=args)
+        t.daemon = True
+        t.start()
+
+    tb.start()
+    while True:
+        try:
+            m = conn.recv()
+        except (EOFError, IOError, OSError):
+            break
+        if m[0] == 'quit':
+            break
+        elif m[0] == 'call':
+            seq, t_sent, msgq_id, method, args = m[1:]
+            result = None
+            if method in WORKER_COMMANDS and msgq_id in tb.channel_by_id:
+                try:
+                    result = getattr(tb.find_channel(msgq_id), method)(*args)
+                except:
+                    sys.stderr.write("%s [%s] device worker command %s failed:\n%s\n" % (log_ts.get(), dev_config['name'], method, traceback.format_exc()))
+            if not isinstance(result, (bool, int, float, str)):
+                result = None
+            try:
+                send(('ack', seq, t_sent, time.time(), result))
+            except (IOError, OSError, EOFError):
+                break
+    tb.stop()
+    tb.wait()
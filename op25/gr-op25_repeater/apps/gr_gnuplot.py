@@ -20,6 +20,7 @@
 import sys
 import os
 import time
+import threading
 import subprocess
 import json
 
@@ -44,6 +45,35 @@ BAL_AVG  = 0.05
 FFT_BINS = 512    # number of fft bins
 FFT_FREQ = 0.05   # time interval between fft updates
 MIX_FREQ = 0.02   # time interval between mixer updates
+EYE_FREQ = 0.10   # time interval between datascope snapshot polls
+EYE_DECIM = 20    # datascope keeps one frame in EYE_DECIM
+SNAP_FREQ = 0.10  # time interval between constellation/symbol snapshot polls
+
+COMPLEX_MODES = ('constellation', 'fft', 'mixer', 'fll')
+
+class plot_ring(object):
+    """
+    Preallocated sample buffer used to assemble plot frames.  Incoming
+    samples are copied in by slice assignment and the write index wraps
+    back to the start once a complete frame has been consumed, so frame
+    assembly never allocates.
+    """
+    def __init__(self, size, dtype):
+        self.size = int(size)
+        self.data = np.zeros(self.size, dtype=dtype)
+        self.count = 0
+
+    def fill(self, buf):
+        n = min(len(buf), self.size - self.count)
+        self.data[self.count:self.count + n] = buf[:n]
+        self.count += n
+        return n
+
+    def full(self):
+        return self.count >= self.size
+
+    def reset(self):
+        self.count = 0
 
 class wrap_gp(object):
     def __init__(self, sps=_def_sps, plot_name="", chan = 0, out_q = None):
@@ -56,7 +86,8 @@ class wrap_gp(object):
         self.freqs = ()
         self.avg_pwr = np.zeros(FFT_BINS)
         self.min_y = -100.0
-        self.buf = []
+        self.rings = {}
+        self.windows = {}
         self.plot_count = 0
         self.last_plot = 0
         self.plot_interval = None
@@ -104,82 +135,86 @@ class wrap_gp(object):
     def set_output_dir(self, v):
         self.output_dir = v
 
+    def get_ring(self, mode, bufsz):
+        ring = self.rings.get(mode)
+        if ring is None or ring.size != bufsz:
+            ring = plot_ring(bufsz, np.complex64 if mode in COMPLEX_MODES else np.float32)
+            self.rings[mode] = ring
+        return ring
+
+    def get_window(self, bufsz):
+        if bufsz not in self.windows:
+            self.windows[bufsz] = np.blackman(bufsz)
+        return self.windows[bufsz]
+
     def plot(self, buf, bufsz, mode='eye'):
         BUFSZ = bufsz
-        consumed = min(len(buf), BUFSZ-len(self.buf))
-        if len(self.buf) < BUFSZ:
-            self.buf = np.concatenate((self.buf, buf[:int(consumed)]))
-        if len(self.buf) < BUFSZ:
+        ring = self.get_ring(mode, BUFSZ)
+        consumed = ring.fill(buf)
+        if not ring.full():
             return consumed
+        frame = ring.data   # view of the completed frame; only valid until the next fill()
+        ring.reset()
 
         self.plot_count += 1
-        if mode == 'eye' and self.plot_count % 20 != 0:
-            self.buf = np.array([])
-            return consumed
 
         plot_data = { "json_type": "plot", "chan": self.chan, "mode": mode, "data": [] }
         plots = []
         s = ''
-        while(len(self.buf)):
-            if mode == 'eye':
-                if len(self.buf) < self.sps:
-                    break
+        if mode == 'eye':
+            for start in range(0, BUFSZ - self.sps + 1, self.sps):
+                trace = frame[start:start + self.sps]
                 for i in range(self.sps):
-                    s += '%f\n' % self.buf[i]
-                    plot_data['data'].append( (i, self.buf[i]) )
-                s += 'e\n'
-                self.buf=self.buf[self.sps:]
-                plots.append('"-" with lines')
-            elif mode == 'constellation':
-                for b in self.buf:
-                    s += '%f\t%f\n' % (b.real, b.imag)
-                    plot_data['data'].append( (b.real, b.imag) )
+                    s += '%f\n' % trace[i]
+                    plot_data['data'].append( (i, float(trace[i])) )
                 s += 'e\n'
-                self.buf = []
-                plots.append('"-" with points')
-            elif mode == 'symbol':
-                idx = 0
-                for b in self.buf:
-                    s += '%f\n' % (b)
-                    plot_data['data'].append( (idx, b) )
-                    idx += 1
-                s += 'e\n'
-                self.buf = []
-                plots.append('"-" with points')
-            elif mode == 'fft' or mode == 'mixer' or mode == 'fll':
-                sum_pwr = 0.0
-                self.ffts = np.fft.fft((self.buf * np.blackman(BUFSZ)), BUFSZ , 0) / (0.42 * BUFSZ)
-                self.ffts = np.fft.fftshift(self.ffts)
-                self.freqs = np.fft.fftfreq(len(self.ffts))
-                self.freqs = np.fft.fftshift(self.freqs)
-                tune_freq = (self.center_freq - self.relative_freq) / 1e6
-                if self.center_freq and self.width:
-                                    self.freqs = ((self.freqs * self.width) + self.center_freq + self.offset_freq) / 1e6
-                elif self.width:
-                                    self.freqs = (self.freqs * self.width)
-                for i in range(len(self.ffts)):
-                    if mode == 'fft':
-                        self.avg_pwr[i] = ((1.0 - FFT_AVG) * self.avg_pwr[i]) + (FFT_AVG * np.abs(self.ffts[i]))
-                    else:
-                        self.avg_pwr[i] = ((1.0 - MIX_AVG) * self.avg_pwr[i]) + (MIX_AVG * np.abs(self.ffts[i]))
-                    if self.avg_pwr[i] == 0: # guard against divide by zero
-                        break
-                    y_val = 20 * np.log10(self.avg_pwr[i])
-                    s += '%f\t%f\n' % (self.freqs[i], y_val)
-                    plot_data['data'].append( (self.freqs[i], y_val) )
-                    if ((mode == 'mixer') or (mode == 'fll')) and (self.avg_pwr[i] > 1e-5):
-                        if (self.freqs[i] - self.center_freq) < 0:
-                            sum_pwr -= self.avg_pwr[i]
-                        elif (self.freqs[i] - self.center_freq) > 0:
-                            sum_pwr += self.avg_pwr[i]
-                s += 'e\n'
-                self.buf = []
                 plots.append('"-" with lines')
-                if min(self.avg_pwr) == 0: # plot is broken, probably because source device was missing
-                    return consumed
-                min_y = 20 * np.log10(min(self.avg_pwr))
-                self.min_y = ((1.0 - Y_AVG) * self.min_y) + (Y_AVG * min_y) 
-        self.buf = []
+        elif mode == 'constellation':
+            for b in frame:
+                s += '%f\t%f\n' % (b.real, b.imag)
+                plot_data['data'].append( (float(b.real), float(b.imag)) )
+            s += 'e\n'
+            plots.append('"-" with points')
+        elif mode == 'symbol':
+            idx = 0
+            for b in frame:
+                s += '%f\n' % (b)
+                plot_data['data'].append( (idx, float(b)) )
+                idx += 1
+            s += 'e\n'
+            plots.append('"-" with points')
+        elif mode == 'fft' or mode == 'mixer' or mode == 'fll':
+            sum_pwr = 0.0
+            self.ffts = np.fft.fft((frame * self.get_window(BUFSZ)), BUFSZ , 0) / (0.42 * BUFSZ)
+            self.ffts = np.fft.fftshift(self.ffts)
+            self.freqs = np.fft.fftfreq(len(self.ffts))
+            self.freqs = np.fft.fftshift(self.freqs)
+            tune_freq = (self.center_freq - self.relative_freq) / 1e6
+            if self.center_freq and self.width:
+                                self.freqs = ((self.freqs * self.width) + self.center_freq + self.offset_freq) / 1e6
+            elif self.width:
+                                self.freqs = (self.freqs * self.width)
+            for i in range(len(self.ffts)):
+                if mode == 'fft':
+                    self.avg_pwr[i] = ((1.0 - FFT_AVG) * self.avg_pwr[i]) + (FFT_AVG * np.abs(self.ffts[i]))
+                else:
+                    self.avg_pwr[i] = ((1.0 - MIX_AVG) * self.avg_pwr[i]) + (MIX_AVG * np.abs(self.ffts[i]))
+                if self.avg_pwr[i] == 0: # guard against divide by zero
+                    break
+                y_val = 20 * np.log10(self.avg_pwr[i])
+                s += '%f\t%f\n' % (self.freqs[i], y_val)
+                plot_data['data'].append( (self.freqs[i], y_val) )
+                if ((mode == 'mixer') or (mode == 'fll')) and (self.avg_pwr[i] > 1e-5):
+                    if (self.freqs[i] - self.center_freq) < 0:
+                        sum_pwr -= self.avg_pwr[i]
+                    elif (self.freqs[i] - self.center_freq) > 0:
+                        sum_pwr += self.avg_pwr[i]
+            s += 'e\n'
+            plots.append('"-" with lines')
+            if min(self.avg_pwr) == 0: # plot is broken, probably because source device was missing
+                return consumed
+            min_y = 20 * np.log10(min(self.avg_pwr))
+            self.min_y = ((1.0 - Y_AVG) * self.min_y) + (Y_AVG * min_y) 
 
         # FFT processing needs to be completed to maintain the weighted average buckets
         # regardless of whether we actually produce a new plot or not.
@@ -281,70 +316,120 @@ class wrap_gp(object):
     def set_width(self, w):
         self.width = w
 
-class eye_sink_f(gr.sync_block):
+
+class snapshot_probe(gr.hier_block2):
+    """
+    Decimating snapshot tap.  Groups the input stream into vectors of
+    'vlen' contiguous samples and retains one vector in every 'decim',
+    entirely within the GNU Radio scheduler.  The most recent vector is
+    held by a probe block and fetched on demand by snapshot().
+    """
+    def __init__(self, itemsize, vlen, decim = 1):
+        gr.hier_block2.__init__(self, "snapshot_probe",
+                                gr.io_signature(1, 1, itemsize),  # Input signature
+                                gr.io_signature(0, 0, 0))         # Output signature
+        self.itemsize = itemsize
+        self.decim = max(1, int(decim))
+        self.dtype = np.complex64 if itemsize == gr.sizeof_gr_complex else np.float32
+        self.build(vlen)
+
+    def build(self, vlen):
+        self.vlen = vlen
+        self.s2v = blocks.stream_to_vector(self.itemsize, vlen)
+        self.keep = blocks.keep_one_in_n(self.itemsize * vlen, self.decim)
+        if self.itemsize == gr.sizeof_gr_complex:
+            self.probe = blocks.probe_signal_vc(vlen)
+        else:
+            self.probe = blocks.probe_signal_vf(vlen)
+        self.connect(self, self.s2v, self.keep, self.probe)
+
+    def set_vlen(self, vlen):
+        # the vector length is fixed when the blocks are made; rebuild them
+        if vlen == self.vlen:
+            return
+        self.lock()
+        self.disconnect_all()
+        self.build(vlen)
+        self.unlock()
+
+    def set_decim(self, decim):
+        self.decim = max(1, int(decim))
+        self.keep.set_n(self.decim)
+
+    def snapshot(self):
+        return np.array(self.probe.level(), dtype=self.dtype)
+
+class plot_sink_base(gr.hier_block2):
+    """
+    Common base for the plot sinks.  Samples never pass through python;
+    instead a low priority thread polls the snapshot probe at plot rate
+    and hands each new snapshot to gnuplot.
+    """
+    def __init__(self, name, itemsize, bufsz, mode, interval, decim = 1, sps = _def_sps, plot_name = "", chan = 0, out_q = None):
+        gr.hier_block2.__init__(self, name,
+                                gr.io_signature(1, 1, itemsize),  # Input signature
+                                gr.io_signature(0, 0, 0))         # Output signature
+        self.bufsz = bufsz
+        self.mode = mode
+        self.interval = interval
+        self.tap = snapshot_probe(itemsize, bufsz, decim)
+        self.connect(self, self.tap)
+        self.gnuplot = wrap_gp(sps=sps, plot_name=plot_name, chan=chan, out_q=out_q)
+        self.keep_running = True
+        self.poller = threading.Thread(target=self.poll, name=name)
+        self.poller.daemon = True
+        self.poller.start()
+
+    def poll(self):
+        last = None
+        while self.keep_running:
+            time.sleep(self.interval)
+            buf = self.tap.snapshot()
+            if len(buf) < self.bufsz or (last is not None and np.array_equal(buf, last)):
+                continue    # probe not yet filled, or no new data since last poll
+            last = buf
+            self.gnuplot.plot(buf, self.bufsz, mode=self.mode)
+
+    def set_decim(self, decim):
+        self.tap.set_decim(decim)
+
+    def set_bufsz(self, bufsz):
+        self.tap.set_vlen(bufsz)
+        self.bufsz = bufsz
+
+    def kill(self):
+        self.keep_running = False
+        self.gnuplot.kill()
+
+class eye_sink_f(plot_sink_base):
     """
     """
     def __init__(self, debug = _def_debug, sps = _def_sps, plot_name = "", chan = 0, out_q = None):
-        gr.sync_block.__init__(self,
-            name="eye_sink_f",
-            in_sig=[np.float32],
-            out_sig=None)
         self.debug = debug
-        self.sps = sps * _def_sps_mult
-        self.gnuplot = wrap_gp(sps=self.sps, plot_name=plot_name, chan=chan, out_q=out_q)
+        self.sps = int(sps * _def_sps_mult)
+        plot_sink_base.__init__(self, "eye_sink_f", gr.sizeof_float, 100 * self.sps, 'eye', EYE_FREQ,
+                                decim=EYE_DECIM, sps=self.sps, plot_name=plot_name, chan=chan, out_q=out_q)
 
     def set_sps(self, sps):
-        self.sps = sps * _def_sps_mult
+        self.sps = int(sps * _def_sps_mult)
         self.gnuplot.set_sps(self.sps)
+        self.set_bufsz(100 * self.sps)      # 100 symbols per snapshot, as before
 
-    def work(self, input_items, output_items):
-        in0 = input_items[0]
-        self.gnuplot.plot(in0, 100 * self.sps, mode='eye')
-        return len(input_items[0])
-
-    def kill(self):
-        self.gnuplot.kill()
-
-class constellation_sink_c(gr.sync_block):
+class constellation_sink_c(plot_sink_base):
     """
     """
     def __init__(self, debug = _def_debug, plot_name = "", chan = 0, out_q = None):
-        gr.sync_block.__init__(self,
-            name="constellation_sink_c",
-            in_sig=[np.complex64],
-            out_sig=None)
         self.debug = debug
-        self.gnuplot = wrap_gp(plot_name=plot_name, chan=chan, out_q=out_q)
-
-    def work(self, input_items, output_items):
-        in0 = input_items[0]
-        self.gnuplot.plot(in0, 1000, mode='constellation')
-        return len(input_items[0])
+        plot_sink_base.__init__(self, "constellation_sink_c", gr.sizeof_gr_complex, 1000, 'constellation', SNAP_FREQ,
+                                plot_name=plot_name, chan=chan, out_q=out_q)
 
-    def kill(self):
-        self.gnuplot.kill()
-
-class fft_sink_c(gr.sync_block):
+class fft_sink_c(plot_sink_base):
     """
     """
     def __init__(self, debug = _def_debug, plot_name = "", chan = 0, out_q = None):
-        gr.sync_block.__init__(self,
-            name="fft_sink_c",
-            in_sig=[np.complex64],
-            out_sig=None)
         self.debug = debug
-        self.gnuplot = wrap_gp(plot_name=plot_name, chan=chan, out_q=out_q)
-        self.next_due = time.time()
-
-    def work(self, input_items, output_items):
-        if time.time() > self.next_due:
-            self.next_due = time.time() + FFT_FREQ
-            in0 = input_items[0]
-            self.gnuplot.plot(in0, FFT_BINS, mode='fft')
-        return len(input_items[0])
-
-    def kill(self):
-        self.gnuplot.kill()
+        plot_sink_base.__init__(self, "fft_sink_c", gr.sizeof_gr_complex, FFT_BINS, 'fft', FFT_FREQ,
+                                plot_name=plot_name, chan=chan, out_q=out_q)
 
     def set_center_freq(self, f):
         self.gnuplot.set_center_freq(f)
@@ -358,72 +443,36 @@ class fft_sink_c(gr.sync_block):
 
     def set_width(self, w):
         self.gnuplot.set_width(w)
+        self.set_decim((w * FFT_FREQ) // FFT_BINS)    # one snapshot per update interval
 
-class mixer_sink_c(gr.sync_block):
+class mixer_sink_c(plot_sink_base):
     """
     """
     def __init__(self, debug = _def_debug, plot_name = "", chan = 0, out_q = None):
-        gr.sync_block.__init__(self,
-            name="mixer_sink_c",
-            in_sig=[np.complex64],
-            out_sig=None)
         self.debug = debug
-        self.gnuplot = wrap_gp(plot_name=plot_name, chan=chan, out_q=out_q)
-        self.next_due = time.time()
-
-    def work(self, input_items, output_items):
-        if time.time() > self.next_due:
-            self.next_due = time.time() + MIX_FREQ
-            in0 = input_items[0]
-            self.gnuplot.plot(in0, FFT_BINS, mode='mixer')
-        return len(input_items[0])
-
-    def kill(self):
-        self.gnuplot.kill()
+        plot_sink_base.__init__(self, "mixer_sink_c", gr.sizeof_gr_complex, FFT_BINS, 'mixer', MIX_FREQ,
+                                plot_name=plot_name, chan=chan, out_q=out_q)
 
     def set_width(self, w):
         self.gnuplot.set_width(w)
+        self.set_decim((w * MIX_FREQ) // FFT_BINS)
 
-class fll_sink_c(gr.sync_block):
+class fll_sink_c(plot_sink_base):
     """
     """
     def __init__(self, debug = _def_debug, plot_name = "", chan = 0, out_q = None):
-        gr.sync_block.__init__(self,
-            name="fll_sink_c",
-            in_sig=[np.complex64],
-            out_sig=None)
         self.debug = debug
-        self.gnuplot = wrap_gp(plot_name=plot_name, chan=chan, out_q=out_q)
-        self.next_due = time.time()
-
-    def work(self, input_items, output_items):
-        if time.time() > self.next_due:
-            self.next_due = time.time() + MIX_FREQ
-            in0 = input_items[0]
-            self.gnuplot.plot(in0, FFT_BINS, mode='fll')
-        return len(input_items[0])
-
-    def kill(self):
-        self.gnuplot.kill()
+        plot_sink_base.__init__(self, "fll_sink_c", gr.sizeof_gr_complex, FFT_BINS, 'fll', MIX_FREQ,
+                                plot_name=plot_name, chan=chan, out_q=out_q)
 
     def set_width(self, w):
         self.gnuplot.set_width(w)
+        self.set_decim((w * MIX_FREQ) // FFT_BINS)
 
-class symbol_sink_f(gr.sync_block):
+class symbol_sink_f(plot_sink_base):
     """
     """
     def __init__(self, debug = _def_debug, plot_name = "", chan = 0, out_q = None):
-        gr.sync_block.__init__(self,
-            name="symbol_sink_f",
-            in_sig=[np.float32],
-            out_sig=None)
         self.debug = debug
-        self.gnuplot = wrap_gp(plot_name=plot_name, chan=chan, out_q=out_q)
-
-    def work(self, input_items, output_items):
-        in0 = input_items[0]
-        self.gnuplot.plot(in0, 2400, mode='symbol')
-        return len(input_items[0])
-
-    def kill(self):
-        self.gnuplot.kill()
+        plot_sink_base.__init__(self, "symbol_sink_f", gr.sizeof_float, 2400, 'symbol', SNAP_FREQ,
+                                plot_name=plot_name, chan=chan, out_q=out_q)
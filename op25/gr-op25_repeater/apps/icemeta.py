@@ -26,8 +26,12 @@ import time
 import threading
 import requests
 import json
+from collections import deque
 from log_ts import log_ts
 
+META_TIMEOUT = 2.0      # seconds allowed for an update request
+META_QUEUE_LEN = 100    # updates held by a meta_queue
+
 # Helper function
 def from_dict(d, key, def_val):
     if key in d and d[key] != "":
@@ -35,6 +39,40 @@ def from_dict(d, key, def_val):
     else:
         return def_val
 
+# Stand-in for the gr.msg_queue feeding a meta_server.  Updates are never
+# refused while the sender is busy (the oldest are discarded past META_QUEUE_LEN)
+# and readers block on a condition variable instead of polling.
+class meta_queue(object):
+    def __init__(self, maxlen = META_QUEUE_LEN):
+        self.cond = threading.Condition()
+        self.msgs = deque(maxlen=maxlen)
+        self.dropped = 0
+
+    def insert_tail(self, msg):
+        with self.cond:
+            if len(self.msgs) == self.msgs.maxlen:
+                self.dropped += 1
+            self.msgs.append(msg)
+            self.cond.notify()
+
+    def delete_head(self, timeout = None):  # returns None if nothing arrived within the timeout
+        with self.cond:
+            if not self.msgs:
+                self.cond.wait(timeout)
+            return self.msgs.popleft() if self.msgs else None
+
+    def delete_head_nowait(self):
+        return self.delete_head(0)
+
+    def full_p(self):
+        return False
+
+    def empty_p(self):
+        return not self.msgs
+
+    def count(self):
+        return len(self.msgs)
+
 # OP25 thread to send metadata tags to an Icecast server
 class meta_server(threading.Thread):
     def __init__(self, input_q, metacfg, debug = 0, **kwds):
@@ -45,7 +83,8 @@ class meta_server(threading.Thread):
         self.keep_running = True
         self.last_metadata = ""
         self.delay = 0
-        self.msg = None
+        self.session = requests.Session()
+        self.stats = {'received': 0, 'sent': 0, 'coalesced': 0, 'failed': 0, 'latency_avg': 0.0, 'latency_max': 0.0}
         self.urlBase = ""
         self.url = ""
         if isinstance(metacfg,dict):
@@ -74,16 +113,28 @@ class meta_server(threading.Thread):
             sys.stderr.write("%s meta_server::load_json(): Error reading metadata config file: %s\n" % (log_ts.get(), metacfg))
 
     def run(self):
+        pending = deque()
         while(self.keep_running):
-            self.process_q_events()
-            if self.msg and self.logging >= 11:
-                    sys.stderr.write("%s icemeta::run: received message arg1=%s\n" % (log_ts.get(), log_ts.get(self.msg.arg1())))
-            if self.msg and (time.time() >= (self.msg.arg1() + self.delay)):
-                if self.logging >= 11:
-                    sys.stderr.write("%s icemeta::run: processing message\n" % (log_ts.get()))
-                self.send_metadata(self.format(json.loads(self.msg.to_string())))
-                self.msg = None
-            time.sleep(0.1)
+            # take everything queued, waiting no longer than until the oldest update is due
+            timeout = 1.0 if not pending else max(0.0, pending[0].arg1() + self.delay - time.time())
+            msg = self.read_q(timeout)
+            if msg is not None:
+                pending.append(msg)
+                continue
+            # of the updates that are due only the newest is sent
+            msg = None
+            while pending and time.time() >= pending[0].arg1() + self.delay:
+                if msg is not None:
+                    self.stats['coalesced'] += 1
+                msg = pending.popleft()
+            if msg is None:
+                continue
+            if self.logging >= 11:
+                sys.stderr.write("%s icemeta::run: processing message arg1=%s\n" % (log_ts.get(), log_ts.get(msg.arg1())))
+            if self.send_metadata(self.format(json.loads(msg.to_string()))):
+                self.update_latency(time.time() - msg.arg1() - self.delay)
+            msg = None
+        self.session.close()
 
     def format(self, meta):
         if meta['tgid'] is None:
@@ -109,33 +160,61 @@ class meta_server(threading.Thread):
     def stop(self):
         self.keep_running = False
 
-    def process_q_events(self):
-        if (self.msg is None) and (self.input_q.empty_p() == False):
-            if self.logging >= 11:
-                sys.stderr.write("%s icemeta::process_q_events: queue size=%d\n" % (log_ts.get(), self.input_q.count()))
-            self.msg = self.input_q.delete_head_nowait()
-            if self.msg.type() != -2:
-                self.msg = None
+    def read_q(self, timeout):
+        # next metadata message received within the timeout, or None
+        deadline = time.time() + timeout
+        while True:
+            if isinstance(self.input_q, meta_queue):
+                msg = self.input_q.delete_head(max(0.0, deadline - time.time()))
+            elif not self.input_q.empty_p():    # gr.msg_queue: blocking reads cannot be interrupted by stop()
+                msg = self.input_q.delete_head_nowait()
+            elif time.time() < deadline:
+                time.sleep(min(0.1, deadline - time.time()))
+                continue
+            else:
+                msg = None
+            if msg is None or msg.type() == -2:
+                if msg is not None:
+                    self.stats['received'] += 1
+                return msg
+            if time.time() >= deadline:
+                return None
+
+    def update_latency(self, latency):
+        # seconds from the update to Icecast accepting it, beyond the configured delay
+        latency = max(0.0, latency)
+        self.stats['latency_avg'] += (latency - self.stats['latency_avg']) / self.stats['sent']
+        self.stats['latency_max'] = max(self.stats['latency_max'], latency)
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['dropped'] = self.input_q.dropped if isinstance(self.input_q, meta_queue) else 0
+        return stats
 
-    def send_metadata(self, metadata):
+    def send_metadata(self, metadata):     # returns True if Icecast accepted an update
         if (self.urlBase != "") and (metadata != '') and (self.last_metadata != metadata):
             metadataFormatted = metadata.replace(" ","+") # add "+" instead of " " for icecast2
             requestToSend = (self.urlBase) +(metadataFormatted)
             if self.logging >= 11:
                 sys.stderr.write("%s metadata update: \"%s\"\n" % (log_ts.get(), requestToSend))
             try:
-                r = requests.get((requestToSend), auth=("source",self.cfg['icecastPass']), timeout=1.0)
+                r = self.session.get((requestToSend), auth=("source",self.cfg['icecastPass']), timeout=META_TIMEOUT)
                 status = r.status_code
                 if self.logging >= 11:
                     sys.stderr.write("%s metadata result: \"%s\"\n" % (log_ts.get(), status))
                 if status != 200:
+                    self.stats['failed'] += 1
                     if self.logging >= 11:
                         sys.stderr.write("%s meta_server::send_metadata(): metadata update error: %s\n" % (log_ts.get(), status))
                 else:
                     self.last_metadata = metadata
+                    self.stats['sent'] += 1
+                    return True
             except (requests.ConnectionError, requests.Timeout):
+                self.stats['failed'] += 1
                 if self.logging >= 11:
                     sys.stderr.write("%s meta_server::send_metadata(): exception %s\n" % (log_ts.get(), sys.exc_info()[1]))
+        return False
 
     def get_url(self):
         return self.url
@@ -0,0 +1,336 @@
+#
+# OP25 SigMF IQ Capture
+#
+# This file is part of OP25
+#
+# OP25 is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# OP25 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OP25; see the file COPYING. If not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Boston, MA
+# 02110-1301, USA.
+
+"""
+Compressed IQ recording and playback with SigMF metadata.
+
+The recorder quantizes device samples to ci8 or ci16 (or keeps cf32) in
+a stock conversion block and writes them to a pipe with a stock
+file_descriptor_sink, so that no python code runs on the sample path.
+Background threads read the other end of the pipe, compress the data and
+write a .sigmf-meta file holding the center frequency, sample rate, ppm
+and one annotation per call logged by the trunking module.  A compressor
+that cannot keep up eventually fills the pipe and slows the device
+flowgraph rather than leaving gaps in the recording.  Compression is
+zstd when the 'zstandard' module is installed, otherwise gzip.
+Compressed data is written in independent frames so that a recording
+cut short remains readable up to the last completed frame.
+"""
+
+import sys
+import os
+import time
+import json
+import gzip
+import calendar
+import threading
+import select
+import numpy as np
+from gnuradio import gr, blocks
+from log_ts import log_ts
+import sample_clock
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_def_queue_len = 64             # pipe reads buffered ahead of the compressor
+_def_pipe_size = 1 << 20        # requested pipe capacity; the kernel may cap it (fs.pipe-max-size)
+_def_read_size = 1 << 20        # bytes per pipe read
+_F_SETPIPE_SZ = 1031            # linux fcntl, not exported by python < 3.10
+_def_frame_bytes = 16 << 20     # compressed frame size; metadata is rewritten after each frame
+_def_channel_bw = 12500         # annotation bandwidth around a call frequency
+
+DATATYPES = {'ci8':  ('ci8',     np.int8,    127.0),
+             'ci16': ('ci16_le', np.dtype('<i2'), 32767.0),
+             'cf32': ('cf32_le', np.dtype('<f4'), 1.0)}
+
+COMPRESSION_EXT = {'zstd': '.zst', 'gzip': '.gz', 'none': ''}
+
+def is_sigmf(filename):
+    return filename.endswith('.sigmf-meta') or ('.sigmf-data' in filename)
+
+def meta_filename(filename):
+    if filename.endswith('.sigmf-meta'):
+        return filename
+    return filename[:filename.index('.sigmf-data')] + '.sigmf-meta'
+
+def iso_time(ts):
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(ts)) + (".%06dZ" % int((ts % 1) * 1e6))
+
+def parse_iso_time(s):
+    secs, _, frac = s.rstrip('Z').partition('.')
+    return calendar.timegm(time.strptime(secs, "%Y-%m-%dT%H:%M:%S")) + (float('0.' + frac) if frac else 0.0)
+
+class iq_recorder(gr.hier_block2):
+    """Sink writing complex samples to a (compressed) SigMF recording"""
+    def __init__(self, name, base, rate, freq, ppm = 0.0, offset = 0, datatype = 'ci16', scale = 1.0, compression = 'zstd', level = 3):
+        gr.hier_block2.__init__(self, "iq_recorder",
+                                gr.io_signature(1, 1, gr.sizeof_gr_complex),
+                                gr.io_signature(0, 0, 0))
+        if datatype not in DATATYPES:
+            sys.stderr.write("%s [%s] unknown iq_record_format '%s', using ci16\n" % (log_ts.get(), name, datatype))
+            datatype = 'ci16'
+        if compression == 'zstd' and zstandard is None:
+            sys.stderr.write("%s [%s] zstandard module not installed, compressing with gzip\n" % (log_ts.get(), name))
+            compression = 'gzip'
+        if compression not in COMPRESSION_EXT:
+            compression = 'none'
+        self.name = name
+        self.datatype, self.dtype, fullscale = DATATYPES[datatype]
+        self.compression = compression
+        self.level = int(level)
+        self.bytes_per_sample = 2 * np.dtype(self.dtype).itemsize
+        self.count = 0          # samples read from the pipe
+        self.partial = 0        # bytes of an incomplete sample at the end of the last read
+        self.lock = threading.Lock()
+        self.q = queue.Queue(_def_queue_len)
+        self.closing = False
+
+        # quantization and output both run in stock blocks; python only reads the far end of the pipe
+        self.rfd, self.wfd = os.pipe()
+        if fcntl is not None:
+            try:
+                fcntl.fcntl(self.wfd, _F_SETPIPE_SZ, _def_pipe_size)
+            except (IOError, OSError):
+                pass
+        if datatype == 'cf32':
+            self.convert = None
+            self.sink = blocks.file_descriptor_sink(gr.sizeof_gr_complex, self.wfd)
+            self.connect(self, self.sink)
+        else:
+            if datatype == 'ci16':
+                self.convert = blocks.complex_to_interleaved_short(False, fullscale / scale)
+                self.sink = blocks.file_descriptor_sink(gr.sizeof_short, self.wfd)
+            else:
+                self.convert = blocks.complex_to_interleaved_char(False, fullscale / scale)
+                self.sink = blocks.file_descriptor_sink(gr.sizeof_char, self.wfd)
+            self.connect(self, self.convert, self.sink)
+
+        start = sample_clock.time()
+        base = time.strftime(base, time.localtime(start))
+        self.meta_file = base + '.sigmf-meta'
+        self.data_file = base + '.sigmf-data' + COMPRESSION_EXT[compression]
+        self.meta = {'global':      {'core:datatype':    self.datatype,
+                                     'core:sample_rate': float(rate),
+                                     'core:version':     '1.0.0',
+                                     'core:recorder':    'OP25',
+                                     'core:description': 'OP25 device %s' % name,
+                                     'op25:ppm':         float(ppm),
+                                     'op25:offset':      int(offset),
+                                     'op25:scale':       float(scale),
+                                     'op25:compression': compression},
+                     'captures':    [{'core:sample_start': 0,
+                                      'core:frequency':    float(freq),
+                                      'core:datetime':     iso_time(start)}],
+                     'annotations': []}
+        if compression != 'none':       # not a plain SigMF dataset; name the file explicitly
+            self.meta['global']['core:dataset'] = os.path.basename(self.data_file)
+        sys.stderr.write("%s [%s] Recording IQ to %s (%s, %s)\n" % (log_ts.get(), name, self.data_file, self.datatype, compression))
+
+        self.writer = threading.Thread(target=self.write_thread)
+        self.writer.daemon = True
+        self.writer.start()
+        self.reader = threading.Thread(target=self.read_thread)
+        self.reader.daemon = True
+        self.reader.start()
+
+    def close(self):
+        # call once the flowgraph has stopped: drains the pipe and finishes the data and metadata files.
+        # The write end stays open; the file_descriptor_sink closes it when it is destroyed.
+        if self.reader is None:
+            return
+        self.closing = True
+        self.reader.join()
+        self.writer.join()
+        self.reader = None
+        os.close(self.rfd)
+
+    def read_thread(self):
+        while True:
+            r, _, _ = select.select([self.rfd], [], [], 0.5)
+            if not r:
+                if self.closing:        # flowgraph stopped and pipe drained
+                    break
+                continue
+            data = os.read(self.rfd, _def_read_size)
+            if len(data) == 0:
+                break
+            with self.lock:
+                n = self.partial + len(data)
+                self.count += n // self.bytes_per_sample
+                self.partial = n % self.bytes_per_sample
+            self.q.put(data)            # blocks while the compressor is behind; the pipe then absorbs the backlog
+        self.q.put(None)
+
+    def set_center_freq(self, freq):
+        with self.lock:
+            self.meta['captures'].append({'core:sample_start': self.count,
+                                          'core:frequency':    float(freq),
+                                          'core:datetime':     iso_time(sample_clock.time())})
+
+    def annotate_call(self, entry):
+        # place the annotation at the sample received when the call was logged
+        rate = self.meta['global']['core:sample_rate']
+        with self.lock:
+            start = max(0, int(self.count - (sample_clock.time() - entry['time']) * rate))
+            a = {'core:sample_start': start,
+                 'core:label':        ("%s %s" % (entry['tgid'], entry['tgtag'])).strip(),
+                 'op25:time':         iso_time(entry['time'])}
+            if entry.get('freq'):
+                a['core:freq_lower_edge'] = float(entry['freq'] - _def_channel_bw / 2)
+                a['core:freq_upper_edge'] = float(entry['freq'] + _def_channel_bw / 2)
+            for key in ['sysid', 'rcvr', 'slot', 'tgid', 'tgtag', 'rid', 'rtag']:
+                if entry.get(key) not in [None, ""]:
+                    a['op25:' + key] = entry[key]
+            self.meta['annotations'].append(a)
+
+    def write_meta(self):
+        with self.lock:
+            js = json.dumps(self.meta, indent=4, sort_keys=True)
+        tmp = self.meta_file + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(js)
+        os.rename(tmp, self.meta_file)
+
+    def write_thread(self):
+        f = open(self.data_file, 'wb')
+        if self.compression == 'zstd':
+            cctx = zstandard.ZstdCompressor(level=self.level)
+            out = None
+        elif self.compression == 'gzip':
+            out = gzip.GzipFile(fileobj=f, mode='wb', compresslevel=self.level)
+        else:
+            out = f
+        self.write_meta()
+        pending = []
+        pending_len = 0
+        done = False
+        while not done:
+            chunk = self.q.get()
+            if chunk is None:
+                done = True
+            else:
+                pending.append(chunk)
+                pending_len += len(chunk)
+            if pending_len >= _def_frame_bytes or (done and pending_len > 0):
+                data = b''.join(pending)
+                if self.compression == 'zstd':
+                    f.write(cctx.compress(data))    # each frame decodes on its own
+                else:
+                    out.write(data)
+                f.flush()
+                pending = []
+                pending_len = 0
+                self.write_meta()
+        if self.compression == 'gzip':
+            out.close()
+        f.close()
+        self.write_meta()
+        sys.stderr.write("%s [%s] IQ recording closed: %d samples, %d bytes\n" % (log_ts.get(), self.name, self.count, os.path.getsize(self.data_file)))
+
+class sigmf_source(gr.sync_block):
+    """Source replaying a recording written by iq_recorder (or any ci8/ci16/cf32 SigMF file)"""
+    def __init__(self, filename, seek = 0):
+        gr.sync_block.__init__(self, name="sigmf_source", in_sig=None, out_sig=[np.complex64])
+        self.meta_file = meta_filename(filename)
+        with open(self.meta_file) as f:
+            self.meta = json.load(f)
+        g = self.meta['global']
+        datatype = g['core:datatype']
+        dtypes = dict([(DATATYPES[k][0], DATATYPES[k]) for k in DATATYPES])
+        if datatype not in dtypes:
+            raise ValueError("unsupported SigMF datatype %s" % datatype)
+        _, self.dtype, fullscale = dtypes[datatype]
+        self.gain = float(g.get('op25:scale', 1.0)) / fullscale
+        self.bytes_per_sample = 2 * np.dtype(self.dtype).itemsize
+        self.compression = g.get('op25:compression', 'none')
+        base = self.meta_file[:-len('.sigmf-meta')]
+        data_file = os.path.join(os.path.dirname(self.meta_file), g['core:dataset']) if 'core:dataset' in g else base + '.sigmf-data'
+
+        self.f = open(data_file, 'rb')
+        if self.compression == 'zstd':
+            if zstandard is None:
+                raise ImportError("zstandard module required to replay %s" % data_file)
+            dctx = zstandard.ZstdDecompressor()
+            try:
+                self.stream = dctx.stream_reader(self.f, read_across_frames=True)
+            except TypeError:   # older zstandard
+                self.stream = dctx.stream_reader(self.f)
+        elif self.compression == 'gzip':
+            self.stream = gzip.GzipFile(fileobj=self.f, mode='rb')
+        else:
+            self.stream = self.f
+        self.leftover = b''
+        self.skip(int(seek))
+
+    def skip(self, nsamples):
+        nbytes = nsamples * self.bytes_per_sample
+        while nbytes > 0:
+            data = self.stream.read(min(nbytes, _def_frame_bytes))
+            if len(data) == 0:
+                break
+            nbytes -= len(data)
+
+    def get_sample_rate(self):
+        return self.meta['global']['core:sample_rate']
+
+    def get_center_freq(self):
+        return self.meta['captures'][0]['core:frequency']
+
+    def get_ppm(self):
+        return self.meta['global'].get('op25:ppm', 0.0)
+
+    def get_offset(self):
+        return self.meta['global'].get('op25:offset', 0)
+
+    def get_ts(self):
+        if 'core:datetime' in self.meta['captures'][0]:
+            return parse_iso_time(self.meta['captures'][0]['core:datetime'])
+        return 0
+
+    def work(self, input_items, output_items):
+        out = output_items[0]
+        want = len(out) * self.bytes_per_sample
+        data = self.leftover
+        while len(data) < want:
+            chunk = self.stream.read(want - len(data))
+            if len(chunk) == 0:
+                break
+            data += chunk
+        n = len(data) // self.bytes_per_sample
+        if n == 0:
+            return -1   # WORK_DONE
+        used = n * self.bytes_per_sample
+        self.leftover = data[used:]
+        samples = np.frombuffer(data[:used], dtype=self.dtype).astype(np.float32) * self.gain
+        out[:n] = samples.view(np.complex64)
+        return n
@@ -0,0 +1,215 @@
+#
+# OP25 Metadata Dispatcher
+#
+# This file is part of OP25
+#
+# OP25 is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# OP25 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OP25; see the file COPYING. If not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Boston, MA
+# 02110-1301, USA.
+
+"""
+Metadata module sending each update of a stream to several sinks.
+
+Used in place of icemeta in the multi_rx 'metadata' section.  Every sink
+listed in the stream's 'sinks' has its own bounded queue and worker thread:
+the dispatcher only appends to these queues, so a slow or unreachable
+server delays (and, once its queue is full, loses) only its own updates.
+A stream with 'icecastServerAddress' also gets an icemeta sink, as before.
+"""
+
+import sys
+import time
+import json
+import socket
+import threading
+import requests
+import icemeta
+from icemeta import meta_queue, from_dict
+from log_ts import log_ts
+
+# Worker thread of one sink: takes updates from its own queue and sends them
+class meta_sink(threading.Thread):
+    def __init__(self, cfg, debug = 0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.q = meta_queue(int(from_dict(cfg, 'queue_len', icemeta.META_QUEUE_LEN)))
+        self.logging = debug
+        self.keep_running = True
+        self.stats = {'sent': 0, 'failed': 0, 'latency_avg': 0.0, 'latency_max': 0.0}
+
+    def run(self):
+        while self.keep_running:
+            event = self.q.delete_head(1.0)
+            if event is None:
+                continue
+            try:
+                self.send(event)
+            except Exception as e:
+                self.stats['failed'] += 1
+                if self.logging >= 11:
+                    sys.stderr.write("%s meta_sink::run(): %s update failed: %s\n" % (log_ts.get(), self.describe(), e))
+                continue
+            latency = max(0.0, time.time() - event['time'])
+            self.stats['sent'] += 1
+            self.stats['latency_avg'] += (latency - self.stats['latency_avg']) / self.stats['sent']
+            self.stats['latency_max'] = max(self.stats['latency_max'], latency)
+        self.close()
+
+    def put(self, event):   # never blocks; the oldest update is dropped when the queue is full
+        self.q.insert_tail(event)
+
+    def stop(self):
+        self.keep_running = False
+
+    def set_debug(self, dbglvl):
+        self.logging = dbglvl
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['dropped'] = self.q.dropped
+        return stats
+
+    def close(self):
+        pass
+
+# http endpoint of an external service, e.g. home automation or a chat bot
+class webhook_sink(meta_sink):
+    def __init__(self, cfg, debug = 0):
+        meta_sink.__init__(self, cfg, debug)
+        self.url = cfg['url']
+        self.timeout = float(from_dict(cfg, 'timeout', icemeta.META_TIMEOUT))
+        self.session = requests.Session()
+        self.session.headers.update({'Content-Type': 'application/json'})
+
+    def describe(self):
+        return "webhook %s" % self.url
+
+    def send(self, event):
+        r = self.session.post(self.url, data=json.dumps(event), timeout=self.timeout)
+        if r.status_code >= 300:
+            raise IOError("http status %d" % r.status_code)
+
+    def close(self):
+        self.session.close()
+
+# one json object per line, e.g. for a log shipper
+class jsonl_sink(meta_sink):
+    def __init__(self, cfg, debug = 0):
+        meta_sink.__init__(self, cfg, debug)
+        self.filename = cfg['file']
+        self.f = open(self.filename, 'a')
+
+    def describe(self):
+        return "file %s" % self.filename
+
+    def send(self, event):
+        self.f.write(json.dumps(event) + "\n")
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+# one json datagram per update; a broadcast address reaches every listener on the lan
+class udp_sink(meta_sink):
+    def __init__(self, cfg, debug = 0):
+        meta_sink.__init__(self, cfg, debug)
+        self.dest = (str(from_dict(cfg, 'host', '255.255.255.255')), int(cfg['port']))
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+
+    def describe(self):
+        return "udp %s:%d" % self.dest
+
+    def send(self, event):
+        self.sock.sendto(json.dumps(event).encode(), self.dest)
+
+    def close(self):
+        self.sock.close()
+
+SINK_TYPES = {
+    'webhook': webhook_sink,
+    'jsonl':   jsonl_sink,
+    'udp':     udp_sink,
+}
+
+# Same interface as icemeta.meta_server; fans the updates of one stream out to its sinks
+class meta_server(threading.Thread):
+    def __init__(self, input_q, metacfg, debug = 0, **kwds):
+        threading.Thread.__init__(self, **kwds)
+        self.daemon = True
+        self.input_q = input_q
+        self.cfg = metacfg
+        self.logging = debug
+        self.keep_running = True
+        self.stream_name = from_dict(metacfg, 'stream_name', "")
+        self.icecast = None
+        self.sinks = []
+        if 'icecastServerAddress' in metacfg:
+            self.icecast = icemeta.meta_server(meta_queue(), metacfg, debug=debug)
+        for sink_cfg in from_dict(metacfg, 'sinks', []):
+            sink_type = from_dict(sink_cfg, 'type', "")
+            if sink_type not in SINK_TYPES:
+                sys.stderr.write("%s meta_server::__init__(): ignoring metadata sink of unknown type '%s'\n" % (log_ts.get(), sink_type))
+                continue
+            sink = SINK_TYPES[sink_type](sink_cfg, debug)
+            sink.start()
+            self.sinks.append(sink)
+        self.start()
+
+    def describe(self):
+        names = [s.describe() for s in self.sinks]
+        if self.icecast is not None:
+            names.insert(0, self.cfg['icecastServerAddress'] + "/" + self.cfg['icecastMountpoint'])
+        return ", ".join(names)
+
+    def run(self):
+        while self.keep_running:
+            msg = self.input_q.delete_head(1.0)
+            if msg is None or msg.type() != -2:
+                continue
+            if self.icecast is not None:
+                self.icecast.input_q.insert_tail(msg)
+            if not self.sinks:
+                continue
+            event = json.loads(msg.to_string())
+            del event['json_type']
+            event['time'] = msg.arg1()
+            event['stream'] = self.stream_name
+            for sink in self.sinks:
+                sink.put(event)
+
+    def set_debug(self, dbglvl):
+        self.logging = dbglvl
+        if self.icecast is not None:
+            self.icecast.set_debug(dbglvl)
+        for sink in self.sinks:
+            sink.set_debug(dbglvl)
+
+    def stop(self):
+        self.keep_running = False
+        if self.icecast is not None:
+            self.icecast.stop()
+        for sink in self.sinks:
+            sink.stop()
+
+    def get_url(self):
+        return self.icecast.get_url() if self.icecast is not None else ""
+
+    def get_stats(self):
+        stats = {}
+        if self.icecast is not None:
+            stats['icecast'] = self.icecast.get_stats()
+        for sink in self.sinks:
+            stats[sink.describe()] = sink.get_stats()
+        return stats
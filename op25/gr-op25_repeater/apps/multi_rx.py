@@ -45,6 +45,7 @@ exit 127
 import io
 import os
 import sys
+import ctypes
 import threading
 import time
 import json
@@ -63,6 +64,15 @@ import p25_demodulator_dev as p25_demodulator
 import op25_nbfm
 import op25_iqsrc
 import op25_wavsrc
+import op25_channelizer
+import tap_cache
+import sample_clock
+import device_ipc
+import rate_planner
+import symbol_ring
+import iq_capture
+import call_recorder
+import audio_shm
 from log_ts import log_ts
 from helper_funcs import *
 
@@ -80,27 +90,82 @@ os.environ['IMBE'] = 'soft'
 
 _def_symbol_rate = 4800
 _def_capture_file = "capture.bin"
+_def_ring_post = 2.0            # seconds of symbols kept after a ring trigger
+_def_ring_holdoff = 30.0        # minimum seconds between triggered ring dumps
+_def_overrun_interval = 10.0    # seconds between sample overrun checks
+_def_overrun_tolerance = 0.005  # fraction of expected samples that may be missing before counting an overrun
+
+def get_int_list(config, key):
+    # value may be a list of ints, a single int or a comma separated string
+    values = from_dict(config, key, None)
+    if values is None:
+        return []
+    if isinstance(values, list):
+        return [int(v) for v in values]
+    return [int(v) for v in str(values).split(',') if v.strip() != ""]
+
+def get_affinity(config):
+    return get_int_list(config, 'affinity')
+
+def set_block_threads(blk, affinity, priority, visited = None):
+    # Apply processor affinity and thread priority to a block.  GR hier blocks
+    # only accept affinity, so python hier blocks are walked to reach the leaf
+    # blocks they hold as attributes for setting thread priority.
+    if blk is None or (len(affinity) == 0 and priority is None):
+        return
+    if visited is None:
+        visited = set()
+    if id(blk) in visited:
+        return
+    visited.add(id(blk))
+    if len(affinity) > 0 and hasattr(blk, 'set_processor_affinity'):
+        blk.set_processor_affinity(affinity)
+    if priority is None:
+        return
+    if hasattr(blk, 'set_thread_priority'):
+        blk.set_thread_priority(priority)
+    elif isinstance(blk, gr.hier_block2):
+        for attr in list(vars(blk).values()):
+            if isinstance(attr, (gr.hier_block2, gr.basic_block)):
+                set_block_threads(attr, [], priority, visited)
 
 # The P25 receiver
 #
 
 class device(object):
     def __init__(self, config):
-        speeds = [250000, 1000000, 1024000, 1800000, 1920000, 2000000, 2048000, 2400000, 2560000]
+        speeds = rate_planner.RTL_RATES
 
         self.name = config['name']
         self.args = config['args']
         self.tunable = bool(from_dict(config, 'tunable', False))
+        self.channelizer = None
+        self.channelizer_attached = False
+        self.realtime = True
+        self.start_ts = 0
+        self.sample_counter = None
+        self.sample_counter_attached = False
+        self.overruns = 0
+        self.dropped_samples = 0
+        self.overrun_mark = None
+        self.recorder = None
+        self.recorder_attached = False
 
         sys.stderr.write('device: %s\n' % config)
         if config['args'] == 'iqsrc':
             self.src = op25_iqsrc.op25_iqsrc_c(str(config['name']), config)
+            self.realtime = self.src.is_realtime()
             self.ppm = float(from_dict(config, 'ppm', "0.0"))
             self.tunable = False
             if self.src.is_dsd():
                 self.frequency = self.src.get_center_freq()
                 self.sample_rate = self.src.get_sample_rate()
                 self.offset = 600000
+            elif self.src.is_sigmf():  # recording made by 'iq_record'
+                self.ppm = float(from_dict(config, 'ppm', self.src.get_ppm()))
+                self.offset = int(from_dict(config, 'offset', self.src.get_offset()))
+                self.frequency = int(self.src.get_center_freq()) - self.offset
+                self.sample_rate = self.src.get_sample_rate()
             else:
                 self.frequency = int(from_dict(config, 'frequency', 800000000))
                 self.sample_rate = config['rate']
@@ -110,6 +175,7 @@ class device(object):
 
         elif config['args'] == 'wavsrc':
             self.src = op25_wavsrc.op25_wavsrc_f(str(config['name']), config)
+            self.realtime = self.src.is_realtime()
             self.sample_rate = self.src.get_sample_rate()
             self.ppm = float(from_dict(config, 'ppm', "0.0"))
             self.frequency = int(from_dict(config, 'frequency', 800000000))
@@ -119,6 +185,7 @@ class device(object):
 
         elif config['args'] == 'symbols':
             self.src = None
+            self.realtime = bool(from_dict(config, 'throttle', True))
             self.sample_rate = config['rate']
             self.frequency = int(from_dict(config, 'frequency', 800000000))
             self.usable_bw = float(from_dict(config, 'usable_bw_pct', 1.0))
@@ -164,9 +231,65 @@ class device(object):
             self.src.set_center_freq(self.frequency + self.offset)
             self.usable_bw = float(from_dict(config, 'usable_bw_pct', 1.0))
 
+            # Counts delivered samples so that overruns (dropped samples) can be reported
+            self.sample_counter = blocks.null_sink(gr.sizeof_gr_complex)
+
+        # Unthrottled file replay keeps time by symbol count, starting from the capture time if known
+        if not self.realtime:
+            self.start_ts = self.src.get_ts() if (self.src is not None and self.src.get_ts() > 0) else time.time()
+
+        # Optional IQ recording of the device samples
+        iq_record = str(from_dict(config, 'iq_record', ""))
+        if iq_record != "" and self.src is not None and config['args'] != 'wavsrc':
+            self.recorder = iq_capture.iq_recorder(self.name, iq_record, self.sample_rate, self.frequency + self.offset,
+                                                   ppm = self.ppm,
+                                                   offset = self.offset,
+                                                   datatype = str(from_dict(config, 'iq_record_format', "ci16")),
+                                                   scale = float(from_dict(config, 'iq_record_scale', 1.0)),
+                                                   compression = str(from_dict(config, 'iq_record_compress', "zstd")),
+                                                   level = int(from_dict(config, 'iq_record_level', 3)))
+
+        # Optional shared channelizer splits the device bandwidth once for all attached channels
+        if bool(from_dict(config, 'channelizer', False)) and self.src is not None and config['args'] != 'wavsrc':
+            self.channelizer = op25_channelizer.op25_channelizer_c(self.name, self.sample_rate, int(from_dict(config, 'channelizer_bw', 24000)), self.usable_bw)
+
+        # Optional cpu affinity and thread priority for the source and channelizer
+        self.affinity = get_affinity(config)
+        self.priority = from_dict(config, 'priority', None)
+        if self.priority is not None:
+            self.priority = int(self.priority)
+        set_block_threads(self.src, self.affinity, self.priority)
+        set_block_threads(self.channelizer, self.affinity, self.priority)
+        set_block_threads(self.sample_counter, self.affinity, self.priority)
+        set_block_threads(self.recorder, self.affinity, self.priority)
+        if len(self.affinity) > 0 or self.priority is not None:
+            sys.stderr.write("%s [%s] device threads: affinity=%s, priority=%s\n" % (log_ts.get(), self.name, self.affinity, self.priority))
+
     def get_ppm(self):
         return self.ppm
 
+    def check_overruns(self, now):
+        # compare delivered samples against the nominal rate; a shortfall means the driver dropped samples
+        if self.sample_counter is None or not self.sample_counter_attached:
+            return
+        nitems = self.sample_counter.nitems_read(0)
+        if self.overrun_mark is None:
+            self.overrun_mark = (now, nitems)
+            return
+        (mark_ts, mark_items) = self.overrun_mark
+        if now < mark_ts + _def_overrun_interval:
+            return
+        expected = (now - mark_ts) * self.sample_rate
+        missing = int(expected - (nitems - mark_items))
+        if missing > expected * _def_overrun_tolerance:
+            self.overruns += 1
+            self.dropped_samples += missing
+            sys.stderr.write("%s [%s] sample overrun: %d samples (%.1f ms) missing in last %.0f sec; %d overruns, %d samples dropped in total\n" % (log_ts.get(), self.name, missing, 1000.0 * missing / self.sample_rate, now - mark_ts, self.overruns, self.dropped_samples))
+        self.overrun_mark = (now, nitems)
+
+    def get_overruns(self):
+        return self.overruns
+
     def set_debug(self, dbglvl):
         pass
 
@@ -195,6 +318,21 @@ class channel(object):
         self.config = config
         self.symbol_rate = int(from_dict(config, 'symbol_rate', _def_symbol_rate))
         self.channel_rate = self.symbol_rate
+        self.selector = None
+        self.sample_clock = not dev.realtime
+        self.ring = None
+        self.ring_triggers = []
+        self.ring_tgids = []
+        self.ring_tgid = None
+        self.ring_synced = False
+        input_rate = dev.sample_rate
+        usable_bw = getattr(dev, 'usable_bw', 1.0)
+        relative_freq = (dev.frequency + dev.offset + dev.fractional_corr) - self.frequency
+        if dev.channelizer is not None:     # demod input is a single channelizer bin; tuning is applied by set_relative_frequency()
+            self.selector = dev.channelizer.make_selector()
+            input_rate = dev.channelizer.get_output_rate()
+            usable_bw = 1.0
+            relative_freq = 0
         if dev.args == 'wavsrc':
             self.demod = p25_demodulator.p25_demod_fb(
                              msgq_id = self.msgq_id,
@@ -210,29 +348,45 @@ class channel(object):
             self.demod = p25_demodulator.p25_demod_cb(
                              msgq_id = self.msgq_id,
                              debug = self.verbosity,
-                             input_rate = dev.sample_rate,
+                             input_rate = input_rate,
                              demod_type = 'fsk4',
                              filter_type = filter_type,
-                             usable_bw = self.device.usable_bw,
+                             usable_bw = usable_bw,
                              excess_bw = float(from_dict(config, 'excess_bw', 0.2)),
-                             relative_freq = ((dev.frequency + dev.offset + dev.fractional_corr) - self.frequency),
+                             relative_freq = relative_freq,
                              offset = dev.offset,
                              if_rate = config['if_rate'],
-                             symbol_rate = self.symbol_rate)
+                             symbol_rate = self.symbol_rate,
+                             xlat_mode = str(from_dict(config, 'xlat_mode', 'fir')))
         else:                             # P25, DMR, NXDN and everything else
             self.demod = p25_demodulator.p25_demod_cb(
                              msgq_id = self.msgq_id,
                              debug = self.verbosity,
-                             input_rate = dev.sample_rate,
+                             input_rate = input_rate,
                              demod_type = config['demod_type'],
                              filter_type = config['filter_type'],
-                             usable_bw = self.device.usable_bw,
+                             usable_bw = usable_bw,
                              excess_bw = float(from_dict(config, 'excess_bw', 0.2)),
-                             relative_freq = ((dev.frequency + dev.offset + dev.fractional_corr) - self.frequency),
+                             relative_freq = relative_freq,
                              offset = dev.offset,
                              if_rate = config['if_rate'],
-                             symbol_rate = self.symbol_rate)
+                             symbol_rate = self.symbol_rate,
+                             xlat_mode = str(from_dict(config, 'xlat_mode', 'fir')))
         self.decoder = op25_repeater.frame_assembler(str(config['destination']), verbosity, msgq_id, rx_q)
+        if self.sample_clock:
+            self.decoder.control(json.dumps({'tuner': self.msgq_id, 'cmd': 'set_sample_clock', 'ts': dev.start_ts, 'rate': self.symbol_rate}))
+
+        # Optional in-memory symbol ring, dumped on demand or on trigger
+        ring_secs = float(from_dict(config, 'symbol_ring', 0))
+        if ring_secs > 0:
+            self.ring_triggers = [t.strip() for t in str(from_dict(config, 'ring_triggers', "")).split(',') if t.strip() != ""]
+            self.ring_tgids = get_int_list(config, 'ring_tgids')
+            self.ring = symbol_ring.symbol_ring(self.msgq_id,
+                                               ring_secs * self.symbol_rate,
+                                               post_symbols = float(from_dict(config, 'ring_post', _def_ring_post)) * self.symbol_rate,
+                                               holdoff = float(from_dict(config, 'ring_holdoff', _def_ring_holdoff)),
+                                               output_dir = str(from_dict(config, 'ring_output', ".")))
+            sys.stderr.write("%s [%d] symbol ring: %.1f sec, triggers: %s\n" % (log_ts.get(), self.msgq_id, ring_secs, self.ring_triggers))
 
         # Load crypt keys if present
         if self.crypt_keys_file != "":
@@ -248,7 +402,7 @@ class channel(object):
         # sys.stderr.write("%s crypt behavior: %d\n" % (log_ts.get(), self.crypt_behavior))
         
         # Relative-tune the demodulator
-        if not self.demod.set_relative_frequency((dev.frequency + dev.offset + dev.fractional_corr) - self.frequency):
+        if not self.set_relative_frequency((dev.frequency + dev.offset + dev.fractional_corr) - self.frequency):
             sys.stderr.write("%s [%d] Unable to initialize demod to freq: %d, using device freq: %d\n" % (log_ts.get(), self.msgq_id, self.frequency, dev.frequency))
             self.frequency = dev.frequency
 
@@ -272,6 +426,16 @@ class channel(object):
             else:
                 self.nbfm = None
 
+        # Optional cpu affinity and thread priority for the channel dsp and decoder
+        affinity = get_affinity(config)
+        priority = from_dict(config, 'priority', None)
+        if priority is not None:
+            priority = int(priority)
+        for blk in [self.selector, self.demod, self.decoder, self.nbfm]:
+            set_block_threads(blk, affinity, priority)
+        if len(affinity) > 0 or priority is not None:
+            sys.stderr.write("%s [%d] channel threads: affinity=%s, priority=%s\n" % (log_ts.get(), self.msgq_id, affinity, priority))
+
         if ('plot' not in list(config.keys())) or (config['plot'] == ""):
             return
 
@@ -402,12 +566,18 @@ class channel(object):
             sink.set_relative_freq(self.device.frequency - self.frequency)
             sink.set_width(self.device.sample_rate)
             self.tb.lock()
-            self.demod.connect_complex('src', sink)
+            if self.selector is not None:           # demod input is a single bin, so plot the full device band instead
+                self.tb.connect(self.device.src, sink)
+            else:
+                self.demod.connect_complex('src', sink)
             self.tb.unlock()
         else:
             (sink, fn) = self.sinks.pop('fft')
             self.tb.lock()
-            self.demod.disconnect_complex(sink)
+            if self.selector is not None:
+                self.tb.disconnect(self.device.src, sink)
+            else:
+                self.demod.disconnect_complex(sink)
             self.tb.unlock()
             sink.kill()
 
@@ -451,17 +621,19 @@ class channel(object):
         old_freq = self.frequency
         self.frequency = freq
 
-        if not self.demod.set_relative_frequency(self.device.offset + self.device.frequency + self.device.fractional_corr - freq): # First attempt relative tune
+        if not self.set_relative_frequency(self.device.offset + self.device.frequency + self.device.fractional_corr - freq): # First attempt relative tune
             if self.device.tunable:                                                                  # then hard tune if allowed
                 self.device.frequency = self.frequency
                 if self.device.src is not None:
                     self.device.src.set_center_freq(self.frequency + self.device.offset)
+                if self.device.recorder is not None:
+                    self.device.recorder.set_center_freq(self.frequency + self.device.offset)
                 self.device.fractional_corr = int((int(round(self.device.ppm)) - self.device.ppm) * (self.device.frequency/1e6))        # Calc frac ppm using new freq
-                self.demod.set_relative_frequency(self.device.offset + self.device.frequency + self.device.fractional_corr - freq)
+                self.set_relative_frequency(self.device.offset + self.device.frequency + self.device.fractional_corr - freq)
                 if self.verbosity >= 9:
                     sys.stderr.write("%s [%d] Hardware tune: dev_freq(%d), dev_off(%d), dev_frac(%d), tune_freq(%d)\n" % (log_ts.get(), self.msgq_id, self.device.frequency, self.device.offset, self.device.fractional_corr, (self.device.frequency - (self.device.offset + self.device.frequency + self.device.fractional_corr - freq))))
             else:                                                                                    # otherwise fail and reset to prev freq
-                self.demod.set_relative_frequency(self.device.offset + self.device.frequency + self.device.fractional_corr - old_freq)
+                self.set_relative_frequency(self.device.offset + self.device.frequency + self.device.fractional_corr - old_freq)
                 self.frequency = old_freq
                 if self.verbosity:
                     sys.stderr.write("%s [%d] Unable to tune %s to frequency %f\n" % (log_ts.get(), self.msgq_id, self.name, (freq/1e6)))
@@ -478,13 +650,25 @@ class channel(object):
         self.decoder.control(json.dumps({'tuner': self.msgq_id, 'cmd': 'sync_reset'}))
         return True
 
+    def set_relative_frequency(self, freq):
+        if self.selector is None:
+            return self.demod.set_relative_frequency(freq)
+        chan_bin = self.device.channelizer.find_bin(-freq)
+        if chan_bin is None:
+            return False
+        bin_idx, residual = chan_bin
+        if not self.demod.set_relative_frequency(-residual):
+            return False
+        self.selector.set_input_index(bin_idx)
+        return True
+
     def adj_tune(self, adjustment): # ideally this would all be done at the device level but the demod belongs to the channel object
         self.device.ppm -= get_fractional_ppm(self.device.frequency, adjustment)
         if self.device.src is not None:
             self.device.src.set_freq_corr(int(round(self.device.ppm)))
             self.device.src.set_center_freq(self.device.frequency + self.device.offset)
         self.device.fractional_corr = int((int(round(self.device.ppm)) - self.device.ppm) * (self.device.frequency/1e6))
-        self.demod.set_relative_frequency(self.device.offset + self.device.frequency + self.device.fractional_corr - self.frequency)
+        self.set_relative_frequency(self.device.offset + self.device.frequency + self.device.fractional_corr - self.frequency)
         self.demod.reset()          # reset gardner-costas tracking loop
 
     def configure_p25_tdma(self, params):
@@ -504,6 +688,7 @@ class channel(object):
 
         self.symbol_rate = rate
         self.demod.set_omega(rate)
+        self.set_clock_rate(rate)
         if 'eye' in self.sinks:
             self.sinks['eye'][0].set_sps(self.config['if_rate'] / rate)
 
@@ -518,20 +703,65 @@ class channel(object):
     def set_rate(self, rate):
         self.symbol_rate = rate
         self.demod.set_omega(rate)
+        self.set_clock_rate(rate)
         if 'eye' in self.sinks:
             self.sinks['eye'][0].set_sps(self.config['if_rate'] / rate)
 
+    def tune(self, params):
+        if 'sigtype' in params and params['sigtype'] == "P25": # P25 specific config
+            self.configure_p25_tdma(params)
+
+        if self.ring is not None:
+            self.ring_tgid = params.get('tgid')
+            if self.ring_tgid is not None and 'tgid' in self.ring_triggers and self.ring_tgid in self.ring_tgids:
+                self.ring.trigger("tg%d" % self.ring_tgid)
+
+        if not self.set_freq(params['freq']):
+            self.control({'tuner': self.msgq_id, 'cmd': 'set_slotid', 'slotid': 0})
+            return False
+
+        if 'slot' in params:
+            self.control({'tuner': self.msgq_id, 'cmd': 'set_slotid', 'slotid': params['slot']})
+
+        if 'rate' in params:
+            self.set_rate(params['rate'])
+        return True
+
+    def set_clock_rate(self, rate):
+        if self.sample_clock:
+            self.decoder.control(json.dumps({'tuner': self.msgq_id, 'cmd': 'set_sample_clock', 'rate': rate}))
+
     def control(self, params):
         if 'cmd' in params:
             if self.verbosity >= 10:
                 sys.stderr.write("%s [%d] channel control: cmd=%s, params=%s\n" % (log_ts.get(), self.msgq_id, params['cmd'], params))
             if params['cmd'] == "set_slotid":
                 self.chan_idle = True if (params['slotid'] == 4) else False
+                if self.chan_idle:
+                    self.ring_tgid = None
             elif params['cmd'] == "set_xormask":
                 self.decoder.control(json.dumps({'tuner': self.msgq_id, 'cmd': 'set_xormask', 'xormask': self.xor_cache[self.get_hash(params)]}))
                 return
         self.decoder.control(json.dumps(params))
-        self.demod.control(not self.chan_idle)
+        self.set_idle(self.chan_idle)
+
+    def set_idle(self, idle):
+        if idle == self.demod.suspended:
+            return
+        if idle:                                # suspend ahead of all channel dsp, including the channelizer bin copy
+            if self.ring is not None:           # no more symbols will arrive to complete a triggered dump
+                self.ring.flush()
+            if self.selector is not None:
+                self.selector.set_enabled(False)
+            self.demod.suspend()
+        else:
+            if self.selector is not None:
+                self.selector.set_enabled(True)
+            self.demod.resume()
+            if self.sample_clock:       # no symbols were counted while suspended; catch up to stream time
+                self.decoder.control(json.dumps({'tuner': self.msgq_id, 'cmd': 'set_sample_clock', 'ts': sample_clock.time(), 'rate': self.symbol_rate}))
+        if self.verbosity >= 9:
+            sys.stderr.write("%s [%d] %s demodulator\n" % (log_ts.get(), self.msgq_id, "Suspending" if idle else "Resuming"))
 
     def kill(self):
         for sink in self.sinks:
@@ -546,6 +776,47 @@ class channel(object):
     def get_error(self):
         return self.error
 
+    def get_ppm(self):
+        return self.device.get_ppm()
+
+    def get_overruns(self):
+        return self.device.get_overruns()
+
+    def is_capturing(self):
+        return self.raw_sink is not None
+
+    def get_plot_files(self):
+        filenames = []
+        for sink in self.sinks:
+            if self.sinks[sink][0].gnuplot.filename is not None:
+                filenames.append(self.sinks[sink][0].gnuplot.filename)
+        return filenames
+
+    def nbfm_control(self, action):
+        if self.nbfm is not None:
+            self.nbfm.control(action)
+
+    def dump_buffer(self):
+        self.decoder.control(json.dumps({'tuner': self.msgq_id, 'cmd': 'dump_buffer'}))
+        if self.ring is not None:
+            self.ring.dump()
+
+    def annotate_call(self, entry):
+        if self.device.recorder is not None:
+            self.device.recorder.annotate_call(entry)
+
+    def ring_msg(self, m_type):     # decoder message for this channel; only sync loss is of interest
+        if m_type != -1:
+            self.ring_synced = True
+            return
+        if not self.ring_synced:    # repeated timeouts while searching for a signal
+            return
+        self.ring_synced = False
+        if 'error' in self.ring_triggers and self.ring_tgid is not None:
+            self.ring.trigger("error")
+        elif 'sync' in self.ring_triggers:
+            self.ring.trigger("sync")
+
 class rx_block (gr.top_block):
 
     # Initialize the receiver
@@ -561,10 +832,14 @@ class rx_block (gr.top_block):
         self.interactive = True
         self.audio = None
         self.audio_instances = {}
+        self.audio_mixers = []
         self.metadata = None
         self.meta_streams = {}
         self.trunking = None
         self.du_watcher = None
+        self.device_workers = []
+        self.ring_channels = {}
+        self.recorder = None
         self.rx_q = gr.msg_queue(100)
         self.ui_in_q = gr.msg_queue(100)
         self.ui_out_q = gr.msg_queue(100)
@@ -580,14 +855,38 @@ class rx_block (gr.top_block):
         if "metadata" in config:
             self.configure_metadata(config['metadata'])
 
-        if "trunking" in config:
-            self.configure_trunking(config['trunking'])
+        if "tap_cache" in config and config['tap_cache'] != "":
+            tap_cache.load(str(config['tap_cache']))
+
+        rate_planner.plan_devices(config)    # devices with "plan": true get rate, frequency and offset from their channels
+
+        config_start = time.time()
+        if bool(from_dict(config, 'device_processes', False)):
+            if "trunking" in config:
+                self.configure_trunking(config['trunking'])
+
+            self.configure_device_processes(config)
+        else:
+            self.configure_devices(config['devices'])
+            self.configure_sample_clock()
+
+            if "trunking" in config:
+                self.configure_trunking(config['trunking'])
 
-        self.configure_devices(config['devices'])
-        self.configure_channels(config['channels'])
+            self.configure_channels(config['channels'])
+        tap_stats = tap_cache.get_stats()
+        sys.stderr.write("%s Devices and channels configured in %.3f sec; filter taps: %d designed in %.3f sec, %d reused, %d preloaded\n" % (log_ts.get(), time.time() - config_start, tap_stats['designed'], tap_stats['design_time'], tap_stats['reused'], tap_stats['loaded']))
+        tap_cache.save()
 
         if self.trunking is not None: # post-initialization after channels and devices created
             self.trunk_rx.post_init()
+            if hasattr(self.trunk_rx, 'add_call_listener'):     # optional in trunking modules
+                self.trunk_rx.add_call_listener(self.annotate_call)
+            if len(self.audio_mixers) > 0 and hasattr(self.trunk_rx, 'add_call_listener'):
+                self.trunk_rx.add_call_listener(self.mix_priority)
+
+        if "recording" in config:
+            self.configure_recording(config['recording'])
 
         if "terminal" in config:
             self.configure_terminal(config['terminal'])
@@ -633,7 +932,16 @@ class rx_block (gr.top_block):
                 audio_2chan = True if int(from_dict(instance,'number_channels', 1)) == 2 else False
                 sys.stderr.write("Configuring audio instance #%d [%s]\n" % (idx, instance_name))
                 try:
-                    audio_s = self.audio.audio_thread("127.0.0.1", audio_port, audio_device, audio_2chan, audio_gain, instance_name=instance_name)
+                    if 'shm' in instance and instance['shm'] != "":        # shared memory ring of a 'shm://' destination
+                        audio_s = audio_shm.shm_thread(str(instance['shm']), audio_device, audio_2chan, audio_gain, instance_name=instance_name,
+                                                       jitter_buffer=bool(from_dict(instance, 'jitter_buffer', True)))
+                    elif 'streams' in instance and instance['streams'] != "":  # single player mixing several receivers
+                        audio_s = self.audio.mixer_thread("127.0.0.1", instance['streams'], audio_device, audio_gain, instance_name=instance_name,
+                                                          duck_gain=float(from_dict(instance, 'duck_gain', self.audio.MIX_DUCK_GAIN)))
+                        self.audio_mixers.append(audio_s)
+                    else:
+                        audio_s = self.audio.audio_thread("127.0.0.1", audio_port, audio_device, audio_2chan, audio_gain, instance_name=instance_name,
+                                                          jitter_buffer=bool(from_dict(instance, 'jitter_buffer', True)))
                     self.audio_instances[instance_name] = audio_s
                 except:
                     sys.stderr.write("Error configuring audio instance #%d; %s\n" % (idx, sys.exc_info()[1]))
@@ -678,7 +986,7 @@ class rx_block (gr.top_block):
 
         if self.trunking is not None:
             self.trunk_rx = self.trunking.rx_ctl(frequency_set = self.change_freq, nbfm_ctrl = self.nbfm_control, fa_ctrl = self.fa_control, debug = self.verbosity, chans = config['chans'])
-            self.du_watcher = du_queue_watcher(self.rx_q, self.trunk_rx.process_qmsg)
+            self.du_watcher = du_queue_watcher(self.rx_q, self.process_rxq)
             sys.stderr.write("Enabled trunking module: %s\n" % config['module'])
 
     def configure_metadata(self, config):
@@ -699,10 +1007,11 @@ class rx_block (gr.top_block):
                     sys.stderr.write("Ignoring duplicate metadata stream #%d [%s]\n" % (idx, stream_name))
                     break
                 try:
-                    meta_q = gr.msg_queue(10)
+                    meta_q = self.metadata.meta_queue() if hasattr(self.metadata, 'meta_queue') else gr.msg_queue(10)
                     meta_s = self.metadata.meta_server(meta_q, stream, debug=self.verbosity)
                     self.meta_streams[stream_name] = (meta_s, meta_q)
-                    sys.stderr.write("Configuring metadata stream #%d [%s]: %s\n" % (idx, stream_name, stream['icecastServerAddress'] + "/" + stream['icecastMountpoint']))
+                    meta_desc = meta_s.describe() if hasattr(meta_s, 'describe') else stream['icecastServerAddress'] + "/" + stream['icecastMountpoint']
+                    sys.stderr.write("Configuring metadata stream #%d [%s]: %s\n" % (idx, stream_name, meta_desc))
                 except:
                     sys.stderr.write("Error configuring metadata stream #%d; %s\n" % (idx, sys.exc_info()[1]))
                     #sys.exc_clear()
@@ -710,12 +1019,44 @@ class rx_block (gr.top_block):
                 sys.stderr.write("Ignoring unnamed metadata stream #%d\n" % idx)
             idx += 1
 
+    def configure_recording(self, config):
+        if self.trunking is None:
+            sys.stderr.write("%s Call recording requires trunking; not enabled\n" % log_ts.get())
+            return
+        if not (hasattr(self.trunk_rx, 'add_call_event_listener') and hasattr(self.trunk_rx, 'add_call_listener')):
+            sys.stderr.write("%s Call recording not supported by trunking module %s; not enabled\n" % (log_ts.get(), self.trunking.__name__))
+            return
+        self.recorder = call_recorder.call_recorder(config, debug=self.verbosity)
+        for rcvr in range(len(self.channels)):
+            chan_config = self.channels[rcvr].config
+            dest = str(from_dict(chan_config, 'destination', ""))
+            if not bool(from_dict(chan_config, 'record', True)):
+                continue
+            if dest.startswith('udp://'):
+                host, port = dest[len('udp://'):].rsplit(':', 1)
+                self.recorder.add_channel(rcvr, from_dict(chan_config, 'name', str(rcvr)), host, int(port))
+            elif dest.startswith('shm://'):
+                self.recorder.add_channel(rcvr, from_dict(chan_config, 'name', str(rcvr)), None, dest)
+        players = [self.audio_instances[name].sock_audio for name in self.audio_instances if self.audio_instances[name] is not None]
+        self.recorder.start(players)
+        self.trunk_rx.add_call_event_listener(self.recorder.call_event)
+        self.trunk_rx.add_call_listener(self.recorder.call_entry)
+
     def configure_devices(self, config):
         self.devices = []
         for cfg in config:
             self.device_id_by_name[cfg['name']] = len(self.devices)
             self.devices.append(device(cfg))
 
+    def configure_sample_clock(self):
+        # unthrottled file sources run faster than realtime, so trunking must keep stream time
+        for dev in self.devices:
+            if not dev.realtime:
+                sample_clock.enable(dev.start_ts)
+                self.set_interactive(False) # this is non-interactive 'replay' session 
+                sys.stderr.write("%s Batch replay: trunking time follows device [%s] symbol count from %s\n" % (log_ts.get(), dev.name, log_ts.get(dev.start_ts)))
+                return
+
     def find_device(self, chan):
         if 'device' in chan and (chan['device'] != "") and (chan['device'] in self.device_id_by_name):
             dev_id = self.device_id_by_name[chan['device']]
@@ -763,22 +1104,99 @@ class rx_block (gr.top_block):
                 msgq_id = -1 - len(self.channels)
                 chan = channel(cfg, dev, self.verbosity, msgq_id, self.rx_q, self)
                 self.channels.append(chan)
-            if ("raw_input" in cfg) and (cfg['raw_input'] != ""):
-                sys.stderr.write("%s Reading raw symbols from file: %s\n" % (log_ts.get(), cfg['raw_input']))
-                chan.raw_file = blocks.file_source(gr.sizeof_char, str(cfg['raw_input']), False)
-                if ("raw_seek" in cfg) and (cfg['raw_seek'] != 0):
-                    chan.raw_file.seek(int(cfg['raw_seek']) * 4800, 0)
+            self.connect_channel(chan, dev, cfg)
+
+    def find_device_config(self, chan, devices):
+        if 'device' in chan and (chan['device'] != ""):
+            for idx in range(len(devices)):
+                if devices[idx]['name'] == chan['device']:
+                    return idx
+
+        if 'frequency' in chan and (chan['frequency'] != ""):
+            for idx in range(len(devices)):
+                d = abs(chan['frequency'] - int(from_dict(devices[idx], 'frequency', 800000000)))
+                nf = int(from_dict(devices[idx], 'rate', 0)) / 2
+                if d + 6250 <= nf:
+                    return idx
+        return None
+
+    def configure_device_processes(self, config):
+        # each device and its channels run in a worker process; channels are represented here by proxies
+        devices = config['devices']
+        placement = []
+        for cfg in config['channels']:
+            dev_idx = self.find_device_config(cfg, devices)
+            if dev_idx is None:
+                sys.stderr.write("* * * Channel '%s' not attached to any device - ignoring!\n" % from_dict(cfg, 'name', ""))
+                continue
+            if bool(from_dict(devices[dev_idx], 'tunable', False)) and dev_idx in [p[1] for p in placement]:
+                sys.stderr.write("* * * Channel '%s' cannot share a tunable device - ignoring!\n" % from_dict(cfg, 'name', ""))
+                continue
+            msgq_id = len(placement) if self.trunking is not None else -1 - len(placement)
+            placement.append((msgq_id, dev_idx, cfg))
+
+        workers = {}
+        for dev_idx in range(len(devices)):
+            chans = [(msgq_id, cfg) for (msgq_id, idx, cfg) in placement if idx == dev_idx]
+            if len(chans) == 0:
+                continue
+            workers[dev_idx] = device_ipc.device_worker(devices[dev_idx], chans, config, self.verbosity, self.rx_q, self.ui_in_q)
+            self.device_workers.append(workers[dev_idx])
+
+        for (msgq_id, dev_idx, cfg) in placement:
+            chan = workers[dev_idx].add_channel(msgq_id, cfg)
+            self.channels.append(chan)
+            if self.trunking is not None:
+                meta_s, meta_q = None, None
+                if self.metadata is not None and 'meta_stream_name' in cfg and cfg['meta_stream_name'] != "" and cfg['meta_stream_name'] in self.meta_streams:
+                    meta_s, meta_q = self.meta_streams[cfg['meta_stream_name']]
+                self.trunk_rx.add_receiver(msgq_id, config=cfg, meta_q=meta_q, freq=chan.frequency)
+
+    def connect_channel(self, chan, dev, cfg):
+        if chan.ring is not None:
+            self.ring_channels[chan.msgq_id] = chan
+        if ("raw_input" in cfg) and (cfg['raw_input'] != ""):
+            sys.stderr.write("%s Reading raw symbols from file: %s\n" % (log_ts.get(), cfg['raw_input']))
+            chan.raw_file = blocks.file_source(gr.sizeof_char, str(cfg['raw_input']), False)
+            if ("raw_seek" in cfg) and (cfg['raw_seek'] != 0):
+                chan.raw_file.seek(int(cfg['raw_seek']) * 4800, 0)
+            if dev.realtime:
                 chan.throttle = blocks.throttle(gr.sizeof_char, chan.symbol_rate)
                 chan.throttle.set_max_noutput_items(int(chan.symbol_rate/50));
                 self.connect(chan.raw_file, chan.throttle)
                 self.connect(chan.throttle, chan.decoder)
-                self.set_interactive(False) # this is non-interactive 'replay' session 
+                if chan.ring is not None:
+                    self.connect(chan.throttle, chan.ring)
+            else:
+                self.connect(chan.raw_file, chan.decoder)
+                if chan.ring is not None:
+                    self.connect(chan.raw_file, chan.ring)
+            self.set_interactive(False) # this is non-interactive 'replay' session 
+        else:
+            if dev.sample_counter is not None and not dev.sample_counter_attached:
+                self.connect(dev.src, dev.sample_counter)
+                dev.sample_counter_attached = True
+            if dev.recorder is not None and not dev.recorder_attached:
+                self.connect(dev.src, dev.recorder)
+                dev.recorder_attached = True
+            if chan.selector is not None:
+                self.connect_channelizer(dev, chan)
+                self.connect(chan.selector, chan.demod, chan.decoder)
             else:
                 self.connect(dev.src, chan.demod, chan.decoder)
-                if ("raw_output" in cfg) and (cfg['raw_output'] != ""):
-                    sys.stderr.write("%s Saving raw symbols to file: %s\n" % (log_ts.get(), cfg['raw_output']))
-                    chan.raw_sink = blocks.file_sink(gr.sizeof_char, str(cfg['raw_output']))
-                    self.connect(chan.demod, chan.raw_sink)
+            if chan.ring is not None:
+                self.connect(chan.demod, chan.ring)
+            if ("raw_output" in cfg) and (cfg['raw_output'] != ""):
+                sys.stderr.write("%s Saving raw symbols to file: %s\n" % (log_ts.get(), cfg['raw_output']))
+                chan.raw_sink = blocks.file_sink(gr.sizeof_char, str(cfg['raw_output']))
+                self.connect(chan.demod, chan.raw_sink)
+
+    def connect_channelizer(self, dev, chan):
+        if not dev.channelizer_attached:
+            self.connect(dev.src, dev.channelizer)
+            dev.channelizer_attached = True
+        for i in range(dev.channelizer.get_nchans()):
+            self.connect((dev.channelizer, i), (chan.selector, i))
 
     def scan_channels(self):
         for chan in self.channels:
@@ -792,19 +1210,9 @@ class rx_block (gr.top_block):
             return False
 
         chan = self.channels[tuner]
-        if 'sigtype' in params and params['sigtype'] == "P25": # P25 specific config
-            chan.configure_p25_tdma(params)
-
-        if not chan.set_freq(params['freq']):
-            chan.control({'tuner': chan.msgq_id, 'cmd': 'set_slotid', 'slotid': 0})
+        if not chan.tune(params):
             return False
 
-        if 'slot' in params:
-            chan.control({'tuner': chan.msgq_id, 'cmd': 'set_slotid', 'slotid': params['slot']})
-
-        if 'rate' in params:
-            chan.set_rate(params['rate'])
-
         if 'chan' in params:
             self.trunk_rx.receivers[tuner].current_chan = params['chan']
 
@@ -826,8 +1234,36 @@ class rx_block (gr.top_block):
             chan.control(params)
 
     def nbfm_control(self, msgq_id, action):
-        if (msgq_id >= 0 and msgq_id < len(self.channels)) and self.channels[msgq_id].nbfm is not None:
-            self.channels[msgq_id].nbfm.control(action)
+        if (msgq_id >= 0 and msgq_id < len(self.channels)):
+            self.channels[msgq_id].nbfm_control(action)
+
+    def annotate_call(self, entry):         # mark calls in IQ recordings
+        rcvr = entry['rcvr']
+        if rcvr >= 0 and rcvr < len(self.channels):
+            self.channels[rcvr].annotate_call(entry)
+
+    def mix_priority(self, entry):          # duck audio mixer streams by talkgroup priority
+        rcvr = entry['rcvr']
+        if rcvr < 0 or rcvr >= len(self.channels):
+            return
+        dest = str(from_dict(self.channels[rcvr].config, 'destination', ""))
+        if not dest.startswith('udp://'):
+            return
+        port = int(dest.split(':')[-1])
+        for mixer in self.audio_mixers:
+            mixer.set_stream_priority(port, entry['prio'])
+            mixer.set_stream_priority(port + 2, entry['prio'])  # second dmr/tdma slot
+
+    def process_rxq(self, msg):             # Handle decoder messages
+        self.ring_check(msg)
+        self.trunk_rx.process_qmsg(msg)
+
+    def ring_check(self, msg):
+        if len(self.ring_channels) == 0:
+            return
+        msgq_id = int(msg.arg1()) >> 1
+        if msgq_id in self.ring_channels:
+            self.ring_channels[msgq_id].ring_msg(ctypes.c_int16(msg.type() & 0xffff).value)
 
     def process_qmsg(self, msg):            # Handle UI requests
         RX_COMMANDS = 'skip lockout hold whitelist reload'.split()
@@ -894,7 +1330,7 @@ class rx_block (gr.top_block):
             #msgq_id = int(msg.arg2())
             #self.find_channel(msgq_id).decoder.control(json.dumps({'tuner': msgq_id, 'cmd': 'dump_buffer'}))
             for chan in self.channels:
-                chan.decoder.control(json.dumps({'tuner': chan.msgq_id, 'cmd': 'dump_buffer'}))
+                chan.dump_buffer()
         elif s == 'watchdog':
             if self.ui_last_update > 0 and (time.time() > (self.ui_last_update + self.ui_timeout)):
                 self.ui_last_update = 0
@@ -917,13 +1353,19 @@ class rx_block (gr.top_block):
         if not self.ui_in_q.full_p():
             self.ui_in_q.insert_tail(msg)
 
+    def check_overruns(self):               # periodic housekeeping, independent of the ui message queue
+        now = time.time()
+        for dev in self.devices:
+            dev.check_overruns(now)
+
     def ui_freq_update(self):
         if self.trunking is None or self.trunk_rx is None:
             return False
         params = json.loads(self.trunk_rx.get_chan_status())   # extract data from all channels
         for rx_id in params['channels']:                       # iterate and convert stream name to url
-            params[rx_id]['ppm'] = self.find_channel(int(rx_id)).device.get_ppm()
-            params[rx_id]['capture'] = False if self.find_channel(int(rx_id)).raw_sink is None else True
+            params[rx_id]['ppm'] = self.find_channel(int(rx_id)).get_ppm()
+            params[rx_id]['capture'] = self.find_channel(int(rx_id)).is_capturing()
+            params[rx_id]['overruns'] = self.find_channel(int(rx_id)).get_overruns()
             params[rx_id]['error'] = self.find_channel(int(rx_id)).get_error()
             s_name = params[rx_id]['stream']
             if s_name not in self.meta_streams:
@@ -941,9 +1383,7 @@ class rx_block (gr.top_block):
 
         filenames = []
         for chan in self.channels:
-            for sink in chan.sinks:
-                if chan.sinks[sink][0].gnuplot.filename is not None:
-                    filenames.append(chan.sinks[sink][0].gnuplot.filename)
+            filenames += chan.get_plot_files()
         d = {'json_type': 'rx_update', 'files': filenames}
         msg = gr.message().make_from_string(json.dumps(d), -4, 0, 0)
         if not self.ui_in_q.full_p():
@@ -961,13 +1401,82 @@ class rx_block (gr.top_block):
             if self.meta_streams[meta_s] is not None:
                 self.meta_streams[meta_s][0].stop()
 
+        if self.recorder is not None:
+            self.recorder.stop()
+            self.recorder = None
+
         if self.terminal is not None:
             self.terminal.end_terminal()
 
+        for worker in self.device_workers:
+            worker.stop()
+
+    def start(self):
+        if len(self.device_workers) > 0:    # all dsp runs in the device worker processes
+            return
+        gr.top_block.start(self)
+
     def stop(self):
         sys.stderr.write("%s rx_block::stop() flowgraph stop called\n" % log_ts.get())
         self.kill()
-        gr.top_block.stop(self)
+        if len(self.device_workers) == 0:
+            gr.top_block.stop(self)
+            self.close_recorders()
+
+    def close_recorders(self):
+        # IQ recorders are finished only after the flowgraph has stopped writing to them
+        recorders = [dev.recorder for dev in self.devices if dev.recorder is not None]
+        if len(recorders) == 0:
+            return
+        gr.top_block.wait(self)
+        for recorder in recorders:
+            recorder.close()
+
+class device_block(rx_block):
+    """
+    Flowgraph for a single device and its channels.  Used by the worker
+    processes started when 'device_processes' is enabled; trunking, audio,
+    metadata and the terminal remain with the controlling rx_block.
+    """
+    def __init__(self, verbosity, dev_config, chan_configs, terminal_config = None):
+        gr.top_block.__init__(self)
+        self.verbosity = verbosity
+        self.config = dev_config
+        self.interactive = True
+        self.trunking = None
+        self.device_workers = []
+        self.audio_instances = {}
+        self.meta_streams = {}
+        self.terminal = None
+        self.terminal_type = None
+        self.rx_q = gr.msg_queue(100)
+        self.ui_in_q = gr.msg_queue(100)
+
+        if terminal_config is not None:     # plot settings follow the controller's terminal
+            term_type = str(from_dict(terminal_config, 'terminal_type', "curses"))
+            if term_type == 'curses':
+                self.terminal_type = "curses"
+            elif term_type[:1].isdigit():
+                self.terminal_type = "udp"
+            elif term_type.startswith('http:'):
+                self.terminal_type = "http"
+            self.curses_plot_interval = float(from_dict(terminal_config, 'curses_plot_interval', 0.0))
+            self.http_plot_interval = float(from_dict(terminal_config, 'http_plot_interval', 1.0))
+            self.http_plot_directory = str(from_dict(terminal_config, 'http_plot_directory', "../www/images"))
+
+        self.device = device(dev_config)
+        self.devices = [self.device]
+        self.channels = []
+        self.channel_by_id = {}
+        self.ring_channels = {}
+        for msgq_id, cfg in chan_configs:
+            chan = channel(cfg, self.device, verbosity, msgq_id, self.rx_q, self)
+            self.channels.append(chan)
+            self.channel_by_id[msgq_id] = chan
+            self.connect_channel(chan, self.device, cfg)
+
+    def find_channel(self, msgq_id):
+        return self.channel_by_id[msgq_id]
 
 # data unit receive queue
 #
@@ -1062,11 +1571,13 @@ class rx_main(object):
             if self.tb.get_interactive():
                 while self.keep_running:
                     time.sleep(1.0)
+                    self.tb.check_overruns()
                     msg = gr.message().make_from_string("watchdog", -2, 0, 0)
                     if not self.tb.ui_out_q.full_p():
                        self.tb.ui_out_q.insert_tail(msg)
             else:
                 self.tb.wait() # curiously wait() matures when a flowgraph gets locked
+                self.tb.close_recorders()
             sys.stderr.write('Flowgraph complete. Exiting\n')
         except (KeyboardInterrupt):
             self.tb.stop()
@@ -0,0 +1,102 @@
+#
+# OP25 Shared Device Channelizer Block
+#
+# This file is part of GNU Radio and part of OP25
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# It is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+"""
+OP25 Shared Device Channelizer Block
+
+Splits the wideband stream of one SDR device into evenly spaced
+narrowband bins using a single polyphase filterbank.  Each channel
+attached to the device selects the bin nearest its frequency and only
+has to remove the small residual offset at the (much lower) bin rate,
+so the full-rate filtering is performed once per device rather than
+once per channel.
+"""
+
+import sys
+from gnuradio import gr
+from gnuradio import filter, blocks
+from gnuradio.fft import window
+from log_ts import log_ts
+import tap_cache
+
+_def_chan_bw = 24000    # widest channel (if_rate) the bins must carry
+_def_oversample = 2     # bin output rate is this multiple of the bin spacing
+
+class op25_channelizer_c(gr.hier_block2):
+    def __init__(self, name, input_rate, chan_bw = _def_chan_bw, usable_bw = 1.0, debug = 0):
+
+        # bin spacing must be at least twice the channel bandwidth so that a
+        # channel lying on a bin edge still fits inside that bin's passband
+        nchans = int(input_rate // (2 * chan_bw))
+        nchans -= nchans % _def_oversample
+        if nchans < _def_oversample:
+            nchans = _def_oversample
+
+        gr.hier_block2.__init__(self, "op25_channelizer_c",
+                                gr.io_signature(1, 1, gr.sizeof_gr_complex),            # Input signature
+                                gr.io_signature(nchans, nchans, gr.sizeof_gr_complex))  # Output signature
+
+        self.name = name
+        self.debug = debug
+        self.input_rate = input_rate
+        self.usable_bw = usable_bw
+        self.chan_bw = chan_bw
+        self.nchans = nchans
+        self.spacing = float(input_rate) / nchans
+        self.output_rate = self.spacing * _def_oversample
+
+        # prototype filter passes a full channel at the bin edge, and stops
+        # before the band that would alias into it at the bin output rate
+        pass_edge = (self.spacing / 2) + (chan_bw / 2)
+        stop_edge = self.output_rate - pass_edge
+        self.taps = tap_cache.low_pass(1.0, input_rate, (pass_edge + stop_edge) / 2, stop_edge - pass_edge, window.WIN_HAMMING)
+        self.pfb = filter.pfb.channelizer_ccf(nchans, self.taps, _def_oversample)
+
+        self.connect(self, self.pfb)
+        for i in range(nchans):
+            self.connect((self.pfb, i), (self, i))
+
+        sys.stderr.write("%s [%s] channelizer: input_rate=%d, bins=%d, spacing=%d, bin_rate=%d, taps=%d (%d per arm)\n" % (log_ts.get(), name, input_rate, nchans, self.spacing, self.output_rate, len(self.taps), (len(self.taps) + nchans - 1) // nchans))
+
+    def get_output_rate(self):
+        return self.output_rate
+
+    def get_nchans(self):
+        return self.nchans
+
+    def find_bin(self, freq):
+        """
+        Map a frequency offset (Hz, relative to the device center) to a bin.
+        Returns a tuple (bin index, residual offset from bin center) or None
+        if the offset lies outside the usable device bandwidth.
+        """
+        if abs(freq) > (((self.input_rate * self.usable_bw) / 2) - (self.chan_bw / 2)):
+            return None
+        k = int(round(freq / self.spacing))
+        residual = freq - (k * self.spacing)
+        return (k % self.nchans, residual)
+
+    def make_selector(self):
+        """
+        Create a per-channel bin selector.  The caller is responsible for
+        connecting every channelizer output to the matching selector input.
+        """
+        return blocks.selector(gr.sizeof_gr_complex, 0, 0)
@@ -28,6 +28,7 @@ import sys
 from gnuradio import gr
 from gnuradio import blocks
 import gnuradio.op25_repeater as op25_repeater
+import iq_capture
 from log_ts import log_ts
 
 
@@ -47,8 +48,11 @@ class op25_iqsrc_c(gr.hier_block2):
         self.config = config
         self.name = name
         self.is_dsd_file = False
+        self.is_sigmf_file = False
         self.freq = 0
         self.ts = 0
+        self.ppm = None
+        self.offset = None
 
         sys.stderr.write("%s [%s] Enabling IQ file source\n" % (log_ts.get(), name))
 
@@ -58,24 +62,42 @@ class op25_iqsrc_c(gr.hier_block2):
         self.iq_size = int(from_dict(config, 'iq_size', 1))
         self.iq_signed  = bool(from_dict(config, 'iq_signed', False))
         self.rate = int(from_dict(config, 'rate', 2400000))
+        self.realtime = bool(from_dict(config, 'throttle', True))
 
         # Create the source block
-        self.iqsrc = op25_repeater.iqfile_source(self.iq_size, self.iq_file, self.iq_signed, self.iq_seek, 0)
-        if self.iqsrc.is_dsd():
+        if iq_capture.is_sigmf(self.iq_file):
+            self.iqsrc = iq_capture.sigmf_source(self.iq_file, self.iq_seek)
+            self.is_sigmf_file = True
+            self.rate = self.iqsrc.get_sample_rate()
+            self.freq = self.iqsrc.get_center_freq()
+            self.ts = self.iqsrc.get_ts()
+            self.ppm = self.iqsrc.get_ppm()
+            self.offset = self.iqsrc.get_offset()
+            sys.stderr.write("%s [%s] SigMF recording: rate %d, center frequency %f\n" % (log_ts.get(), name, self.rate, self.freq/1e6))
+        else:
+            self.iqsrc = op25_repeater.iqfile_source(self.iq_size, self.iq_file, self.iq_signed, self.iq_seek, 0)
+        if not self.is_sigmf_file and self.iqsrc.is_dsd():
             self.is_dsd_file = True
             self.rate = self.iqsrc.get_dsd_rate()
             self.freq = self.iqsrc.get_dsd_freq()
             self.ts = self.iqsrc.get_dsd_ts()
 
-        # Create the throttle to set playback rate
-        self.throttle = blocks.throttle(gr.sizeof_gr_complex, self.rate)
+        if self.realtime:
+            # Create the throttle to set playback rate
+            self.throttle = blocks.throttle(gr.sizeof_gr_complex, self.rate)
 
-        # Connect src and throttle
-        self.connect(self.iqsrc, self.throttle, self)            
+            # Connect src and throttle
+            self.connect(self.iqsrc, self.throttle, self)            
+        else:
+            # Batch mode: decode as fast as possible
+            self.throttle = None
+            self.connect(self.iqsrc, self)
+            sys.stderr.write("%s [%s] IQ file source is unthrottled (batch mode)\n" % (log_ts.get(), name))
 
     def set_sample_rate(self, iq_rate):
         self.rate = iq_rate
-        self.throttle.set_sample_rate(self.rate)
+        if self.throttle is not None:
+            self.throttle.set_sample_rate(self.rate)
 
     def get_sample_rate(self):
         return self.rate
@@ -92,6 +114,18 @@ class op25_iqsrc_c(gr.hier_block2):
     def get_ts(self):
         return self.ts
 
+    def is_realtime(self):
+        return self.realtime
+
     def is_dsd(self):
         return self.is_dsd_file
 
+    def is_sigmf(self):
+        return self.is_sigmf_file
+
+    def get_ppm(self):
+        return self.ppm
+
+    def get_offset(self):
+        return self.offset
+
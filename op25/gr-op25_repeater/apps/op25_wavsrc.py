@@ -52,6 +52,7 @@ class op25_wavsrc_f(gr.hier_block2):
         self.wav_file = str(from_dict(config, 'wav_file', ""))
         self.wav_size = int(from_dict(config, 'wav_size', 1))
         self.wav_gain = float(from_dict(config, 'wav_gain', 1.0))
+        self.realtime = bool(from_dict(config, 'throttle', True))
 
         # Create the source block
         self.wavsrc = blocks.wavfile_source(self.wav_file)
@@ -61,15 +62,21 @@ class op25_wavsrc_f(gr.hier_block2):
 
         sys.stderr.write("%s [%s] Enabling WAV file source: rate=%d, bit=%d, channels=%d\n" % (log_ts.get(), name, self.rate, self.size, self.chans))
 
-        # Create the throttle to set playback rate
-        self.throttle = blocks.throttle(gr.sizeof_float, self.rate)
-
         # Gain
         self.gain = blocks.multiply_const_ff(self.wav_gain)
         self.agc = op25_repeater.rmsagc_ff(alpha=0.001, k=1.0)
 
-        # Connect src and throttle
-        self.connect(self.wavsrc, self.throttle, self.agc, self.gain, self)            
+        if self.realtime:
+            # Create the throttle to set playback rate
+            self.throttle = blocks.throttle(gr.sizeof_float, self.rate)
+
+            # Connect src and throttle
+            self.connect(self.wavsrc, self.throttle, self.agc, self.gain, self)            
+        else:
+            # Batch mode: decode as fast as possible
+            self.throttle = None
+            self.connect(self.wavsrc, self.agc, self.gain, self)
+            sys.stderr.write("%s [%s] WAV file source is unthrottled (batch mode)\n" % (log_ts.get(), name))
 
     def get_sample_rate(self):
         return self.rate;
@@ -83,3 +90,8 @@ class op25_wavsrc_f(gr.hier_block2):
     def get_center_freq(self):
         return self.freq
 
+    def get_ts(self):
+        return 0
+
+    def is_realtime(self):
+        return self.realtime
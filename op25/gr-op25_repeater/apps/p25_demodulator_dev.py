@@ -38,6 +38,7 @@ import pmt
 import gnuradio.op25 as op25
 import gnuradio.op25_repeater as op25_repeater
 import rms_agc
+import tap_cache
 from math import pi, isnan, isinf
 from log_ts import log_ts
 
@@ -67,6 +68,8 @@ _def_mu = 0.5
 _def_freq_error = 0.0
 _def_omega_relative_limit = 0.005
 
+_def_xlat_mode = 'fir'
+
 TWO_PI = 2.0 * pi
 
 # /////////////////////////////////////////////////////////////////////////////
@@ -91,6 +94,32 @@ def get_decim(speed):
         return decim, decim2
     return None
 
+class fft_xlating_filter_ccf(gr.hier_block2):
+    def __init__(self, decimation, taps, center_freq, sampling_freq):
+        """
+        Frequency translating, decimating filter built from a rotator and a
+        fast-convolution (overlap-save) fft filter.  Drop-in replacement for
+        filter.freq_xlating_fir_filter_ccf when the translating taps are long.
+
+        @param sampling_freq: sample rate of complex input
+        @type sampling_freq: int
+        """
+        gr.hier_block2.__init__(self, "fft_xlating_filter_ccf",
+                                gr.io_signature(1, 1, gr.sizeof_gr_complex),  # Input signature
+                                gr.io_signature(1, 1, gr.sizeof_gr_complex))  # Output signature
+        self.sampling_freq = sampling_freq
+        self.rotator = blocks.rotator_cc(0.0)
+        self.fft_filter = filter.fft_filter_ccf(decimation, taps)
+        self.connect(self, self.rotator, self.fft_filter, self)
+        self.set_center_freq(center_freq)
+
+    def set_center_freq(self, freq):
+        self.center_freq = freq
+        self.rotator.set_phase_inc(-TWO_PI * freq / self.sampling_freq)
+
+    def set_taps(self, taps):
+        self.fft_filter.set_taps(taps)
+
 class p25_demod_base(gr.hier_block2):
     def __init__(self,
                  msgq_id = 0,
@@ -111,21 +140,22 @@ class p25_demod_base(gr.hier_block2):
         self.symbol_rate = symbol_rate
         self.bb_sink = {}
         self.bb_tuner_sink = {}
+        self.suspended = False
         self.spiir = filter.single_pole_iir_filter_ff(0.0001)
 
         #self.switch = blocks.copy(gr.sizeof_gr_complex)
         self.switch = blocks.copy(gr.sizeof_float)
         self.null_sink = blocks.null_sink(gr.sizeof_float)
         self.baseband_amp = blocks.multiply_const_ff(_def_bb_gain)
-        coeffs = op25_c4fm_mod.c4fm_taps(sample_rate=self.if_rate, span=9, generator=op25_c4fm_mod.transfer_function_rx).generate()
+        coeffs = tap_cache.c4fm(self.if_rate, 9, op25_c4fm_mod.transfer_function_rx)
         sps = self.if_rate // self.symbol_rate
         if filter_type == 'rrc':
             ntaps = 7 * sps
             if ntaps & 1 == 0:
                 ntaps += 1
-            coeffs = filter.firdes.root_raised_cosine(1.0, self.if_rate, self.symbol_rate, excess_bw, ntaps)
+            coeffs = tap_cache.root_raised_cosine(1.0, self.if_rate, self.symbol_rate, excess_bw, ntaps)
         if filter_type == 'nxdn':
-            coeffs = op25_c4fm_mod.c4fm_taps(sample_rate=self.if_rate, span=9, generator=op25_c4fm_mod.transfer_function_nxdn, symbol_rate=self.symbol_rate).generate()
+            coeffs = tap_cache.c4fm(self.if_rate, 9, op25_c4fm_mod.transfer_function_nxdn, symbol_rate=self.symbol_rate)
             gain_adj = 1.8	# for nxdn48 6.25 KHz
             if self.symbol_rate == 4800:
                gain_adj = 0.77	# nxdn96 12.5 KHz
@@ -160,7 +190,7 @@ class p25_demod_base(gr.hier_block2):
             ntaps = 7 * sps
             if ntaps & 1 == 0:
                 ntaps += 1
-            coeffs = filter.firdes.root_raised_cosine(1.0, self.if_rate, self.symbol_rate, excess_bw, ntaps)
+            coeffs = tap_cache.root_raised_cosine(1.0, self.if_rate, self.symbol_rate, excess_bw, ntaps)
             self.fsk4_demod = digital.clock_recovery_mm_ff(sps, 0.1, 0.5, 0.05, 0.005)
             self.baseband_amp = op25_repeater.rmsagc_ff(alpha=0.01, k=1.0)
             self.symbol_filter = filter.fir_filter_fff(1, coeffs)
@@ -169,14 +199,14 @@ class p25_demod_base(gr.hier_block2):
             ntaps = 7 * sps
             if ntaps & 1 == 0:
                 ntaps += 1
-            coeffs = filter.firdes.root_raised_cosine(1.0, self.if_rate, self.symbol_rate, excess_bw, ntaps)
+            coeffs = tap_cache.root_raised_cosine(1.0, self.if_rate, self.symbol_rate, excess_bw, ntaps)
             autotuneq = gr.msg_queue(2)
             self.fsk4_demod = op25.fsk4_demod_ff(autotuneq, self.if_rate, self.symbol_rate, True)
             self.baseband_amp = op25_repeater.rmsagc_ff(alpha=0.01, k=1.0)
             self.symbol_filter = filter.fir_filter_fff(1, coeffs)
             self.slicer = digital.binary_slicer_fb()
         elif filter_type == "widepulse":
-            coeffs = op25_c4fm_mod.c4fm_taps(sample_rate=self.if_rate, span=9, generator=op25_c4fm_mod.transfer_function_rx).generate(rate_multiplier = 2.0)
+            coeffs = tap_cache.c4fm(self.if_rate, 9, op25_c4fm_mod.transfer_function_rx, rate_multiplier = 2.0)
             self.symbol_filter = filter.fir_filter_fff(1, coeffs)
             autotuneq = gr.msg_queue(2)
             self.fsk4_demod = op25.fsk4_demod_ff(autotuneq, self.if_rate, self.symbol_rate)
@@ -248,8 +278,20 @@ class p25_demod_base(gr.hier_block2):
     def set_tdma(self, enabled = True):
         pass 
 
+    def suspend(self):
+        # gate the demodulator at its input so that no downstream block is scheduled while idle
+        self.switch.set_enabled(False)
+        self.suspended = True
+
+    def resume(self):
+        self.switch.set_enabled(True)
+        self.suspended = False
+
     def control(self, enabled = True):
-        self.switch.set_enabled(enabled)
+        if enabled and self.suspended:
+            self.resume()
+        elif not enabled and not self.suspended:
+            self.suspend()
 
 class p25_demod_fb(p25_demod_base):
 
@@ -338,13 +380,16 @@ class p25_demod_cb(p25_demod_base):
                  if_rate        = _def_if_rate,
                  gain_mu        = _def_gain_mu,
                  costas_alpha   = _def_costas_alpha,
-                 symbol_rate    = _def_symbol_rate):
+                 symbol_rate    = _def_symbol_rate,
+                 xlat_mode      = _def_xlat_mode):
         """
         Hierarchical block for P25 demodulation.
 
         The complex input is tuned, decimated and demodulated
         @param input_rate: sample rate of complex input channel
         @type input_rate: int
+        @param xlat_mode: channel translating filter: 'fir' (default) or 'fft'
+        @type xlat_mode: str
         """
         self.msgq_id = msgq_id
         self.debug = debug
@@ -380,10 +425,14 @@ class p25_demod_cb(p25_demod_base):
         resampled_rate = float(input_rate) / float(decimation)
         fdma_cutoff = fdma_cutoff if ((resampled_rate//2) >= fdma_cutoff) else (resampled_rate//2)          # sanity-check cutoffs to ensure they are less than the nyquist frequency
         tdma_cutoff = tdma_cutoff if ((resampled_rate//2) >= tdma_cutoff) else (resampled_rate//2)
-        freq_xlat_coeffs = filter.firdes.low_pass(1.0, input_rate, resampled_rate/2, resampled_rate/2)      # taps can be very long for wideband SDR hardware so maximize transition width
-        self.if_coeffs_fdma = filter.firdes.low_pass(1.0, resampled_rate, fdma_cutoff, trans_width, window.WIN_HAMMING)
-        self.if_coeffs_tdma = filter.firdes.low_pass(1.0, resampled_rate, tdma_cutoff, trans_width, window.WIN_HAMMING)
-        self.freq_xlat = filter.freq_xlating_fir_filter_ccf(decimation, freq_xlat_coeffs, 0, input_rate)    # freq_xlat extracts the approximate channel, sampled at or near the if_rate
+        freq_xlat_coeffs = tap_cache.low_pass(1.0, input_rate, resampled_rate/2, resampled_rate/2)      # taps can be very long for wideband SDR hardware so maximize transition width
+        self.if_coeffs_fdma = tap_cache.low_pass(1.0, resampled_rate, fdma_cutoff, trans_width, window.WIN_HAMMING)
+        self.if_coeffs_tdma = tap_cache.low_pass(1.0, resampled_rate, tdma_cutoff, trans_width, window.WIN_HAMMING)
+        self.xlat_mode = xlat_mode if xlat_mode == 'fft' else 'fir'
+        if self.xlat_mode == 'fft':
+            self.freq_xlat = fft_xlating_filter_ccf(decimation, freq_xlat_coeffs, 0, input_rate)            # fast-convolution equivalent for long taps
+        else:
+            self.freq_xlat = filter.freq_xlating_fir_filter_ccf(decimation, freq_xlat_coeffs, 0, input_rate)    # freq_xlat extracts the approximate channel, sampled at or near the if_rate
         self.if_filter = filter.fir_filter_ccf(1, self.if_coeffs_tdma)                                      # if_filter rejects adjacent channel inteference
         self.if_tdma = True                                                                                 # filter width dynamically selectable based on modulation type
         self.connect(self, self.switch, self.freq_xlat, self.if_filter)
@@ -397,7 +446,7 @@ class p25_demod_cb(p25_demod_base):
         sps = self.if_rate // self.symbol_rate
         gain_omega = 0.1  * gain_mu * gain_mu
 
-        sys.stderr.write("demodulator: xlator if_rate=%d, input_rate=%d, decim=%d, if taps=[%d,%d], resampled_rate=%d, sps=%d\n" % (if_rate, input_rate, decimation, len(freq_xlat_coeffs), len(self.if_coeffs_tdma), resampled_rate, sps))
+        sys.stderr.write("demodulator: xlator(%s) if_rate=%d, input_rate=%d, decim=%d, if taps=[%d,%d], resampled_rate=%d, sps=%d\n" % (self.xlat_mode, if_rate, input_rate, decimation, len(freq_xlat_coeffs), len(self.if_coeffs_tdma), resampled_rate, sps))
 
         self.agc = rms_agc.rms_agc(0.45, 0.85)
         self.fll = digital.fll_band_edge_cc(sps, excess_bw, 2*sps+1, TWO_PI/sps/350) # automatic frequency correction
@@ -0,0 +1,184 @@
+#
+# OP25 Device Sample Rate Planner
+#
+# This file is part of OP25
+#
+# OP25 is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# OP25 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OP25; see the file COPYING. If not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Boston, MA
+# 02110-1301, USA.
+
+"""
+Device sample rate and center frequency planner.
+
+Given every frequency a (non-tunable) device has to receive, i.e. the
+frequencies of its channels and the known frequencies of the trunking
+systems they follow, pick the lowest valid sample rate whose usable
+bandwidth covers them all, and a tuner center frequency that keeps the
+DC spike away from every channel.  The channel translating filters
+dominate front-end cpu and their cost grows linearly with the device
+rate, so the lowest rate that fits is also the cheapest.
+"""
+
+import sys
+from helper_funcs import from_dict, get_frequency
+from log_ts import log_ts
+
+# rtl-sdr rates known to work well
+RTL_RATES = [250000, 1000000, 1024000, 1800000, 1920000, 2000000, 2048000, 2400000, 2560000]
+
+_def_if_rate = 24000
+_def_usable_bw = 1.0
+_def_dc_guard = 12500      # minimum distance (Hz) between a channel and the tuner center
+_def_hamming_atten = 53.0  # stopband attenuation assumed by firdes for the hamming window
+
+def get_freq_list(value):
+    # accepts a list or comma separated string of frequencies in Hz or MHz
+    if value is None or value == "":
+        return []
+    if not isinstance(value, list):
+        value = str(value).split(',')
+    return [get_frequency(str(f).strip()) for f in value if str(f).strip() != ""]
+
+def xlat_cost(input_rate, if_rate = _def_if_rate):
+    """
+    Estimate the per-channel cost of the p25_demod_cb translating filter
+    at a given device rate.  Mirrors the filter design used there.
+    """
+    decim = max(1, int(input_rate / if_rate))
+    resampled_rate = float(input_rate) / decim
+    ntaps = int(_def_hamming_atten * input_rate / (22.0 * (resampled_rate / 2)))
+    if (ntaps & 1) == 0:
+        ntaps += 1
+    return {'decim': decim,
+            'resampled_rate': resampled_rate,
+            'taps': ntaps,
+            'taps_per_output': float(ntaps) / decim,
+            'mmacs': ntaps * resampled_rate / 1e6,          # complex multiply-accumulates per second (millions)
+            'resample': resampled_rate != if_rate}
+
+def place_center(freqs, rate, usable_bw = _def_usable_bw, if_rate = _def_if_rate, dc_guard = _def_dc_guard):
+    """
+    Return the tuner center frequency for 'freqs' at 'rate', or None if
+    they cannot all be received while keeping dc_guard Hz from the center.
+    """
+    half = (rate * usable_bw / 2) - (if_rate / 2)
+    lo = max(freqs) - half
+    hi = min(freqs) + half
+    if lo > hi:
+        return None
+    mid = (min(freqs) + max(freqs)) / 2.0
+    sfreqs = sorted(freqs)
+    candidates = [mid, lo, hi] + [(sfreqs[i] + sfreqs[i+1]) / 2.0 for i in range(len(sfreqs) - 1)]
+    best = None
+    for c in candidates:
+        c = min(max(c, lo), hi)
+        gap = min([abs(f - c) for f in freqs])
+        if gap < dc_guard:
+            c2 = None
+            for f in freqs:                 # try moving just clear of the nearest channel
+                for c_try in [f - dc_guard, f + dc_guard]:
+                    if lo <= c_try <= hi and min([abs(f2 - c_try) for f2 in freqs]) >= dc_guard:
+                        if c2 is None or abs(c_try - mid) < abs(c2 - mid):
+                            c2 = c_try
+            if c2 is None:
+                continue
+            c = c2
+        if best is None or abs(c - mid) < abs(best - mid):
+            best = c
+    return None if best is None else int(round(best))
+
+def plan(freqs, rates, usable_bw = _def_usable_bw, if_rate = _def_if_rate, dc_guard = _def_dc_guard):
+    """Return the plan for the lowest rate in 'rates' that covers 'freqs', or None."""
+    if len(freqs) == 0:
+        return None
+    for rate in sorted(rates):
+        center = place_center(freqs, rate, usable_bw, if_rate, dc_guard)
+        if center is None:
+            continue
+        mid = int(round((min(freqs) + max(freqs)) / 2.0))
+        return {'rate': rate,
+                'frequency': mid,
+                'offset': center - mid,
+                'center': center,
+                'span': max(freqs) - min(freqs),
+                'channels': len(freqs),
+                'cost': xlat_cost(rate, if_rate)}
+    return None
+
+def device_frequencies(dev_cfg, config):
+    # frequencies of channels on the device plus the known frequencies of their trunking systems
+    freqs = get_freq_list(from_dict(dev_cfg, 'plan_frequencies', None))
+    sysnames = []
+    for chan in config.get('channels', []):
+        if from_dict(chan, 'device', "") != dev_cfg['name']:
+            continue
+        if 'frequency' in chan and chan['frequency'] != "":
+            freqs.append(get_frequency(chan['frequency']))
+        if from_dict(chan, 'trunking_sysname', "") != "":
+            sysnames.append(chan['trunking_sysname'])
+    trunking = config.get('trunking', {})
+    for tchan in (trunking.get('chans', []) if isinstance(trunking, dict) else []):
+        if from_dict(tchan, 'sysname', None) in sysnames:
+            freqs += get_freq_list(from_dict(tchan, 'control_channel_list', None))
+    return sorted(set(freqs))
+
+def device_rates(dev_cfg):
+    rates = from_dict(dev_cfg, 'plan_rates', None)
+    if rates is not None:
+        return [int(float(r)) for r in (rates if isinstance(rates, list) else str(rates).split(','))]
+    if str(dev_cfg['args']).startswith('rtl'):
+        return RTL_RATES
+    return [int(dev_cfg['rate'])]
+
+def format_plan(name, p, configured_rate = None, if_rate = _def_if_rate):
+    c = p['cost']
+    s = "[%s] plan: rate=%d, frequency=%d, offset=%d (tuner %d), span=%d Hz, %d freqs; per channel: decim=%d, xlat taps=%d (%.1f per output), %.2f MMAC/s%s" % (
+        name, p['rate'], p['frequency'], p['offset'], p['center'], p['span'], p['channels'],
+        c['decim'], c['taps'], c['taps_per_output'], c['mmacs'], ", arb resampler" if c['resample'] else "")
+    if configured_rate is not None and int(configured_rate) != p['rate']:
+        c0 = xlat_cost(int(configured_rate), if_rate)
+        s += "; configured rate %d costs %.2f MMAC/s (%.0f%%)" % (int(configured_rate), c0['mmacs'], 100.0 * p['cost']['mmacs'] / c0['mmacs'] if c0['mmacs'] > 0 else 0)
+    return s
+
+def plan_devices(config, apply = True):
+    """
+    Plan every device with "plan": true and, if 'apply', replace its rate,
+    frequency and offset.  Returns a dict of device name to plan.
+    """
+    plans = {}
+    for dev_cfg in config.get('devices', []):
+        if not bool(from_dict(dev_cfg, 'plan', False)):
+            continue
+        if_rate = _def_if_rate
+        for chan in config.get('channels', []):
+            if from_dict(chan, 'device', "") == dev_cfg['name']:
+                if_rate = max(if_rate, int(from_dict(chan, 'if_rate', _def_if_rate)))
+        freqs = device_frequencies(dev_cfg, config)
+        if len(freqs) == 0:
+            sys.stderr.write("%s [%s] plan: no channel or trunking frequencies known; using configured rate and frequency\n" % (log_ts.get(), dev_cfg['name']))
+            continue
+        p = plan(freqs, device_rates(dev_cfg),
+                 usable_bw = float(from_dict(dev_cfg, 'usable_bw_pct', _def_usable_bw)),
+                 if_rate = if_rate,
+                 dc_guard = int(from_dict(dev_cfg, 'plan_dc_guard', _def_dc_guard)))
+        if p is None:
+            sys.stderr.write("%s [%s] plan: span %d Hz does not fit any allowed rate; using configured rate and frequency\n" % (log_ts.get(), dev_cfg['name'], max(freqs) - min(freqs)))
+            continue
+        sys.stderr.write("%s %s\n" % (log_ts.get(), format_plan(dev_cfg['name'], p, from_dict(dev_cfg, 'rate', None), if_rate)))
+        plans[dev_cfg['name']] = p
+        if apply:
+            dev_cfg['rate'] = p['rate']
+            dev_cfg['frequency'] = p['frequency']
+            dev_cfg['offset'] = p['offset']
+    return plans
@@ -258,7 +258,8 @@ class p25_rx_block (gr.top_block):
 
         # attach meta server thread
         if self.options.metacfg is not None:
-            from icemeta import meta_server
+            from icemeta import meta_server, meta_queue
+            self.meta_q = meta_queue()     # bounded (META_QUEUE_LEN), oldest dropped when full; meta_server sends only the newest due update
             self.meta_server = meta_server(self.meta_q, self.options.metacfg, debug=self.options.verbosity)
             try:
                 with open(self.options.metacfg) as json_file:
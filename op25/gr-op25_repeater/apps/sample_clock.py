@@ -0,0 +1,53 @@
+#
+# OP25 Trunking Sample Clock
+#
+# This file is part of OP25
+#
+# OP25 is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# OP25 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OP25; see the file COPYING. If not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Boston, MA
+# 02110-1301, USA.
+
+"""
+Trunking time source.
+
+Normally this is simply the wall clock.  When a capture file is replayed
+unthrottled the flowgraph runs faster than realtime, so the clock instead
+follows the receive timestamps carried in frame_assembler messages, which
+are then derived from the number of symbols decoded.
+"""
+
+import time as _time
+
+_enabled = False
+_now = 0.0
+
+def enable(start_ts):
+    """Switch from wall clock to stream time, starting at 'start_ts'."""
+    global _enabled, _now
+    _enabled = True
+    _now = float(start_ts)
+
+def is_enabled():
+    return _enabled
+
+def update(ts):
+    """Advance stream time to a message timestamp; never runs backwards."""
+    global _now
+    if _enabled and ts > _now:
+        _now = ts
+
+def time():
+    if _enabled:
+        return _now
+    return _time.time()
@@ -29,7 +29,9 @@ import socket
 import errno
 import struct
 import ctypes
+import math
 import numpy as np
+from collections import deque
 from log_ts import log_ts
 
 # OP25 defaults
@@ -37,6 +39,25 @@ PCM_RATE = 8000             # audio sample rate (Hz)
 PCM_BUFFER_SIZE = 4000      # size of ALSA buffer in frames
 
 MAX_SUPERFRAME_SIZE = 320   # maximum size of incoming UDP audio buffer
+GAIN_SHIFT = 12             # fraction bits of the fixed point audio gain
+
+# Mixer defaults
+MIX_QUEUE_FRAMES = 25       # frames queued per stream before the oldest are discarded (0.5 sec)
+MIX_DUCK_GAIN = 0.25        # gain applied to lower priority streams while a higher priority one is heard
+MIX_DUCK_HOLD = 25          # frames ducking is held after the higher priority stream pauses (0.5 sec)
+
+# Jitter buffer defaults
+JB_FRAME_SEC = 0.02         # duration of one 160 sample frame
+JB_MIN_FRAMES = 2           # lower limit of the adaptive playout target
+JB_MAX_FRAMES = 25          # upper limit of the adaptive playout target (0.5 sec)
+JB_SLOTS = 2 * JB_MAX_FRAMES    # frames held before the oldest is discarded (overrun)
+JB_JITTER_K = 3.0           # target covers the mean lateness plus K standard deviations
+JB_ALPHA = 1.0 / 64         # smoothing of the lateness statistics
+JB_REPORT_SEC = 60.0        # seconds between statistics reports
+
+# Stream gate defaults
+GATE_LEVEL_DB = -50.0       # frames quieter than this (dBFS rms) do not hold the gate open
+GATE_HANG_SEC = 2.0         # seconds the gate stays open after the last audible frame or end of call
 
 # Debug
 LOG_AUDIO_XRUNS = True      # log audio underruns to stderr
@@ -117,6 +138,7 @@ class alsasound(object):
         self.channels = 0
         self.rate = 0
         self.framesize = 0
+        self.xruns = 0
 
     def open(self, hwdev):
         b_hwdev = create_string_buffer(str.encode(hwdev))
@@ -196,9 +218,13 @@ class alsasound(object):
         return ret
 
     def write(self, pcm_data):
-        datalen = len(pcm_data)
+        if isinstance(pcm_data, np.ndarray):    # passed by address, without copying
+            datalen = pcm_data.nbytes
+            c_data = c_void_p(pcm_data.ctypes.data)
+        else:
+            datalen = len(pcm_data)
+            c_data = c_char_p(pcm_data)
         n_frames = c_ulong(datalen // self.framesize)
-        c_data = c_char_p(pcm_data)
         ret = 0
 
         if (self.c_pcm.value == None):
@@ -208,6 +234,7 @@ class alsasound(object):
         ret = self.libasound.snd_pcm_writei(self.c_pcm, cast(c_data, POINTER(c_void_p)), n_frames)
         if (ret < 0):
             if (ret == -errno.EPIPE): # underrun
+                self.xruns += 1
                 if (LOG_AUDIO_XRUNS):
                     sys.stderr.write("%s PCM underrun\n" % log_ts.get())
                 ret = self.libasound.snd_pcm_recover(self.c_pcm, ret, 1)
@@ -229,6 +256,12 @@ class alsasound(object):
 
         return ret
 
+    def delay(self): # frames queued for playback, None if unknown
+        c_delay = c_long(0)
+        if (self.c_pcm.value == None) or (self.libasound.snd_pcm_delay(self.c_pcm, byref(c_delay)) < 0):
+            return None
+        return c_delay.value
+
     def drain(self):
         ret = self.libasound.snd_pcm_drain(self.c_pcm)
         if (ret == -errno.ESTRPIPE): # suspended
@@ -279,6 +312,7 @@ class pa_sound(object):
         self.error = c_int(0)
         self.libpa = cdll.LoadLibrary("libpulse-simple.so.0")
        	self.libpa.strerror.restype = c_char_p
+        self.libpa.pa_simple_get_latency.restype = c_uint64
         self.ss = _struct_pa_sample_spec(PA_SAMPLE_S16LE, 8000, 2)
 
     def open(self, hwdevice):
@@ -312,9 +346,16 @@ class pa_sound(object):
         return 0
 
     def write(self, pcm_data):
-        self.libpa.pa_simple_write(c_void_p(self.out), pcm_data, len(pcm_data), byref(self.error))
+        if isinstance(pcm_data, np.ndarray):    # passed by address, without copying
+            self.libpa.pa_simple_write(c_void_p(self.out), c_void_p(pcm_data.ctypes.data), pcm_data.nbytes, byref(self.error))
+        else:
+            self.libpa.pa_simple_write(c_void_p(self.out), pcm_data, len(pcm_data), byref(self.error))
         return self.error
 
+    def delay(self): # frames queued for playback
+        usec = self.libpa.pa_simple_get_latency(c_void_p(self.out), byref(self.error))
+        return usec * self.ss.rate // 1000000
+
     def drain(self):
         self.libpa.pa_simple_drain(c_void_p(self.out), byref(self.error))
         return self.error.value
@@ -375,14 +416,177 @@ class stdout_wrapper(object):
     def dump(self):
         pass
 
+# Adaptive jitter buffer between the udp receiver and the pcm writer.
+# Playout of each transmission starts once 'target' frames are queued; the target
+# follows the variance of the frame inter-arrival times.
+class jitter_buf(object):
+    def __init__(self):
+        self.slots = np.zeros((JB_SLOTS, MAX_SUPERFRAME_SIZE), dtype=np.int16)
+        self.lens = [0] * JB_SLOTS
+        self.arrival = [0.0] * JB_SLOTS
+        self.head = 0
+        self.count = 0
+        self.cond = threading.Condition()
+        self.playing = False
+        self.end_pending = False
+        self.drop_pending = False
+        self.prebuffer_start = None
+        self.last_arrival = None
+        self.gap_mean = JB_FRAME_SEC
+        self.gap_var = 0.0
+        self.target = JB_MIN_FRAMES
+        self.stats = {'frames': 0, 'underruns': 0, 'overruns': 0, 'latency_total': 0.0, 'latency_max': 0.0}
+
+    def update_target(self, now):
+        # gaps are only measured within a transmission
+        if self.last_arrival is not None:
+            diff = (now - self.last_arrival) - self.gap_mean
+            self.gap_mean += JB_ALPHA * diff
+            self.gap_var += JB_ALPHA * (diff * diff - self.gap_var)
+            target_sec = JB_JITTER_K * math.sqrt(self.gap_var)
+            self.target = min(max(int(math.ceil(target_sec / JB_FRAME_SEC)) + 1, JB_MIN_FRAMES), JB_MAX_FRAMES)
+        self.last_arrival = now
+
+    def put(self, pcm):    # copies pcm (int16 array) into the next free slot
+        now = time.time()
+        with self.cond:
+            self.update_target(now)
+            if self.count == JB_SLOTS:  # writer stalled; discard the oldest frame
+                self.head = (self.head + 1) % JB_SLOTS
+                self.count -= 1
+                self.stats['overruns'] += 1
+            tail = (self.head + self.count) % JB_SLOTS
+            self.slots[tail][:len(pcm)] = pcm
+            self.lens[tail] = len(pcm)
+            self.arrival[tail] = now
+            self.count += 1
+            if not self.playing and self.prebuffer_start is None:
+                self.prebuffer_start = now
+            self.cond.notify()
+
+    def end(self):         # end of transmission: play out what is queued, then drain
+        with self.cond:
+            self.end_pending = True
+            self.last_arrival = None
+            self.cond.notify()
+
+    def flush(self):       # discard queued audio
+        with self.cond:
+            self.head = 0
+            self.count = 0
+            self.playing = False
+            self.end_pending = False
+            self.drop_pending = True
+            self.prebuffer_start = None
+            self.last_arrival = None
+            self.cond.notify()
+
+    def stop(self):
+        with self.cond:
+            self.cond.notify()
+
+    def get(self, out, slack_fn, keep_running):
+        # returns ('frame', n) with n samples copied to out, ('silence', n), 'drain', 'drop' or None when stopped
+        with self.cond:
+            while keep_running():
+                now = time.time()
+                if self.drop_pending:
+                    self.drop_pending = False
+                    return 'drop'
+                if not self.playing:
+                    if self.count > 0 and (self.count >= self.target or self.end_pending or
+                                           now > self.prebuffer_start + (self.target + 1) * JB_FRAME_SEC):
+                        self.playing = True
+                        self.prebuffer_start = None
+                    elif self.end_pending and self.count == 0:
+                        self.end_pending = False
+                        return 'drain'
+                    else:
+                        self.cond.wait(JB_FRAME_SEC)
+                        continue
+                if self.count > 0:
+                    i = self.head
+                    n = self.lens[i]
+                    out[:n] = self.slots[i][:n]
+                    latency = now - self.arrival[i]
+                    self.stats['frames'] += 1
+                    self.stats['latency_total'] += latency
+                    self.stats['latency_max'] = max(self.stats['latency_max'], latency)
+                    self.head = (self.head + 1) % JB_SLOTS
+                    self.count -= 1
+                    return ('frame', n)
+                if self.end_pending:
+                    self.end_pending = False
+                    self.playing = False
+                    self.prebuffer_start = None
+                    return 'drain'
+                slack = slack_fn()  # seconds queued in the pcm device, None if unknown
+                if slack is not None and slack < JB_FRAME_SEC:
+                    self.stats['underruns'] += 1  # fill the gap with silence rather than let the device run dry
+                    self.target = min(self.target + 1, JB_MAX_FRAMES)
+                    out[:] = 0
+                    return ('silence', len(out))
+                self.cond.wait(JB_FRAME_SEC / 2 if slack is None else max(slack - JB_FRAME_SEC, 0.001))
+        return None
+
+    def get_stats(self):
+        with self.cond:
+            d = dict(self.stats)
+            d['latency_avg'] = (d['latency_total'] / d['frames']) if d['frames'] else 0.0
+            d['target_ms'] = self.target * JB_FRAME_SEC * 1000
+            d['jitter_ms'] = math.sqrt(self.gap_var) * 1000
+            d['queued'] = self.count
+            del d['latency_total']
+        return d
+
+# Separates audio worth sending from idle periods, so that a stream need not
+# carry (or encode) silence between calls.  The gate opens on the first frame
+# of a call and on every frame louder than the level, and closes 'hang' seconds
+# after the last of these or after the end of call flag.
+class stream_gate(object):
+    def __init__(self, level_db = GATE_LEVEL_DB, hang = GATE_HANG_SEC):
+        self.threshold = (32768.0 * 10 ** (level_db / 20.0)) ** 2   # mean square
+        self.hang = hang
+        self.in_call = False
+        self.until = 0.0
+        self.stats = {'gated': 0}
+
+    def frame(self, pcm, now = None):   # pcm is an int16 array; returns False if the frame is gated
+        now = time.time() if now is None else now
+        x = pcm.astype(np.float32)
+        if not self.in_call or np.dot(x, x) >= self.threshold * len(x):
+            self.in_call = True
+            self.until = now + self.hang
+        if now < self.until:
+            return True
+        self.stats['gated'] += 1
+        return False
+
+    def end(self, now = None):          # end of call (or drop) flag
+        now = time.time() if now is None else now
+        self.in_call = False
+        if now < self.until:
+            self.until = now + self.hang
+
+    def is_open(self, now = None):
+        return (time.time() if now is None else now) < self.until
+
+    def get_stats(self):
+        return dict(self.stats)
+
 # Main class that receives UDP audio samples and sends them to a PCM subsystem (currently ALSA or STDOUT)
 class socket_audio(object):
-    def __init__(self, udp_host, udp_port, pcm_device, two_channels = False, audio_gain = 1.0, dest_stdout = False, instance_name = "OP25", **kwds):
+    def __init__(self, udp_host, udp_port, pcm_device, two_channels = False, audio_gain = 1.0, dest_stdout = False, instance_name = "OP25", jitter_buffer = True, gate = None, **kwds):
         self.keep_running = True
+        self.gate = gate    # stream_gate dropping the silence of idle periods, or None
         self.two_channels = two_channels
-        self.audio_gain = audio_gain
+        self.pcm_buf = np.zeros(MAX_SUPERFRAME_SIZE, dtype=np.int16)    # interleaved output, 2 x MAX_SUPERFRAME_SIZE/2 samples
+        self.set_gain(audio_gain)
         self.dest_stdout = dest_stdout
         self.instance_name = instance_name
+        self.udp_port = udp_port
+        self.sinks = []     # additional consumers of the played audio, e.g. a stream encoder
+        self.port_listeners = {}    # consumers of the raw udp payloads of one port, e.g. a call recorder
         self.sock_a = None
         self.sock_b = None
         self.pcm = None
@@ -391,68 +595,63 @@ class socket_audio(object):
             sys.stdout = os.fdopen(sys.stdout.fileno(), 'wb', 0) # reopen stdout with buffering disabled
             self.pcm = stdout_wrapper()
         else:
-            if pcm_device.lower() == "pulse":
-                try:
-                    self.pcm = pa_sound(self.instance_name)   # first try to open PulseAudio
-                    sys.stderr.write("using PulseAudio sound system\n")
-                except Exception as e:
-                    self.pcm = None
-                    sys.stderr.write("unable to load PulseAudio library\n%s\n" % e)
-                    pcm_device = "default"
-            if self.pcm is None:
-                try:
-                    self.pcm = alsasound()  # if PulseAudio not available, try to use ALSA
-                    sys.stderr.write("using ALSA sound system\n")
-                except Exception as e:
-                    sys.stderr.write("unable to load ALSA library\n%s\n" % e)
+            pcm_device = self.create_pcm(pcm_device)
 
         if self.pcm is not None:
             self.setup_pcm(pcm_device)
         else:
             self.keep_running = False
 
+        # stdout writes never block, so there is no playout clock to buffer against
+        self.jb = jitter_buf() if (jitter_buffer and not dest_stdout) else None
+        self.writer = None
+        self.writer_rc = 0
+
         self.setup_sockets(udp_host, udp_port)
 
     def run(self):
         rc = 0
+        if self.jb is not None and self.keep_running:
+            self.writer = threading.Thread(target=self.play)
+            self.writer.daemon = True
+            self.writer.start()
         while self.keep_running and (rc >= 0):
-            readable, writable, exceptional = select.select( [self.sock_a, self.sock_b], [], [self.sock_a, self.sock_b], 5.0)
-            in_a = None
-            in_b = None
+            in_a, in_b = self.receive(5.0)
             data_a = bytearray()
             data_b = bytearray()
             flag_a = -1
             flag_b = -1
 
-            # Check for select() polling timeout and pcm self-check
-            if (not readable) and (not writable) and (not exceptional):
+            # Check for polling timeout and pcm self-check
+            if (in_a is None) and (in_b is None):
                 rc = self.pcm.check()
                 if isinstance(rc, ctypes.c_int):
                     rc = rc.value
                 continue
 
-            # Data received on the udp port is 320 bytes for an audio frame or 2 bytes for a flag
-            if self.sock_a in readable:
-                in_a = self.sock_a.recvfrom(MAX_SUPERFRAME_SIZE)
-
-            if self.sock_b in readable:
-                in_b = self.sock_b.recvfrom(MAX_SUPERFRAME_SIZE)
-
             if in_a is not None:
-                len_a = len(in_a[0])
+                len_a = len(in_a)
                 if len_a == 2:
-                    flag_a = np.frombuffer(in_a[0], dtype=np.int16)[0]
+                    flag_a = np.frombuffer(in_a, dtype=np.int16)[0]
                 elif len_a > 0:
-                    data_a = in_a[0]
+                    data_a = in_a
 
             if in_b is not None:
-                len_b = len(in_b[0])
+                len_b = len(in_b)
                 if len_b == 2:
-                    flag_b = np.frombuffer(in_b[0], dtype=np.int16)[0]
+                    flag_b = np.frombuffer(in_b, dtype=np.int16)[0]
                 elif len_b > 0:
-                    data_b = in_b[0]
+                    data_b = in_b
 
             if (flag_a == 0) or (flag_b == 0):
+                for sink in self.sinks:
+                    sink.drain()
+                if self.gate is not None:
+                    self.gate.end()
+                if self.jb is not None:
+                    self.jb.end()
+                    rc = self.writer_rc
+                    continue
                 rc = self.pcm.drain()
                 if isinstance(rc, ctypes.c_int):
                     rc = rc.value
@@ -461,53 +660,169 @@ class socket_audio(object):
             if (((flag_a == 1) and (flag_b == 1)) or
                 ((flag_a == 1) and (in_b is None)) or 
                 ((flag_b == 1) and (in_a is None))):
+                for sink in self.sinks:
+                    sink.drop()
+                if self.gate is not None:
+                    self.gate.end()
+                if self.jb is not None:
+                    self.jb.flush()
+                    rc = self.writer_rc
+                    continue
                 rc = self.pcm.drop()
                 if isinstance(rc, ctypes.c_int):
                     rc = rc.value
                 continue
 
-            if not self.two_channels:
-                data_a = self.scale(data_a)
-                rc = self.pcm.write(self.interleave(data_a, data_a))
-                if isinstance(rc, ctypes.c_int):
-                    rc = rc.value
+            pcm = self.interleave(data_a, None if not self.two_channels else data_b)
+            for sink in self.sinks:
+                sink.write(pcm)
+            if self.gate is not None and not self.gate.frame(pcm):
+                continue
+            if self.jb is not None:
+                self.jb.put(pcm)
+                rc = self.writer_rc
             else:
-                data_a = self.scale(data_a)
-                data_b = self.scale(data_b)
-                rc = self.pcm.write(self.interleave(data_a, data_b))
+                rc = self.pcm.write(pcm)
                 if isinstance(rc, ctypes.c_int):
                     rc = rc.value
 
+        self.keep_running = False
+        if self.writer is not None:
+            self.jb.stop()
+            self.writer.join()
         self.close_sockets()
         self.close_pcm()
         return
 
-    def scale(self, data):  # crude amplitude scaler (volume) for S16_LE samples
-        arr = np.array(np.frombuffer(data, dtype=np.int16), dtype=np.float32)
-        result = np.zeros(len(arr), dtype=np.int16)
-        if sys.version[0] == '2':
-            arr = np.clip(arr*self.audio_gain, -32767, 32766, out=result)
-        else:
-            arr = np.clip(arr*self.audio_gain, -32767, 32766, out=result, casting='unsafe')
-        return result.tobytes('C')
+    def receive(self, timeout):
+        # Data received on the udp port is 320 bytes for an audio frame or 2 bytes for a flag
+        # returns the payloads of both channels, None where nothing was received
+        in_a = None
+        in_b = None
+        readable, writable, exceptional = select.select( [self.sock_a, self.sock_b], [], [self.sock_a, self.sock_b], timeout)
+        if self.sock_a in readable:
+            in_a = self.sock_a.recvfrom(MAX_SUPERFRAME_SIZE)[0]
+            self.notify_port(self.udp_port, in_a)
+
+        if self.sock_b in readable:
+            in_b = self.sock_b.recvfrom(MAX_SUPERFRAME_SIZE)[0]
+            self.notify_port(self.udp_port + 2, in_b)
+        return in_a, in_b
+
+    def pcm_slack(self):    # seconds of audio queued in the pcm device, None if unknown
+        frames = self.pcm.delay() if hasattr(self.pcm, 'delay') else None
+        if frames is None:
+            return None
+        return float(frames) / PCM_RATE
+
+    def play(self):         # jitter buffer writer thread
+        out = np.zeros(MAX_SUPERFRAME_SIZE, dtype=np.int16)
+        next_report = time.time() + JB_REPORT_SEC
+        last_stats = None
+        rc = 0
+        while self.keep_running and (rc >= 0):
+            item = self.jb.get(out, self.pcm_slack, lambda: self.keep_running)
+            if item is None:
+                break
+            elif item == 'drain':
+                rc = self.pcm.drain()
+            elif item == 'drop':
+                rc = self.pcm.drop()
+            else:
+                rc = self.pcm.write(out[:item[1]])
+            if isinstance(rc, ctypes.c_int):
+                rc = rc.value
+            if LOG_AUDIO_XRUNS and time.time() > next_report:
+                next_report = time.time() + JB_REPORT_SEC
+                stats = self.get_stats()
+                if stats != last_stats and (stats['underruns'] or stats['overruns'] or stats['xruns']):
+                    sys.stderr.write("%s audio jitter buffer: target %.0fms, jitter %.1fms, latency avg %.0fms max %.0fms, underruns %d, overruns %d, pcm xruns %d\n" % (log_ts.get(), stats['target_ms'], stats['jitter_ms'], 1000 * stats['latency_avg'], 1000 * stats['latency_max'], stats['underruns'], stats['overruns'], stats['xruns']))
+                last_stats = stats
+        self.writer_rc = rc if rc < 0 else 0
+
+    def get_stats(self):
+        stats = self.jb.get_stats() if self.jb is not None else {}
+        stats['xruns'] = getattr(self.pcm, 'xruns', 0)
+        if self.gate is not None:
+            stats.update(self.gate.get_stats())
+        return stats
+
+    def set_gain(self, audio_gain):
+        # crude amplitude scaler (volume) applied in fixed point; the scratch buffer must hold sample * gain
+        self.audio_gain = audio_gain
+        self.gain_q = int(round(audio_gain * (1 << GAIN_SHIFT)))
+        scratch_type = np.int32 if (self.gain_q < (1 << 16)) else np.int64
+        self.scratch = np.zeros(MAX_SUPERFRAME_SIZE // 2, dtype=scratch_type)
+        self.gain_scalar = scratch_type(self.gain_q)    # typed scalars keep the ufuncs free of temporaries
+        self.gain_shift = scratch_type(GAIN_SHIFT)
+        self.clip_lo = scratch_type(-32767)
+        self.clip_hi = scratch_type(32766)
+
+    def scale_into(self, arr, out):     # out[:] = clip(arr * gain); out may be a strided view
+        if self.gain_q == (1 << GAIN_SHIFT):
+            np.copyto(out, arr)
+            return
+        t = self.scratch[:len(arr)]
+        np.copyto(t, arr)
+        np.multiply(t, self.gain_scalar, out=t)
+        np.right_shift(t, self.gain_shift, out=t)
+        np.minimum(t, self.clip_hi, out=t)
+        np.maximum(t, self.clip_lo, out=t)
+        np.copyto(out, t, casting='unsafe')
 
     def interleave(self, data_a, data_b):
+        # scale S16_LE samples into the preallocated stereo buffer; data_b None duplicates channel a
+        # the returned array is a view that stays valid until the next call
         arr_a = np.frombuffer(data_a, dtype=np.int16)
-        arr_b = np.frombuffer(data_b, dtype=np.int16)
+        arr_b = arr_a if data_b is None else np.frombuffer(data_b, dtype=np.int16)
         d_len = max(len(arr_a), len(arr_b))
-        result = np.zeros(d_len*2, dtype=np.int16)
-        if len(arr_a):
-            # copy arr_a to result[0,2,4, ...]
-            result[ range(0, len(arr_a)*2, 2) ] = arr_a
-        if len(arr_b):
-            # copy arr_b to result[1,3,5, ...]
-            result[ range(1, len(arr_b)*2, 2) ] = arr_b
-        return result.tobytes('C')
+        result = self.pcm_buf[:d_len*2]
+        left = result[0::2]
+        right = result[1::2]
+        self.scale_into(arr_a, left[:len(arr_a)])
+        left[len(arr_a):] = 0
+        if data_b is None:
+            right[:] = left
+        else:
+            self.scale_into(arr_b, right[:len(arr_b)])
+            right[len(arr_b):] = 0
+        return result
 
     def stop(self):
         self.keep_running = False
         return
 
+    def create_pcm(self, pcm_device):   # sets self.pcm, returns the device name to open
+        if pcm_device.lower() == "pulse":
+            try:
+                self.pcm = pa_sound(self.instance_name)   # first try to open PulseAudio
+                sys.stderr.write("using PulseAudio sound system\n")
+            except Exception as e:
+                self.pcm = None
+                sys.stderr.write("unable to load PulseAudio library\n%s\n" % e)
+                pcm_device = "default"
+        if self.pcm is None:
+            try:
+                self.pcm = alsasound()  # if PulseAudio not available, try to use ALSA
+                sys.stderr.write("using ALSA sound system\n")
+            except Exception as e:
+                sys.stderr.write("unable to load ALSA library\n%s\n" % e)
+        return pcm_device
+
+    def add_sink(self, sink):    # sink.write() must copy the frame, it is only valid during the call
+        self.sinks.append(sink)
+
+    def get_ports(self):
+        return [self.udp_port, self.udp_port + 2]
+
+    def add_port_listener(self, udp_port, listener):    # listener(data) with each udp payload received on udp_port
+        self.port_listeners.setdefault(udp_port, []).append(listener)
+
+    def notify_port(self, udp_port, data):
+        if udp_port in self.port_listeners:
+            for listener in self.port_listeners[udp_port]:
+                listener(data)
+
     def setup_sockets(self, udp_host, udp_port):
         sys.stderr.write("Listening on %s:%d\n" % (udp_host, udp_port))
         self.sock_a = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -545,12 +860,180 @@ class socket_audio(object):
             self.pcm.close()
         return
 
+class mix_stream(object):
+    def __init__(self, udp_port, gain = 1.0, priority = 0):
+        self.udp_port = udp_port
+        self.gain = gain
+        self.priority = priority    # static priority; lower value is more important
+        self.call_prio = None       # talkgroup priority of the current call, if known
+        self.sock = None
+        self.frames = deque(maxlen=MIX_QUEUE_FRAMES)
+        self.ending = False
+
+    def get_priority(self):
+        return self.priority if self.call_prio is None else self.call_prio
+
+def parse_streams(spec):
+    # "port[:gain[:priority]],..." as used on the audio.py command line
+    streams = []
+    for item in spec.split(','):
+        if item.strip() == "":
+            continue
+        f = item.split(':')
+        streams.append({'udp_port': int(f[0]),
+                        'gain': float(f[1]) if len(f) > 1 and f[1] != "" else 1.0,
+                        'priority': int(f[2]) if len(f) > 2 and f[2] != "" else 0})
+    return streams
+
+# Mixes the UDP audio of any number of receivers into a single PCM stream
+class mixer_audio(socket_audio):
+    def __init__(self, udp_host, streams, pcm_device, audio_gain = 1.0, dest_stdout = False, instance_name = "OP25", duck_gain = MIX_DUCK_GAIN, **kwds):
+        self.streams = [mix_stream(int(st['udp_port']), float(st.get('gain', 1.0)), int(st.get('priority', 0))) for st in streams]
+        self.stream_by_sock = {}
+        for st in self.streams:     # fixed point gains, normal and ducked
+            st.gain_q = np.int64(int(round(st.gain * (1 << GAIN_SHIFT))))
+            st.duck_q = np.int64(int(round(st.gain * duck_gain * (1 << GAIN_SHIFT))))
+        self.duck_gain = duck_gain
+        self.duck_prio = None
+        self.duck_expire = 0
+        self.frame_count = 0
+        self.acc = np.zeros(MAX_SUPERFRAME_SIZE // 2, dtype=np.int64)
+        self.tmp = np.zeros(MAX_SUPERFRAME_SIZE // 2, dtype=np.int64)
+        self.mix_buf = np.zeros(MAX_SUPERFRAME_SIZE // 2, dtype=np.int16)
+        self.clip_lo = np.int64(-32767)
+        self.clip_hi = np.int64(32766)
+        self.mix_shift = np.int64(GAIN_SHIFT)
+        socket_audio.__init__(self, udp_host, self.streams[0].udp_port, pcm_device, False, audio_gain, dest_stdout, instance_name, jitter_buffer = False, **kwds)   # paced by the blocking pcm writes
+
+    def set_stream_priority(self, udp_port, prio):
+        for st in self.streams:
+            if st.udp_port == udp_port:
+                st.call_prio = prio
+
+    def run(self):
+        rc = 0
+        drain_pending = False
+        socks = [st.sock for st in self.streams]
+        while self.keep_running and (rc >= 0):
+            queued = any(len(st.frames) for st in self.streams)
+            readable, writable, exceptional = select.select(socks, [], socks, 0 if queued else 5.0)
+
+            # Check for select() polling timeout and pcm self-check
+            if (not queued) and (not readable) and (not exceptional):
+                rc = self.pcm.check()
+                if isinstance(rc, ctypes.c_int):
+                    rc = rc.value
+                continue
+
+            drop = False
+            for sock in readable:
+                st = self.stream_by_sock[sock]
+                data = sock.recv(MAX_SUPERFRAME_SIZE)
+                self.notify_port(st.udp_port, data)
+                if len(data) == 2:
+                    flag = np.frombuffer(data, dtype=np.int16)[0]
+                    if flag == 0:       # end of transmission; drain once all streams are quiet
+                        st.ending = True
+                        drain_pending = True
+                    elif flag == 1:     # discard this stream's pending audio
+                        st.frames.clear()
+                        st.call_prio = None
+                        drop = True
+                elif len(data) > 0:
+                    st.frames.append(data)
+                    st.ending = False
+
+            if any(len(st.frames) for st in self.streams):
+                rc = self.write_mix()
+            elif drop and not drain_pending:
+                for sink in self.sinks:
+                    sink.drop()
+                rc = self.pcm.drop()
+            elif drain_pending:
+                drain_pending = False
+                for st in self.streams:
+                    if st.ending:
+                        st.ending = False
+                        st.call_prio = None
+                for sink in self.sinks:
+                    sink.drain()
+                rc = self.pcm.drain()
+            if isinstance(rc, ctypes.c_int):
+                rc = rc.value
+
+        self.close_sockets()
+        self.close_pcm()
+        return
+
+    def write_mix(self):
+        # one frame from every stream that has one; lower priority streams are ducked while a more important one is heard
+        self.frame_count += 1
+        active = [st for st in self.streams if len(st.frames)]
+        best = min(st.get_priority() for st in active)
+        if self.duck_prio is None or best <= self.duck_prio or self.frame_count > self.duck_expire:
+            self.duck_prio = best
+            self.duck_expire = self.frame_count + MIX_DUCK_HOLD
+
+        n = 0
+        self.acc[:] = 0
+        for st in active:
+            arr = np.frombuffer(st.frames.popleft(), dtype=np.int16)
+            t = self.tmp[:len(arr)]
+            np.copyto(t, arr)
+            np.multiply(t, st.gain_q if st.get_priority() <= self.duck_prio else st.duck_q, out=t)
+            np.add(self.acc[:len(arr)], t, out=self.acc[:len(arr)])
+            n = max(n, len(arr))
+        acc = self.acc[:n]
+        np.right_shift(acc, self.mix_shift, out=acc)
+        np.minimum(acc, self.clip_hi, out=acc)
+        np.maximum(acc, self.clip_lo, out=acc)
+        np.copyto(self.mix_buf[:n], acc, casting='unsafe')
+        pcm = self.interleave(self.mix_buf[:n], None)
+        for sink in self.sinks:
+            sink.write(pcm)
+        return self.pcm.write(pcm)
+
+    def get_ports(self):
+        return [st.udp_port for st in self.streams]
+
+    def setup_sockets(self, udp_host, udp_port):
+        for st in self.streams:
+            sys.stderr.write("Mixing %s:%d (gain %.2f, priority %d)\n" % (udp_host, st.udp_port, st.gain, st.priority))
+            st.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            st.sock.setblocking(0)
+            st.sock.bind((udp_host, st.udp_port))
+            self.stream_by_sock[st.sock] = st
+        return
+
+    def close_sockets(self):
+        for st in self.streams:
+            st.sock.close()
+        return
+
 class audio_thread(threading.Thread):
-    def __init__(self, udp_host, udp_port, pcm_device, two_channels = False, audio_gain = 1.0, dest_stdout = False, instance_name = "OP25", **kwds):
-        threading.Thread.__init__(self, **kwds)
+    def __init__(self, udp_host, udp_port, pcm_device, two_channels = False, audio_gain = 1.0, dest_stdout = False, instance_name = "OP25", jitter_buffer = True, **kwds):
+        threading.Thread.__init__(self)     # kwds are player options, e.g. gate
+        self.setDaemon(True)
+        self.keep_running = True
+        self.sock_audio = socket_audio(udp_host, udp_port, pcm_device, two_channels, audio_gain, dest_stdout, instance_name, jitter_buffer, **kwds)
+        self.start()
+        return
+
+    def run(self):
+        self.sock_audio.run()
+
+    def stop(self):
+        self.sock_audio.stop()
+
+    def get_stats(self):
+        return self.sock_audio.get_stats()
+
+class mixer_thread(threading.Thread):
+    def __init__(self, udp_host, streams, pcm_device, audio_gain = 1.0, dest_stdout = False, instance_name = "OP25", duck_gain = MIX_DUCK_GAIN, **kwds):
+        threading.Thread.__init__(self)     # kwds are player options, e.g. gate
         self.setDaemon(True)
         self.keep_running = True
-        self.sock_audio = socket_audio(udp_host, udp_port, pcm_device, two_channels, audio_gain, dest_stdout, instance_name, **kwds)
+        self.sock_audio = mixer_audio(udp_host, streams, pcm_device, audio_gain, dest_stdout, instance_name, duck_gain, **kwds)
         self.start()
         return
 
@@ -560,3 +1043,5 @@ class audio_thread(threading.Thread):
     def stop(self):
         self.sock_audio.stop()
 
+    def set_stream_priority(self, udp_port, prio):
+        self.sock_audio.set_stream_priority(udp_port, prio)
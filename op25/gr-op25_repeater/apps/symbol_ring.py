@@ -0,0 +1,120 @@
+#
+# OP25 Pre-trigger Symbol Ring
+#
+# This file is part of OP25
+#
+# OP25 is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# OP25 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OP25; see the file COPYING. If not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Boston, MA
+# 02110-1301, USA.
+
+"""
+Rolling in-memory capture of demodulated symbols.
+
+The ring holds the most recent symbols of a channel and is only written
+to disk when a dump is requested, so that a capture contains the moments
+leading up to an event without streaming every symbol to storage.  A
+manual dump is written at once; a triggered dump waits for a number of
+post-trigger symbols, or is flushed early when the channel is suspended.
+The file written has the same format as 'raw_output' and can be replayed
+with 'raw_input'.
+"""
+
+import sys
+import os
+import time
+import threading
+import numpy as np
+from gnuradio import gr
+from log_ts import log_ts
+
+class symbol_ring(gr.sync_block):
+    def __init__(self, msgq_id, nsymbols, post_symbols=0, holdoff=0.0, output_dir="."):
+        gr.sync_block.__init__(self, name="symbol_ring", in_sig=[np.uint8], out_sig=None)
+        self.msgq_id = msgq_id
+        self.ring = np.zeros(max(int(nsymbols), 1), dtype=np.uint8)
+        self.post_symbols = int(post_symbols)
+        self.holdoff = float(holdoff)
+        self.output_dir = output_dir
+        self.count = 0          # total symbols received
+        self.pending = None     # (symbol count at which to dump, reason)
+        self.last_trigger = 0.0
+        self.lock = threading.Lock()
+
+    def work(self, input_items, output_items):
+        in0 = input_items[0]
+        n = len(in0)
+        size = len(self.ring)
+        data = in0[-size:]                          # symbol i is stored at ring[i % size]
+        with self.lock:
+            start = (self.count + n - len(data)) % size
+            k = min(len(data), size - start)
+            self.ring[start:start + k] = data[:k]
+            self.ring[:len(data) - k] = data[k:]
+            self.count += n
+            pending = self.pending
+            if pending is not None and self.count >= pending[0]:
+                self.pending = None
+                snapshot = self.snapshot()
+            else:
+                pending = None
+        if pending is not None:
+            self.save(pending[1], snapshot)
+        return n
+
+    def trigger(self, reason, now=None):
+        """Schedule a dump after the post-trigger symbols; ignored within the holdoff of the last trigger."""
+        now = time.time() if now is None else now
+        with self.lock:
+            if self.pending is not None or (now - self.last_trigger) < self.holdoff:
+                return False
+            self.last_trigger = now
+            self.pending = (self.count + self.post_symbols, reason)
+        return True
+
+    def dump(self, reason="manual"):
+        """Dump the ring contents immediately, whether or not symbols are flowing."""
+        with self.lock:
+            snapshot = self.snapshot()
+        self.save(reason, snapshot)
+
+    def flush(self):
+        """Write a pending triggered dump now, e.g. before the channel is suspended and symbols stop."""
+        with self.lock:
+            pending = self.pending
+            self.pending = None
+            if pending is not None:
+                snapshot = self.snapshot()
+        if pending is not None:
+            self.save(pending[1], snapshot)
+
+    def snapshot(self):     # lock must be held
+        size = len(self.ring)
+        if self.count < size:
+            return self.ring[:self.count].copy()
+        pos = self.count % size                     # oldest symbol once the ring has filled
+        return np.concatenate((self.ring[pos:], self.ring[:pos]))
+
+    def save(self, reason, data):
+        filename = os.path.join(self.output_dir, "ch%d-%s-%s.raw" % (self.msgq_id, time.strftime("%Y%m%d-%H%M%S"), reason))
+        t = threading.Thread(target=self.write_file, args=(filename, data))
+        t.daemon = True
+        t.start()
+
+    def write_file(self, filename, data):
+        try:
+            with open(filename, "wb") as f:
+                f.write(data.tobytes())
+            sys.stderr.write("%s [%d] Saved %d symbols to file: %s\n" % (log_ts.get(), self.msgq_id, len(data), filename))
+        except (IOError, OSError):
+            sys.stderr.write("%s [%d] Unable to save symbol ring to %s: %s\n" % (log_ts.get(), self.msgq_id, filename, sys.exc_info()[1]))
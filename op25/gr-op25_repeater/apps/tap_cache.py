@@ -0,0 +1,121 @@
+#
+# OP25 Filter Tap Design Cache
+#
+# This file is part of OP25
+#
+# OP25 is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# OP25 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public
+# License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OP25; see the file COPYING. If not, write to the Free
+# Software Foundation, Inc., 51 Franklin Street, Boston, MA
+# 02110-1301, USA.
+
+"""
+Memoized filter tap design.
+
+Channels with identical parameters request identical filters, so each
+design is computed once per process and shared.  Optionally the designs
+can be persisted to a json file so that restarts skip the design step
+altogether.
+"""
+
+import sys
+import os
+import json
+import time
+import threading
+from gnuradio import filter
+from gnuradio.fft import window
+from log_ts import log_ts
+
+sys.path.append('tx')
+import op25_c4fm_mod
+
+_taps = {}
+_lock = threading.Lock()
+_cache_file = None
+_dirty = False
+_stats = {'designed': 0, 'reused': 0, 'loaded': 0, 'design_time': 0.0}
+
+def design(kind, params, designer):
+    """
+    Return the taps for filter 'kind' with the given parameter tuple,
+    calling designer() only if they are not already known.
+    """
+    global _dirty
+    key = '%s%s' % (kind, repr(tuple(params)))
+    with _lock:
+        taps = _taps.get(key)
+        if taps is not None:
+            _stats['reused'] += 1
+            return list(taps)
+    t0 = time.time()
+    taps = tuple([float(x) for x in designer()])
+    elapsed = time.time() - t0
+    with _lock:
+        _taps[key] = taps
+        _dirty = True
+        _stats['designed'] += 1
+        _stats['design_time'] += elapsed
+    return list(taps)
+
+def low_pass(gain, sampling_freq, cutoff_freq, transition_width, win = window.WIN_HAMMING):
+    return design('low_pass', (gain, sampling_freq, cutoff_freq, transition_width, int(win)),
+                  lambda: filter.firdes.low_pass(gain, sampling_freq, cutoff_freq, transition_width, win))
+
+def high_pass(gain, sampling_freq, cutoff_freq, transition_width, win = window.WIN_HAMMING):
+    return design('high_pass', (gain, sampling_freq, cutoff_freq, transition_width, int(win)),
+                  lambda: filter.firdes.high_pass(gain, sampling_freq, cutoff_freq, transition_width, win))
+
+def root_raised_cosine(gain, sampling_freq, symbol_rate, alpha, ntaps):
+    return design('rrc', (gain, sampling_freq, symbol_rate, alpha, ntaps),
+                  lambda: filter.firdes.root_raised_cosine(gain, sampling_freq, symbol_rate, alpha, ntaps))
+
+def c4fm(sample_rate, span, generator, symbol_rate = op25_c4fm_mod._def_symbol_rate, rate_multiplier = 1.0):
+    return design('c4fm', (sample_rate, span, generator.__name__, symbol_rate, rate_multiplier),
+                  lambda: op25_c4fm_mod.c4fm_taps(sample_rate=sample_rate, span=span, generator=generator, symbol_rate=symbol_rate).generate(rate_multiplier = rate_multiplier))
+
+def load(filename):
+    """Enable on-disk persistence and preload any designs already saved in 'filename'."""
+    global _cache_file
+    _cache_file = filename
+    if not os.access(filename, os.R_OK):
+        return
+    try:
+        with open(filename, 'r') as f:
+            saved = json.load(f)
+    except (IOError, ValueError) as ex:
+        sys.stderr.write("%s tap cache: ignoring unreadable file %s: %s\n" % (log_ts.get(), filename, ex))
+        return
+    with _lock:
+        for key in saved:
+            _taps[key] = tuple(saved[key])
+        _stats['loaded'] = len(saved)
+
+def save():
+    """Write the cache back to disk if persistence is enabled and new designs were added."""
+    global _dirty
+    if _cache_file is None or not _dirty:
+        return
+    with _lock:
+        snapshot = dict((key, list(_taps[key])) for key in _taps)
+        _dirty = False
+    try:
+        tmp_file = '%s.%d.tmp' % (_cache_file, os.getpid())   # device worker processes may save concurrently
+        with open(tmp_file, 'w') as f:
+            json.dump(snapshot, f)
+        os.rename(tmp_file, _cache_file)
+    except (IOError, OSError) as ex:
+        sys.stderr.write("%s tap cache: unable to save %s: %s\n" % (log_ts.get(), _cache_file, ex))
+
+def get_stats():
+    with _lock:
+        return dict(_stats)
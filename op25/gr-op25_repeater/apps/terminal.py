@@ -52,6 +52,8 @@ import json
 import threading
 import traceback
 import socket
+import struct
+import zlib
 
 from gnuradio import gr
 
@@ -59,6 +61,43 @@ import gnuradio.op25_repeater as op25_repeater
 
 KEEPALIVE_TIME = 3.0   # no data received in (seconds)
 
+# udp terminal protocol v2: a client sending the 'subscribe' command (arg1 = SUB_* flags)
+# gets every message as one or more datagrams, each starting with UDP_HEADER
+UDP_MAGIC = b'O2'
+UDP_HEADER = struct.Struct('!2sBIHH')  # magic, UDP_FLAG_* flags, message seq, chunk index, chunk count
+UDP_FLAG_ZLIB = 1
+UDP_CHUNK_SIZE = 1200       # payload bytes per datagram, below a typical WAN path mtu
+UDP_KEYFRAME = 20           # a full message is sent after this many deltas of one json_type
+UDP_REASSEMBLY_TIME = 2.0   # seconds an incomplete message is kept by the client
+SUB_ZLIB = 1
+SUB_DELTA = 2
+
+def json_delta(old, new):
+    # patch turning dict 'old' into dict 'new'
+    patch = {}
+    for k in new:
+        if k not in old:
+            patch.setdefault('$set', {})[k] = new[k]
+        elif old[k] != new[k]:
+            if isinstance(old[k], dict) and isinstance(new[k], dict):
+                patch.setdefault('$sub', {})[k] = json_delta(old[k], new[k])
+            else:
+                patch.setdefault('$set', {})[k] = new[k]
+    removed = [k for k in old if k not in new]
+    if removed:
+        patch['$del'] = removed
+    return patch
+
+def json_patch(obj, patch):
+    obj = dict(obj)
+    for k, v in patch.get('$set', {}).items():
+        obj[k] = v
+    for k, v in patch.get('$sub', {}).items():
+        obj[k] = json_patch(obj[k], v)
+    for k in patch.get('$del', []):
+        obj.pop(k, None)
+    return obj
+
 class q_watcher(threading.Thread):
     def __init__(self, msgq,  callback, **kwds):
         threading.Thread.__init__ (self, **kwds)
@@ -103,6 +142,8 @@ class curses_terminal(threading.Thread):
         self.sock = sock
         self.sm_step = 100
         self.lg_step = 1200
+        self.lines = {}         # (window, y) -> (x, text, attr) currently displayed
+        self.damaged = set()    # windows with changes not yet sent to the screen
         self.send_command('get_terminal_config', 0, 0)
         self.start()
 
@@ -160,6 +201,16 @@ class curses_terminal(threading.Thread):
         self.status2.mvwin(self.maxy-2, self.maxx-15)
         self.stdscr.refresh()
 
+        # everything is redrawn by the next updates
+        for win in (self.top_bar, self.freq_list, self.active1, self.active2, self.status1, self.status2):
+            win.erase()
+            self.damaged.add(win)
+        self.lines = {}
+        self.current_srcaddr = 0
+        self.current_encrypted = 0
+        self.current_emergency = 0
+        self.flush_screen()
+
         self.title_help()
 
     def end_terminal(self):
@@ -183,6 +234,52 @@ class curses_terminal(threading.Thread):
         self.stdscr.move(1,0)
         self.stdscr.refresh()
 
+    def put_line(self, win, y, x, s, attr = 0):
+        # show s at (y, x) of win, rewriting only the cells that differ from what is displayed
+        old = self.lines.get((win, y))
+        if old == (x, s, attr):
+            return
+        if old is None or old[0] != x or old[2] != attr:
+            win.move(y, 0)
+            win.clrtoeol()
+            if s:
+                win.addstr(y, x, s, attr)
+        else:
+            prev = old[1]
+            i = 0
+            while i < len(s) and i < len(prev) and s[i] == prev[i]:
+                i += 1
+            if len(s) == len(prev):         # only the changed span
+                j = len(s)
+                while j > i and s[j-1] == prev[j-1]:
+                    j -= 1
+                win.addstr(y, x + i, s[i:j], attr)
+            else:
+                if i < len(s):
+                    win.addstr(y, x + i, s[i:], attr)
+                if len(s) < len(prev):
+                    win.move(y, x + len(s))
+                    win.clrtoeol()
+        self.lines[(win, y)] = (x, s, attr)
+        self.damaged.add(win)
+
+    def clear_lines(self, win, first):
+        # blank the displayed lines of win from line 'first' down
+        for key in [k for k in self.lines if k[0] is win and k[1] >= first]:
+            win.move(key[1], 0)
+            win.clrtoeol()
+            del self.lines[key]
+            self.damaged.add(win)
+
+    def flush_screen(self):
+        # one screen update for all windows changed since the last one
+        if not self.damaged:
+            return
+        for win in self.damaged:
+            win.noutrefresh()
+        curses.doupdate()
+        self.damaged = set()
+
     def do_auto_update(self):
         UPDATE_INTERVAL = 0.5    # sec.
         if not self.auto_update:
@@ -362,36 +459,27 @@ class curses_terminal(threading.Thread):
             s = str(msg[current_nac]['top_line'])
             freqs = sorted(msg[current_nac]['frequencies'].keys())
             s = s[:(self.maxx - 1)]
-            self.top_bar.erase()
-            self.top_bar.addstr(0, 0, s)
-            self.top_bar.refresh()
-            self.freq_list.erase()
-            for i in range(len(freqs)):
-                if i > (self.maxy - 6):
-                    break
+            self.put_line(self.top_bar, 0, 0, s)
+            nlines = min(len(freqs), self.maxy - 5)
+            for i in range(nlines):
                 s=msg[current_nac]['frequencies'][freqs[i]]
                 s = s[:(self.maxx - 1)]
-                self.freq_list.addstr(i, 0, s)
-            self.freq_list.refresh()
+                self.put_line(self.freq_list, i, 0, s)
+            self.clear_lines(self.freq_list, nlines)
             if 'srcaddr' in msg:
-                self.status1.erase()
                 srcaddr = msg['srcaddr']
+                s = ''
                 if (srcaddr != 0) and (srcaddr != 0xffffff):
                     s = '%d' % (srcaddr)
                     s = s[:14]
-                    self.status1.addstr(0, (14-len(s)), s)
                     self.current_srcaddr = srcaddr
-                self.status1.refresh()
+                self.put_line(self.status1, 0, 0, s.rjust(14))
             if 'encrypted' in msg:
                 encrypted = msg['encrypted']
                 if self.current_encrypted != encrypted:
-                    self.status2.erase()
-                    if encrypted != 0:
-                        s = 'ENCRYPTED'
-                        self.status2.addstr(0, (14-len(s)), s, curses.A_REVERSE)
-                    self.status2.refresh()
+                    s = 'ENCRYPTED' if encrypted != 0 else ''
+                    self.put_line(self.status2, 0, (14-len(s)), s, curses.A_REVERSE)
                     self.current_encrypted = encrypted
-            self.stdscr.refresh()
         elif msg['json_type'] == 'change_freq': # from rx.py trunking
             s = 'Frequency %f' % (msg['freq'] / 1000000.0)
             if msg['fine_tune'] is not None:
@@ -403,17 +491,12 @@ class curses_terminal(threading.Thread):
                 if msg['tdma'] is not None:
                     s += ' TDMA Slot %s' % msg['tdma']
             s = s[:(self.maxx - 16)]
-            self.active1.erase()
-            self.active2.erase()
-            self.active1.addstr(0, 0, s)
-            self.active1.refresh()
+            self.put_line(self.active1, 0, 0, s)
             s = ""
             if msg['tag']:
                 s = msg['tag']
                 s = s[:(self.maxx - 16)]
-                self.active2.addstr(0, 0, s)
-            self.active2.refresh()
-            self.stdscr.refresh()
+            self.put_line(self.active2, 0, 0, s)
         elif msg['json_type'] == 'channel_update': # from multi_rx.py trunking
             if ('channels' not in msg) or (len(msg['channels']) == 0):
                 return
@@ -457,17 +540,12 @@ class curses_terminal(threading.Thread):
                         mode_str = ""
                     s += " %s" % mode_str
             s = s[:(self.maxx - 16)]
-            self.active1.erase()
-            self.active2.erase()
-            self.active1.addstr(0, 0, s)
-            self.active1.refresh()
+            self.put_line(self.active1, 0, 0, s)
             s = ""
             if msg[c_id]['tag']:
                 s = msg[c_id]['tag']
             s = s[:(self.maxx - 16)]
-            self.active2.addstr(0, 0, s)
-            self.active2.refresh()
-            self.stdscr.refresh()
+            self.put_line(self.active2, 0, 0, s)
             if 'srcaddr' in msg[c_id]:
                 srcaddr = msg[c_id]['srcaddr']
                 if 'srctag' in msg[c_id]:
@@ -477,33 +555,25 @@ class curses_terminal(threading.Thread):
                 if srcaddr == 0xffffffff:
                     srcaddr = 0
                 if self.current_srcaddr != srcaddr:
-                    self.status1.erase()
+                    s = ''
                     if srctag != "":
                         s = srctag[:14]
-                        self.status1.addstr(0, (14-len(s)), s)
                     elif srcaddr != 0:
                         s = '%d' % (srcaddr)
                         s = s[:14]
-                        self.status1.addstr(0, (14-len(s)), s)
+                    self.put_line(self.status1, 0, 0, s.rjust(14))
                     self.current_srcaddr = srcaddr
-                    self.status1.refresh()
             if 'encrypted' in msg[c_id]:
                 encrypted = msg[c_id]['encrypted']
                 if (self.current_encrypted != encrypted) and (self.current_emergency == 0):
-                    self.status2.erase()
-                    if encrypted != 0:
-                        s = 'ENCRYPTED'
-                        self.status2.addstr(0, (14-len(s)), s, curses.A_REVERSE)
-                    self.status2.refresh()
+                    s = 'ENCRYPTED' if encrypted != 0 else ''
+                    self.put_line(self.status2, 0, (14-len(s)), s, curses.A_REVERSE)
                     self.current_encrypted = encrypted
             if 'emergency' in msg[c_id]:
                 emergency = msg[c_id]['emergency']
                 if self.current_emergency != emergency:
-                    self.status2.erase()
-                    if emergency != 0:
-                        s = 'EMERGENCY'
-                        self.status2.addstr(0, (14-len(s)), s, curses.A_REVERSE)
-                    self.status2.refresh()
+                    s = 'EMERGENCY' if emergency != 0 else ''
+                    self.put_line(self.status2, 0, (14-len(s)), s, curses.A_REVERSE)
                     self.current_emergency = emergency
         elif msg['json_type'] == 'terminal_config': # from multi_rx.py
             if 'tuning_step_small' in msg and int(msg['tuning_step_small']) > 0:
@@ -524,7 +594,9 @@ class curses_terminal(threading.Thread):
                 break
             msg = self.input_q.delete_head_nowait()
             if msg.type() == -4:
-                return self.process_json(msg.to_string())
+                rc = self.process_json(msg.to_string())
+                self.flush_screen()
+                return rc
         return False
 
     def send_command(self, command, arg1 = 0, arg2 = 0):
@@ -578,6 +650,14 @@ class http_terminal(threading.Thread):
     def run(self):
         self.server.run()
 
+class udp_client(object):
+    def __init__(self, addr):
+        self.addr = addr
+        self.flags = None       # SUB_* flags; None for a legacy client getting bare json datagrams
+        self.until = 0
+        self.seq = 0
+        self.sent = {}          # json_type -> (seq, message, deltas since the last full message)
+
 class udp_terminal(threading.Thread):
     def __init__(self, input_q,  output_q, port, **kwds):
         threading.Thread.__init__ (self, **kwds)
@@ -586,9 +666,8 @@ class udp_terminal(threading.Thread):
         self.output_q = output_q
         self.keep_running = True
         self.port = port
-        self.remote_ip = '127.0.0.1'
-        self.remote_port = 0
-        self.keepalive_until = 0
+        self.clients = {}       # (ip, port) -> udp_client
+        self.lock = threading.Lock()
 
         self.setup_socket(port)
         self.q_handler = q_watcher(self.input_q, self.process_qmsg)
@@ -602,11 +681,46 @@ class udp_terminal(threading.Thread):
         self.sock.bind(('0.0.0.0', port))
 
     def process_qmsg(self, msg):
-        if time.time() >= self.keepalive_until:
+        if msg.type() != -4:
             return
         s = msg.to_string()
-        if msg.type() == -4 and self.remote_port > 0:
-            self.sock.sendto(s, (self.remote_ip, self.remote_port))
+        if not isinstance(s, bytes):
+            s = s.encode()
+        js = None
+        now = time.time()
+        with self.lock:
+            for addr in list(self.clients):
+                client = self.clients[addr]
+                if now >= client.until:
+                    del self.clients[addr]
+                    continue
+                if client.flags is None:
+                    self.sock.sendto(s, addr)
+                    continue
+                if js is None:
+                    js = json.loads(s)
+                self.send_v2(client, s, js)
+
+    def send_v2(self, client, s, js):
+        client.seq = (client.seq + 1) & 0xffffffff
+        payload = s
+        json_type = js.get('json_type') if isinstance(js, dict) else None
+        if json_type is not None and client.flags & SUB_DELTA:
+            prev = client.sent.get(json_type)
+            if prev is not None and prev[2] < UDP_KEYFRAME:
+                delta = json.dumps({'json_type': json_type, 'delta_base': prev[0], 'patch': json_delta(prev[1], js)}).encode()
+                if len(delta) < len(s):
+                    payload = delta
+            deltas = prev[2] + 1 if (prev is not None and payload is not s) else 0
+            client.sent[json_type] = (client.seq, js, deltas)
+        flags = 0
+        if client.flags & SUB_ZLIB:
+            payload = zlib.compress(payload)
+            flags |= UDP_FLAG_ZLIB
+        count = max(1, (len(payload) + UDP_CHUNK_SIZE - 1) // UDP_CHUNK_SIZE)
+        for i in range(count):
+            chunk = payload[i * UDP_CHUNK_SIZE:(i + 1) * UDP_CHUNK_SIZE]
+            self.sock.sendto(UDP_HEADER.pack(UDP_MAGIC, flags, client.seq, i, count) + chunk, client.addr)
 
     def end_terminal(self):
         self.keep_running = False
@@ -614,16 +728,28 @@ class udp_terminal(threading.Thread):
     def run(self):
         while self.keep_running:
             data, addr = self.sock.recvfrom(2048)
-            data = json.loads(data)
-            if data['command'] == 'quit':
-                self.keepalive_until = 0
+            try:
+                data = json.loads(data)
+                command = str(data['command'])
+            except (ValueError, KeyError, TypeError):
                 continue
-            msg = gr.message().make_from_string(str(data['command']), -2, data['arg1'], data['arg2'])
+            with self.lock:
+                if command == 'quit':
+                    self.clients.pop(addr, None)
+                    continue
+                if addr not in self.clients:
+                    self.clients[addr] = udp_client(addr)
+                client = self.clients[addr]
+                client.until = time.time() + KEEPALIVE_TIME
+                if command == 'subscribe':      # keepalive of a v2 client
+                    client.flags = int(data['arg1'])
+                    continue
+                if command == 'resync':         # client missed a message; send full messages again
+                    client.sent = {}
+                    continue
+            msg = gr.message().make_from_string(command, -2, data['arg1'], data['arg2'])
             if not self.output_q.full_p():
                 self.output_q.insert_tail(msg)
-            self.remote_ip = addr[0]
-            self.remote_port = addr[1]
-            self.keepalive_until = time.time() + KEEPALIVE_TIME
 
 def op25_terminal(input_q,  output_q, terminal_type):
         if terminal_type == 'curses':
@@ -642,6 +768,10 @@ class terminal_client(object):
         self.input_q = gr.msg_queue(10)
         self.keep_running = True
         self.terminal = None
+        self.flags = SUB_ZLIB | SUB_DELTA
+        self.partial = {}       # seq -> [first arrival, chunks]
+        self.state = {}         # json_type -> (seq, message)
+        self.next_keepalive = 0
 
         ip_addr = sys.argv[1]
         port = int(sys.argv[2])
@@ -654,11 +784,16 @@ class terminal_client(object):
 
     def run(self): 
         while self.keep_running:
+            if time.time() >= self.next_keepalive:
+                self.next_keepalive = time.time() + KEEPALIVE_TIME / 3
+                self.terminal.send_command('subscribe', self.flags, 0)
             try:
-                js, addr = self.sock.recvfrom(2048)
-                msg = gr.message().make_from_string(js, -4, 0, 0)
-                if not self.input_q.full_p():
-                    self.input_q.insert_tail(msg)
+                data, addr = self.sock.recvfrom(65536)
+                js = self.receive(data)
+                if js is not None:
+                    msg = gr.message().make_from_string(js, -4, 0, 0)
+                    if not self.input_q.full_p():
+                        self.input_q.insert_tail(msg)
             except socket.timeout:
                 pass
             except:
@@ -666,6 +801,37 @@ class terminal_client(object):
             if not self.terminal.keep_running:
                 self.keep_running = False
 
+    def receive(self, data):
+        # returns the json of a complete message, or None
+        if not data.startswith(UDP_MAGIC) or len(data) < UDP_HEADER.size:
+            return data     # legacy server
+        magic, flags, seq, idx, count = UDP_HEADER.unpack(data[:UDP_HEADER.size])
+        now = time.time()
+        for old in [k for k in self.partial if now - self.partial[k][0] > UDP_REASSEMBLY_TIME]:
+            del self.partial[old]
+        if count > 1:
+            entry = self.partial.setdefault(seq, [now, {}])
+            entry[1][idx] = data[UDP_HEADER.size:]
+            if len(entry[1]) < count:
+                return None
+            del self.partial[seq]
+            payload = b''.join(entry[1][i] for i in range(count))
+        else:
+            payload = data[UDP_HEADER.size:]
+        if flags & UDP_FLAG_ZLIB:
+            payload = zlib.decompress(payload)
+        js = json.loads(payload)
+        if not isinstance(js, dict) or 'json_type' not in js:
+            return payload
+        if 'delta_base' in js:
+            prev = self.state.get(js['json_type'])
+            if prev is None or prev[0] != js['delta_base']:
+                self.terminal.send_command('resync', 0, 0)
+                return None
+            js = json_patch(prev[1], js['patch'])
+        self.state[js['json_type']] = (seq, js)
+        return json.dumps(js).encode()
+
 if __name__ == '__main__':
     terminal = None
     try:
@@ -31,6 +31,7 @@ import threading
 from collections import deque
 from helper_funcs import *
 from log_ts import log_ts
+import sample_clock
 from gnuradio import gr
 import gnuradio.op25_repeater as op25_repeater
 
@@ -51,9 +52,11 @@ CALL_LOG_MAX_LEN = 10    # Maximum number of call_log entries to retain
 #################
 # Helper functions
 
-def meta_update(meta_q, tgid = None, tag = None, rid = None, rtag = None, msgq_id = 0, ts = time.time(), debug = 0):
+def meta_update(meta_q, tgid = None, tag = None, rid = None, rtag = None, msgq_id = 0, ts = None, debug = 0):
     if meta_q is None:
         return
+    if ts is None:
+        ts = time.time()    # wall clock, as compared by icemeta and meta_dispatch; not stream time
     d = {'json_type': 'meta_update'}
     d['tgid'] = tgid
     d['tag'] = tag
@@ -119,9 +122,11 @@ class rx_ctl(object):
         self.receivers = {}
         self.systems = {}
         self.chans = chans
-        self.cleanup_timer = time.time()
+        self.cleanup_timer = sample_clock.time()
         self.call_log = deque(maxlen=CALL_LOG_MAX_LEN)
         self.call_log_mutex = threading.Lock()
+        self.call_listeners = []
+        self.call_event_listeners = []
 
         for chan in self.chans:
             sysname = chan['sysname']
@@ -173,7 +178,8 @@ class rx_ctl(object):
 
     # process_qmsg is the main message dispatch handler connecting the 'radios' to python
     def process_qmsg(self, msg):
-        curr_time = time.time()
+        sample_clock.update(float(msg.arg2()))              # no-op unless replaying unthrottled
+        curr_time = sample_clock.time()
         m_proto = ctypes.c_int16(msg.type() >> 16).value    # upper 16 bits of msg.type() is signed protocol
         if m_proto != 0: # P25 m_proto=0
             return
@@ -200,7 +206,7 @@ class rx_ctl(object):
         if curr_time > (self.cleanup_timer + CLEANUP_TIMER):
             for rcvr in self.receivers:
                 if self.receivers[rcvr]['rx_rcvr'] is not None:
-                    self.receivers[rcvr]['rx_rcvr'].check_expired_hold(time.time())
+                    self.receivers[rcvr]['rx_rcvr'].check_expired_hold(sample_clock.time())
             self.cleanup_timer = curr_time
 
     # Check for control channel assignments to idle receivers
@@ -225,7 +231,7 @@ class rx_ctl(object):
 
     # ui_command handles all requests from user interface
     def ui_command(self, cmd, data, msgq_id):
-        curr_time = time.time()
+        curr_time = sample_clock.time()
         if msgq_id in self.receivers and self.receivers[msgq_id]['rx_rcvr'] is not None:
             self.receivers[msgq_id]['rx_rcvr'].ui_command(cmd = cmd, data = data, curr_time = curr_time)    # Dispatch message to the intended receiver
         # Check for control channel reassignment
@@ -276,18 +282,44 @@ class rx_ctl(object):
         return json.dumps(d)
 
     def log_call(self, sysid, rcvr, freq, slot, prio, tgid, tgtag, rid, rtag):
+        entry = { "time":    sample_clock.time(),
+                  "sysid":   sysid,
+                  "rcvr":    rcvr,
+                  "rcvrtag": from_dict(self.receivers[rcvr]['config'], 'name', ""),
+                  "freq":    freq,
+                  "slot":    slot,
+                  "prio":    prio,
+                  "tgid":    tgid,
+                  "tgtag":   tgtag,
+                  "rid":     rid,
+                  "rtag":    rtag }
         with self.call_log_mutex:
-            self.call_log.append({ "time":    time.time(),
-                                   "sysid":   sysid,
-                                   "rcvr":    rcvr,
-                                   "rcvrtag": from_dict(self.receivers[rcvr]['config'], 'name', ""),
-                                   "freq":    freq,
-                                   "slot":    slot,
-                                   "prio":    prio,
-                                   "tgid":    tgid,
-                                   "tgtag":   tgtag,
-                                   "rid":     rid,
-                                   "rtag":    rtag })
+            self.call_log.append(entry)
+        for listener in self.call_listeners:
+            listener(entry)
+
+    def add_call_listener(self, listener):
+        # listener(entry) is called for every call log entry, e.g. to annotate IQ recordings
+        self.call_listeners.append(listener)
+
+    def call_event(self, event, sysid, rcvr, freq, slot, tgid, tgtag, reason = None):
+        if not self.call_event_listeners:
+            return
+        ev = { "event":  event,
+               "time":   sample_clock.time(),
+               "sysid":  sysid,
+               "rcvr":   rcvr,
+               "freq":   freq,
+               "slot":   slot,
+               "tgid":   tgid,
+               "tgtag":  tgtag,
+               "reason": reason }
+        for listener in self.call_event_listeners:
+            listener(ev)
+
+    def add_call_event_listener(self, listener):
+        # listener(event) is called when a receiver starts ("start") or stops ("end") following a call
+        self.call_event_listeners.append(listener)
 
 #################
 # P25 system class
@@ -383,6 +415,9 @@ class p25_system(object):
     def log_call(self, rcvr, freq, slot, prio, tgid, rid):
         self.rx_ctl.log_call(self.ns_syid, rcvr, freq, slot, prio, tgid, self.talkgroups[tgid]['tag'], rid, self.get_rid_tag(rid))
 
+    def call_event(self, event, rcvr, freq, slot, tgid, reason = None):
+        self.rx_ctl.call_event(event, self.ns_syid, rcvr, freq, slot, tgid, self.talkgroups[tgid]['tag'], reason)
+
     def get_talkgroups(self):
         return self.talkgroups
 
@@ -588,7 +623,7 @@ class p25_system(object):
 
     def decode_mbt_data(self, m_rxid, opcode, src, header, mbt_data):
         self.cc_timeouts = 0
-        self.last_tsbk = time.time()
+        self.last_tsbk = sample_clock.time()
         self.stats['tsbk_count'] += 1
         updated = 0
         if opcode == 0x0:  # grp voice channel grant
@@ -677,7 +712,7 @@ class p25_system(object):
 
     def decode_tsbk(self, m_rxid, tsbk):
         self.cc_timeouts = 0
-        self.last_tsbk = time.time()
+        self.last_tsbk = sample_clock.time()
         self.stats['tsbk_count'] += 1
         updated = 0
         tsbk = tsbk << 16    # for missing crc
@@ -971,7 +1006,7 @@ class p25_system(object):
         return updated
 
     def decode_tdma_ptt(self, m_rxid, msg, curr_time):
-        self.last_tsbk = time.time()
+        self.last_tsbk = sample_clock.time()
         self.stats['tsbk_count'] += 1
         mi    = get_ordinals(msg[0:9])
         algid = get_ordinals(msg[9:10])
@@ -983,7 +1018,7 @@ class p25_system(object):
         return self.update_talkgroup_srcaddr(curr_time, ga, sa)
 
     def decode_tdma_endptt(self, m_rxid, msg, curr_time):
-        self.last_tsbk = time.time()
+        self.last_tsbk = sample_clock.time()
         self.stats['tsbk_count'] += 1
         mi    = get_ordinals(msg[0:9])
         sa    = get_ordinals(msg[12:15])
@@ -995,7 +1030,7 @@ class p25_system(object):
     def decode_tdma_msg(self, m_rxid, msg, curr_time):
         updated = 0
         self.cc_timeouts = 0
-        self.last_tsbk = time.time()
+        self.last_tsbk = sample_clock.time()
         self.stats['tsbk_count'] += 1
         mfid = 0
         op = get_ordinals(msg[:1])
@@ -1330,7 +1365,7 @@ class p25_system(object):
 
     def decode_fdma_lcw(self, m_rxid, msg, curr_time):
         updated = 0
-        self.last_tsbk = time.time()
+        self.last_tsbk = sample_clock.time()
         self.stats['tsbk_count'] += 1
         pb_sf_lco = get_ordinals(msg[0:1])
 
@@ -1431,7 +1466,7 @@ class p25_system(object):
                 self.voice_frequencies[prev_freq]['tgid'] = [None, None]
             else:
                 self.voice_frequencies[prev_freq]['tgid'][prev_slot] = None
-        curr_time = time.time()
+        curr_time = sample_clock.time()
         self.voice_frequencies[frequency]['time'] = curr_time
         self.voice_frequencies[frequency]['counter'] += 1
         if tdma_slot is None:   # FDMA mark both slots with same info
@@ -1485,7 +1520,7 @@ class p25_system(object):
             if self.talkgroups[tgid]['receiver'] is not None and srcaddr is not None and srcaddr > 0 and srcaddr < 0xffffff and self.talkgroups[tgid]['srcaddr'] != srcaddr:
                 ui_log_update = True
 
-            self.talkgroups[tgid]['time'] = time.time()
+            self.talkgroups[tgid]['time'] = sample_clock.time()
             self.talkgroups[tgid]['counter'] += 1
             self.talkgroups[tgid]['frequency'] = frequency
             self.talkgroups[tgid]['tdma_slot'] = tdma_slot
@@ -1569,11 +1604,11 @@ class p25_system(object):
             if sg not in self.patches:
                 self.patches[sg] = {}
                 self.patches[sg]['ga'] = set()
-                self.patches[sg]['ts'] = time.time()
+                self.patches[sg]['ts'] = sample_clock.time()
 
             for ga in ga_list:
                 if (ga != sg):
-                    self.patches[sg]['ts'] = time.time() # update timestamp
+                    self.patches[sg]['ts'] = sample_clock.time() # update timestamp
                     if ga not in self.patches[sg]['ga']:
                         self.patches[sg]['ga'].add(ga)
                         if self.debug >= 5:
@@ -1601,7 +1636,7 @@ class p25_system(object):
     def expire_patches(self):
         updated = 0
         with self.patches_mutex:
-            time_now = time.time()
+            time_now = sample_clock.time()
             for sg in list(self.patches):
                 if time_now > (self.patches[sg]['ts'] + PATCH_EXPIRY_TIME):
                     updated += 1
@@ -1663,7 +1698,7 @@ class p25_system(object):
         d['patch_data']     = {}
         d['last_tsbk']      = self.last_tsbk
 
-        t = time.time()
+        t = sample_clock.time()
 
         # Get all current frequencies we know about (CC, alternate CC, VC)
         self.expire_voice_frequencies(t)
@@ -1901,7 +1936,7 @@ class p25_receiver(object):
         if freq is None or int(freq) == 0:
             return
 
-        self.tune_ts = time.time()                                                          # save timestamp at start of tuning
+        self.tune_ts = sample_clock.time()                                                          # save timestamp at start of tuning
 
         if self.tuner_idle:
             if self.fa_ctrl is not None:
@@ -1936,13 +1971,16 @@ class p25_receiver(object):
             self.tuned_frequency = freq
 
         self.vc_retries = 0
+        new_call = (tgid != self.current_tgid) or (slot != self.current_slot)
         self.current_tgid = tgid
         self.current_slot = slot
         if not self.hold_mode:
             self.hold_tgid = None
-            self.hold_until = time.time()
+            self.hold_until = sample_clock.time()
         with self.system.talkgroups_mutex:
             self.talkgroups[tgid]['receiver'] = self
+        if new_call:
+            self.system.call_event("start", self.msgq_id, freq, slot, tgid)
 
     def ui_command(self, cmd, data, curr_time):
         if self.debug > 10:
@@ -2024,7 +2062,7 @@ class p25_receiver(object):
         elif m_type == -4: # P25 sync established
             if self.tune_ts is not None:
                 if self.debug > 1:
-                    sys.stderr.write('%s [%d] sync established, tuning time %f seconds\n' % (log_ts.get(), self.msgq_id, (time.time() - self.tune_ts)))
+                    sys.stderr.write('%s [%d] sync established, tuning time %f seconds\n' % (log_ts.get(), self.msgq_id, (sample_clock.time() - self.tune_ts)))
                 self.tune_ts = None
 
             if self.current_tgid is None:
@@ -2099,7 +2137,7 @@ class p25_receiver(object):
             self.expire_talkgroup(reason = "skiplisted")
             self.hold_mode = False
             self.hold_tgid = None
-            self.hold_until = time.time()
+            self.hold_until = sample_clock.time()
 
     def add_blacklist(self, tgid, end_time=None):
         if not tgid or (tgid <= 0) or (tgid > 65534):
@@ -2143,7 +2181,7 @@ class p25_receiver(object):
             self.expire_talkgroup(reason = "not whitelisted")
             self.hold_mode = False
             self.hold_tgid = None
-            self.hold_until = time.time()
+            self.hold_until = sample_clock.time()
 
     def blacklist_update(self, start_time):
         expired_tgs = [tg for tg in list(self.blacklist.keys())
@@ -2245,14 +2283,15 @@ class p25_receiver(object):
             self.talkgroups[self.current_tgid]['svcopts'] = 0x4
         if self.debug > 1:
             sys.stderr.write("%s [%d] releasing:  tg(%d), freq(%f), slot(%s), reason(%s)\n" % (log_ts.get(), self.msgq_id, self.current_tgid, (self.tuned_frequency/1e6), get_slot(self.current_slot), reason))
+        self.system.call_event("end", self.msgq_id, self.tuned_frequency, self.current_slot, self.current_tgid, reason)
         if self.hold_mode is False:
             # Commanded tgid hold inactive
             if auto_hold:
                 self.hold_tgid = self.current_tgid
-                self.hold_until = time.time() + self.tgid_hold_time
+                self.hold_until = sample_clock.time() + self.tgid_hold_time
             else:
                 self.hold_tgid = None
-                self.hold_until = time.time()
+                self.hold_until = sample_clock.time()
         else:
             # Commanded tgid hold active
             pass
@@ -28,6 +28,7 @@ import json
 import threading
 from helper_funcs import *
 from log_ts import log_ts
+import sample_clock
 from collections import deque
 from gnuradio import gr
 import gnuradio.op25_repeater as op25_repeater
@@ -67,7 +68,7 @@ def meta_update(meta_q, tgid = None, tag = None):
     d = {'json_type': 'meta_update'}
     d['tgid'] = tgid
     d['tag'] = tag
-    msg = gr.message().make_from_string(json.dumps(d), -2, time.time(), 0)
+    msg = gr.message().make_from_string(json.dumps(d), -2, time.time(), 0)   # wall clock, as compared by icemeta and meta_dispatch
     if not meta_q.full_p():
         meta_q.insert_tail(msg)
 
@@ -84,6 +85,8 @@ class rx_ctl(object):
         self.chans = chans
         self.call_log = deque(maxlen=CALL_LOG_MAX_LEN)
         self.call_log_mutex = threading.Lock()
+        self.call_listeners = []
+        self.call_event_listeners = []
 
         for chan in self.chans:
             sysname = chan['sysname']
@@ -146,7 +149,8 @@ class rx_ctl(object):
 
     # process_qmsg is the main message dispatch handler connecting the 'radios' to python
     def process_qmsg(self, msg):
-        curr_time = time.time()
+        sample_clock.update(float(msg.arg2()))  # no-op unless replaying unthrottled
+        curr_time = sample_clock.time()
         m_rxid = int(msg.arg1()) >> 1
         if (m_rxid in self.receivers and
             self.receivers[m_rxid]['rx_sys'] is not None and
@@ -156,7 +160,7 @@ class rx_ctl(object):
 
     # ui_command handles all requests from user interface
     def ui_command(self, cmd, data, msgq_id):
-        curr_time = time.time()
+        curr_time = sample_clock.time()
         if msgq_id in self.receivers and self.receivers[msgq_id]['rx_sys'] is not None:
             self.receivers[msgq_id]['rx_sys'].ui_command(cmd = cmd, data = data, curr_time = curr_time)    # Dispatch message to the intended receiver
 
@@ -193,18 +197,44 @@ class rx_ctl(object):
         return json.dumps(d)
 
     def log_call(self, sysid, rcvr, freq, prio, tgid, tgtag, rid, rtag = ""):
+        entry = { "time":  sample_clock.time(),
+                  "sysid": sysid,
+                  "rcvr":  rcvr,
+                  "rcvrtag": from_dict(self.receivers[rcvr]['config'], 'name', ""),
+                  "freq":  freq,
+                  "slot":  None,
+                  "prio":  prio,
+                  "tgid":  tgid,
+                  "tgtag": tgtag,
+                  "rid":   rid,
+                  "rtag":  rtag }
         with self.call_log_mutex:
-            self.call_log.append({ "time":  time.time(),
-                                   "sysid": sysid,
-                                   "rcvr":  rcvr,
-                                   "rcvrtag": from_dict(self.receivers[rcvr]['config'], 'name', ""),
-                                   "freq":  freq,
-                                   "slot":  None,
-                                   "prio":  prio,
-                                   "tgid":  tgid,
-                                   "tgtag": tgtag,
-                                   "rid":   rid,
-                                   "rtag":  rtag })
+            self.call_log.append(entry)
+        for listener in self.call_listeners:
+            listener(entry)
+
+    def add_call_listener(self, listener):
+        # listener(entry) is called for every call log entry, e.g. to annotate IQ recordings
+        self.call_listeners.append(listener)
+
+    def call_event(self, event, sysid, rcvr, freq, tgid, tgtag, reason = None):
+        if not self.call_event_listeners:
+            return
+        ev = { "event":  event,
+               "time":   sample_clock.time(),
+               "sysid":  sysid,
+               "rcvr":   rcvr,
+               "freq":   freq,
+               "slot":   None,
+               "tgid":   tgid,
+               "tgtag":  tgtag,
+               "reason": reason }
+        for listener in self.call_event_listeners:
+            listener(ev)
+
+    def add_call_event_listener(self, listener):
+        # listener(event) is called when a receiver starts ("start") or stops ("end") following a call
+        self.call_event_listeners.append(listener)
 
 #################
 # Smartnet control channel class
@@ -265,6 +295,9 @@ class osw_receiver(object):
     def log_call(self, rcvr, freq, prio, tgid, rid):
         self.rx_ctl.log_call(self.rx_sys_id, rcvr, freq, prio, tgid, self.talkgroups[tgid]['tag'], rid, "")
 
+    def call_event(self, event, rcvr, freq, tgid, reason = None):
+        self.rx_ctl.call_event(event, self.rx_sys_id, rcvr, freq, tgid, self.talkgroups[tgid]['tag'], reason)
+
     def post_init(self):
         if self.msgq_id < 0:
             sys.stderr.write("%f Smartnet system has no channel assigned!\n" % (time.time()))
@@ -1826,7 +1859,7 @@ class osw_receiver(object):
                 if self.debug >= 5:
                     sys.stderr.write('%s [%d] ignorning stale OSW for tgid=%s, time_diff=%f\n' % (log_ts.get(), self.msgq_id, base_tgid, (ts - self.talkgroups[base_tgid]['release_time'])))
                 return False
-            self.talkgroups[base_tgid]['time'] = time.time()
+            self.talkgroups[base_tgid]['time'] = sample_clock.time()
             self.talkgroups[base_tgid]['release_time'] = 0
             self.talkgroups[base_tgid]['frequency'] = frequency
             self.talkgroups[base_tgid]['status'] = tgid_stat
@@ -1971,7 +2004,7 @@ class osw_receiver(object):
         d['adjacent_data']  = {}
         d['last_tsbk']      = self.last_osw
 
-        t = time.time()
+        t = sample_clock.time()
 
         # Get all current frequencies we know about (CC, alternate CC, VC)
         all_freqs = list(self.voice_frequencies.keys()) + list(self.alternate_cc_freqs.keys())
@@ -2094,6 +2127,10 @@ class voice_receiver(object):
         if self.control is not None:
             self.control.log_call(self.msgq_id, freq, prio, tgid, rid)
 
+    def call_event(self, event, freq, tgid, reason = None):
+        if self.control is not None:
+            self.control.call_event(event, self.msgq_id, freq, tgid, reason)
+
     def post_init(self):
         if self.debug >= 1:
             sys.stderr.write("%s [%d] Initializing voice channel\n" % (log_ts.get(), self.msgq_id))
@@ -2172,7 +2209,7 @@ class voice_receiver(object):
             self.expire_talkgroup(reason = "skiplisted")
             self.hold_mode = False
             self.hold_tgid = None
-            self.hold_until = time.time()
+            self.hold_until = sample_clock.time()
 
     def add_blacklist(self, tgid, end_time=None):
         if not tgid or (tgid <= 0) or (tgid > 65534):
@@ -2196,7 +2233,7 @@ class voice_receiver(object):
             self.expire_talkgroup(reason = "blacklisted")
             self.hold_mode = False
             self.hold_tgid = None
-            self.hold_until = time.time()
+            self.hold_until = sample_clock.time()
 
     def add_whitelist(self, tgid):
         if not tgid or (tgid <= 0) or (tgid > 65534):
@@ -2218,7 +2255,7 @@ class voice_receiver(object):
             self.expire_talkgroup(reason = "not whitelisted")
             self.hold_mode = False
             self.hold_tgid = None
-            self.hold_until = time.time()
+            self.hold_until = sample_clock.time()
 
     def blacklist_update(self, start_time):
         expired_tgs = [tg for tg in list(self.blacklist.keys())
@@ -2329,14 +2366,17 @@ class voice_receiver(object):
                            'system': self.config['trunking_sysname']}
             self.frequency_set(tune_params)
             self.tuned_frequency = freq
+        new_call = (tgid != self.current_tgid)
         self.current_tgid = tgid
         with self.control.talkgroups_mutex:
             self.talkgroups[tgid]['receiver'] = self
+        if new_call:
+            self.call_event("start", freq, tgid)
         self.fa_ctrl({'tuner': self.msgq_id, 'cmd': 'set_slotid', 'slotid': 0}) # always enable digital p25cai
         self.nbfm_ctrl(self.msgq_id, (self.talkgroups[tgid]['mode'] != 1) )     # enable nbfm unless mode is digital
 
     def expire_talkgroup(self, tgid=None, update_meta = True, reason="unk", auto_hold = True):
-        expire_time = time.time()
+        expire_time = sample_clock.time()
         self.nbfm_ctrl(self.msgq_id, False)                                     # disable nbfm
         self.fa_ctrl({'tuner': self.msgq_id, 'cmd': 'set_slotid', 'slotid': 4}) # disable p25cai
         if self.current_tgid is None:
@@ -2348,6 +2388,7 @@ class voice_receiver(object):
             self.talkgroups[self.current_tgid]['release_time'] = expire_time
         if self.debug > 1:
             sys.stderr.write("%s [%d] releasing:  tg(%d), freq(%f), reason(%s)\n" % (log_ts.get(), self.msgq_id, self.current_tgid, (self.tuned_frequency/1e6), reason))
+        self.call_event("end", self.tuned_frequency, self.current_tgid, reason)
         if auto_hold:
             self.hold_tgid = self.current_tgid
             self.hold_until = expire_time + TGID_HOLD_TIME
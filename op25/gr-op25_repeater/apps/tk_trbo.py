@@ -22,11 +22,11 @@
 
 import sys
 import ctypes
-import time
 import json
 import traceback
 from helper_funcs import *
 from log_ts import log_ts
+import sample_clock
 
 CC_HUNT_TIMEOUTS = 3   # number of sync timeouts to wait until control channel hunt
 VC_SRCH_TIME     = 3.0 # seconds to wait from VC tuning until hunt
@@ -49,7 +49,7 @@ class dmr_chan:
         self.debug = dbglvl
 
 class dmr_receiver:
-    def __init__(self, msgq_id, frequency_set=None, fa_ctrl=None, chans={}, debug=0):
+    def __init__(self, msgq_id, frequency_set=None, fa_ctrl=None, chans={}, debug=0, call_event=None):
         class _states(object):
             IDLE = 0
             CC   = 1
@@ -61,6 +61,7 @@ class dmr_receiver:
         self.current_state = self.states.IDLE
         self.frequency_set = frequency_set
         self.fa_ctrl = fa_ctrl
+        self.call_event = call_event
         self.msgq_id = msgq_id
         self.debug = debug
         self.cc_timeouts = 0
@@ -113,9 +114,11 @@ class dmr_receiver:
                                         'chan': chan,
                                         'state': self.states.SRCH,
                                         'type': self.current_type,
-                                        'time': time.time()})
+                                        'time': sample_clock.time()})
                     self.active_tgids[grp_addr] = lcn_sl
-                self.chans[lcn].slot[slot].grant_time = time.time()
+                    if self.call_event is not None:
+                        self.call_event("start", 1, freq, slot, grp_addr)
+                self.chans[lcn].slot[slot].grant_time = sample_clock.time()
                 self.chans[lcn].slot[slot].grp_addr = grp_addr
                 self.chans[lcn].slot[slot].src_addr = src_addr
             elif self.debug >=9:
@@ -140,7 +143,7 @@ class dmr_receiver:
         tune_params = {'tuner': self.msgq_id,
                        'freq': self.chans[self.chan_list[next_ch]].frequency,
                        'chan': next_ch,
-                       'time': time.time()}
+                       'time': sample_clock.time()}
 
         if msgq_id is not None:
             tune_params['tuner'] = msgq_id
@@ -181,7 +184,7 @@ class dmr_receiver:
                 self.cc_timeouts = 0
 
         # If voice channel not identified, begin LCN search
-        if (self.msgq_id > 0) and (self.current_state == self.states.SRCH) and (self.tune_time + VC_SRCH_TIME < time.time()):
+        if (self.msgq_id > 0) and (self.current_state == self.states.SRCH) and (self.tune_time + VC_SRCH_TIME < sample_clock.time()):
             self.tune_next_chan()
 
         # log received message
@@ -375,6 +378,8 @@ class rx_ctl(object):
         self.fa_ctrl = fa_ctrl
         self.debug = debug
         self.receivers = {}
+        self.call_listeners = []
+        self.call_event_listeners = []
 
         self.chans = {}
         for _chan in chans:
@@ -399,9 +404,10 @@ class rx_ctl(object):
             self.receivers[rx_id].post_init()
 
     def add_receiver(self, msgq_id, config, meta_q = None, freq = 0):
-        self.receivers[msgq_id] = dmr_receiver(msgq_id, self.frequency_set, self.fa_ctrl, self.chans, self.debug)
+        self.receivers[msgq_id] = dmr_receiver(msgq_id, self.frequency_set, self.fa_ctrl, self.chans, self.debug, self.call_event)
 
     def process_qmsg(self, msg):
+        sample_clock.update(float(msg.arg2()))              # no-op unless replaying unthrottled
         m_proto = ctypes.c_int16(msg.type() >> 16).value    # upper 16 bits of msg.type() is signed protocol
         m_type = ctypes.c_int16(msg.type() & 0xffff).value  # lower 16 bits of msg.type() is signed message type
         if (m_proto != 1) and (m_type != -1): # DMR m_proto=1 except for timeout when m_proto=0
@@ -414,7 +420,7 @@ class rx_ctl(object):
             self.receivers[m_rxid].process_qmsg(msg)
 
     def check_expired_grants(self):
-        cur_time = time.time()
+        cur_time = sample_clock.time()
         for tgid in list(self.receivers[0].active_tgids):
             act_lcn = self.receivers[0].active_tgids[tgid] >> 1
             act_slot = self.receivers[0].active_tgids[tgid] & 1
@@ -427,6 +433,7 @@ class rx_ctl(object):
                     self.receivers[1].vc_timeouts = 0
                     self.receivers[1].current_state = self.receivers[1].states.IDLE
                     self.fa_ctrl({'tuner': 1, 'cmd': 'set_slotid', 'slotid': 4})
+                    self.call_event("end", 1, self.chans[act_lcn].frequency, act_slot, tgid, "expired")
 
     def get_chan_status(self):
         d = {'json_type': 'channel_update'}
@@ -440,6 +447,29 @@ class rx_ctl(object):
         d['channels'] = rcvr_ids
         return json.dumps(d)
 
+    def add_call_listener(self, listener):
+        # no call log is kept for DMR, so listeners are registered but never called
+        self.call_listeners.append(listener)
+
+    def call_event(self, event, rcvr, freq, slot, tgid, reason = None):
+        if not self.call_event_listeners:
+            return
+        ev = { "event":  event,
+               "time":   sample_clock.time(),
+               "sysid":  0,
+               "rcvr":   rcvr,
+               "freq":   freq,
+               "slot":   slot,
+               "tgid":   tgid,
+               "tgtag":  "",
+               "reason": reason }
+        for listener in self.call_event_listeners:
+            listener(ev)
+
+    def add_call_event_listener(self, listener):
+        # listener(event) is called when the Connect Plus voice receiver starts ("start") or stops ("end") following a call
+        self.call_event_listeners.append(listener)
+
     def get_call_log(self):
         d = {'json_type': 'call_log', 'log': []}    # stub function for compatibility (does nothing)
         return json.dumps(d)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+#
+# P25 Phase 2 scrambling sequence benchmark
+#
+# Compares the former bit-by-bit register clocking of p25p2_lfsr.mk_xor_bits
+# with the precomputed parity masks now used, for random NAC/SYSID/WACN
+# triplets.  Reports the time per sequence of each, the one-time cost of
+# building the masks, and checks that both produce identical bits.
+#
+# Example usage:
+# util/bench-lfsr.py -n 200
+#
+
+import os
+import sys
+import time
+import numpy as np
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tdma'))
+import lfsr
+from bit_utils import mk_array, mk_int
+
+def legacy_xor_bits(nac, sysid, wacn):
+    l = lfsr.p25p2_lfsr.__new__(lfsr.p25p2_lfsr)
+    reg = np.int64(mk_array(16777216*wacn + 4096*sysid + nac, 44))
+    reg = mk_int(np.dot(reg, lfsr.M))
+    s = []
+    for i in range(lfsr.XOR_BITS):
+        s.append((reg >> 43) & 1)
+        reg = l.cyc_reg(reg)
+    return s
+
+def new_xor_bits(nac, sysid, wacn):
+    return lfsr.p25p2_lfsr.__new__(lfsr.p25p2_lfsr).mk_xor_bits(nac, sysid, wacn)
+
+def run(fn, params):
+    t0 = time.time()
+    for nac, sysid, wacn in params:
+        fn(nac, sysid, wacn)
+    return (time.time() - t0) / len(params)
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-n", "--count", type="int", default=100, help="number of nac/sysid/wacn triplets")
+    (options, args) = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    params = [(0x293, 0x18, 0x1), (0, 0, 0), (0xfff, 0xfff, 0xfffff)]
+    params += [(int(rng.randint(0, 0x1000)), int(rng.randint(0, 0x1000)), int(rng.randint(0, 0x100000))) for i in range(options.count)]
+
+    mismatches = 0
+    for nac, sysid, wacn in params:
+        if list(new_xor_bits(nac, sysid, wacn)) != legacy_xor_bits(nac, sysid, wacn):
+            mismatches += 1
+            sys.stdout.write("mismatch: nac 0x%x sysid 0x%x wacn 0x%x\n" % (nac, sysid, wacn))
+    sys.stdout.write("%d sequences compared, %d mismatches\n" % (len(params), mismatches))
+
+    t0 = time.time()
+    lfsr.mk_xor_masks()
+    sys.stdout.write("  %-8s %9.3f ms (once per process)\n" % ('masks', 1000 * (time.time() - t0)))
+    t_legacy = run(legacy_xor_bits, params)
+    t_new = run(new_xor_bits, params)
+    sys.stdout.write("  %-8s %9.3f ms per sequence\n" % ('legacy', 1000 * t_legacy))
+    sys.stdout.write("  %-8s %9.3f ms per sequence (%.0fx)\n" % ('masks', 1000 * t_new, t_legacy / t_new))
+
+if __name__ == "__main__":
+    main()
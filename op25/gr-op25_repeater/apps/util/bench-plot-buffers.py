@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+#
+# Plot ingestion allocation benchmark
+#
+# Compares the legacy np.concatenate based frame assembly used by
+# gr_gnuplot.wrap_gp with the preallocated plot_ring buffers, feeding
+# both the same stream of work()-sized chunks and reporting allocations
+# measured with tracemalloc.
+#
+# Example usage:
+# util/bench-plot-buffers.py -n 2000 -c 512
+#
+
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from gr_gnuplot import plot_ring
+
+def legacy_ingest(chunks, bufsz, sps):
+    buf = []
+    frames = 0
+    for chunk in chunks:
+        consumed = min(len(chunk), bufsz - len(buf))
+        buf = np.concatenate((buf, chunk[:int(consumed)]))
+        if len(buf) < bufsz:
+            continue
+        frames += 1
+        while len(buf) >= sps:      # per-trace slicing as done for eye plots
+            trace = buf[:sps]
+            buf = buf[sps:]
+        buf = []
+    return frames
+
+def ring_ingest(chunks, bufsz, sps):
+    ring = plot_ring(bufsz, np.float32)
+    frames = 0
+    for chunk in chunks:
+        ring.fill(chunk)
+        if not ring.full():
+            continue
+        frames += 1
+        frame = ring.data
+        for start in range(0, bufsz - sps + 1, sps):
+            trace = frame[start:start + sps]
+        ring.reset()
+    return frames
+
+def measure(fn, chunks, bufsz, sps):
+    tracemalloc.start()
+    t0 = time.time()
+    frames = fn(chunks, bufsz, sps)
+    elapsed = time.time() - t0
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return frames, elapsed, peak
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-n", "--chunks", type="int", default=2000, help="number of work() calls to simulate")
+    parser.add_option("-c", "--chunk-size", type="int", default=512, help="samples per work() call")
+    parser.add_option("-s", "--sps", type="int", default=10, help="eye plot samples per trace")
+    (options, args) = parser.parse_args()
+
+    bufsz = 100 * options.sps
+    chunks = [np.random.randn(options.chunk_size).astype(np.float32) for i in range(options.chunks)]
+
+    for name, fn in (('concatenate', legacy_ingest), ('plot_ring', ring_ingest)):
+        frames, elapsed, peak = measure(fn, chunks, bufsz, options.sps)
+        sys.stdout.write("%-12s frames=%d time=%.3fs peak traced=%d bytes\n" % (name, frames, elapsed, peak))
+
+    tracemalloc.start()
+    ring = plot_ring(bufsz, np.float32)
+    chunk = chunks[0]
+    ring.fill(chunk)
+    ring.reset()
+    before, peak0 = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()     # python 3.9+
+    for i in range(1000):
+        ring.fill(chunk)
+        if ring.full():
+            ring.reset()
+    after, peak1 = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    sys.stdout.write("plot_ring steady state: %d bytes peak growth over 1000 fills\n" % (peak1 - before))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+#
+# sockaudio frame processing benchmark
+#
+# Compares the former float32 scale + range() indexed interleave with
+# the preallocated fixed point path of socket_audio.interleave, feeding
+# both the same 320 byte UDP audio frames.  Reports frames per second
+# and the bytes allocated per frame measured with tracemalloc, and
+# checks that both produce the same samples (within one lsb of rounding).
+#
+# Example usage:
+# util/bench-sockaudio.py -n 20000 -g 1.5
+#
+
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import sockaudio
+
+def legacy_scale(data, gain):
+    arr = np.array(np.frombuffer(data, dtype=np.int16), dtype=np.float32)
+    result = np.zeros(len(arr), dtype=np.int16)
+    np.clip(arr*gain, -32767, 32766, out=result, casting='unsafe')
+    return result.tobytes('C')
+
+def legacy_interleave(data_a, data_b):
+    arr_a = np.frombuffer(data_a, dtype=np.int16)
+    arr_b = np.frombuffer(data_b, dtype=np.int16)
+    d_len = max(len(arr_a), len(arr_b))
+    result = np.zeros(d_len*2, dtype=np.int16)
+    if len(arr_a):
+        result[ range(0, len(arr_a)*2, 2) ] = arr_a
+    if len(arr_b):
+        result[ range(1, len(arr_b)*2, 2) ] = arr_b
+    return result.tobytes('C')
+
+def legacy_frame(sa, data_a, data_b):
+    if data_b is None:
+        data_a = legacy_scale(data_a, sa.audio_gain)
+        return legacy_interleave(data_a, data_a)
+    return legacy_interleave(legacy_scale(data_a, sa.audio_gain), legacy_scale(data_b, sa.audio_gain))
+
+def new_frame(sa, data_a, data_b):
+    return sa.interleave(data_a, data_b)
+
+def make_audio(gain):
+    sa = sockaudio.socket_audio.__new__(sockaudio.socket_audio)    # no sockets or pcm device needed
+    sa.pcm_buf = np.zeros(sockaudio.MAX_SUPERFRAME_SIZE, dtype=np.int16)
+    sa.set_gain(gain)
+    return sa
+
+def run(fn, sa, frames, two_channels):
+    t0 = time.time()
+    for i in range(len(frames) - 1):
+        fn(sa, frames[i], frames[i+1] if two_channels else None)
+    return time.time() - t0
+
+def per_frame_alloc(fn, sa, frame, two_channels):
+    fn(sa, frame, frame if two_channels else None)  # warm up
+    tracemalloc.start()
+    fn(sa, frame, frame if two_channels else None)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-n", "--frames", type="int", default=20000, help="number of udp frames")
+    parser.add_option("-g", "--gain", type="float", default=1.5, help="audio gain")
+    (options, args) = parser.parse_args()
+
+    samples = (np.random.randn(options.frames + 1, sockaudio.MAX_SUPERFRAME_SIZE // 2) * 8000).astype(np.int16)
+    frames = [s.tobytes() for s in samples]
+    sa = make_audio(options.gain)
+
+    for two_channels in (False, True):
+        a = np.frombuffer(legacy_frame(sa, frames[0], frames[1] if two_channels else None), dtype=np.int16)
+        b = new_frame(sa, frames[0], frames[1] if two_channels else None)
+        diff = int(np.max(np.abs(a.astype(np.int32) - b.astype(np.int32))))
+        sys.stdout.write("%s (max sample difference %d)\n" % ("stereo" if two_channels else "mono", diff))
+        for name, fn in (('legacy', legacy_frame), ('preallocated', new_frame)):
+            elapsed = run(fn, sa, frames, two_channels)
+            sys.stdout.write("  %-13s %9.0f frames/sec %6d bytes allocated per frame\n" % (name, options.frames / elapsed, per_frame_alloc(fn, sa, frames[0], two_channels)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+#
+# Channel translating filter benchmark
+#
+# Runs the p25_demod_cb channel translating filter in both its time-domain
+# (freq_xlating_fir_filter_ccf) and fft (rotator + fft_filter_ccf) forms
+# over a fixed number of samples for a range of device sample rates, and
+# reports the process cpu time needed per second of input for one channel.
+#
+# Example usage:
+# util/bench-xlat-filter.py -s 5 -r 1e6,2.4e6,6e6,10e6
+#
+
+import os
+import sys
+import time
+from gnuradio import gr, blocks, analog, filter
+from gnuradio.eng_option import eng_option
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import p25_demodulator_dev as p25_demodulator
+
+_def_if_rate = 24000
+
+class xlat_top_block(gr.top_block):
+    def __init__(self, mode, input_rate, seconds):
+        gr.top_block.__init__(self)
+        decimation = int(input_rate / _def_if_rate)
+        resampled_rate = float(input_rate) / float(decimation)
+        taps = filter.firdes.low_pass(1.0, input_rate, resampled_rate/2, resampled_rate/2)   # same design as p25_demod_cb
+        self.ntaps = len(taps)
+        self.decimation = decimation
+        src = analog.noise_source_c(analog.GR_GAUSSIAN, 1.0, 0)
+        head = blocks.head(gr.sizeof_gr_complex, int(input_rate * seconds))
+        if mode == 'fft':
+            xlat = p25_demodulator.fft_xlating_filter_ccf(decimation, taps, 100000, input_rate)
+        else:
+            xlat = filter.freq_xlating_fir_filter_ccf(decimation, taps, 100000, input_rate)
+        sink = blocks.null_sink(gr.sizeof_gr_complex)
+        self.connect(src, head, xlat, sink)
+
+def run_one(mode, input_rate, seconds):
+    tb = xlat_top_block(mode, input_rate, seconds)
+    c0 = time.process_time()
+    t0 = time.time()
+    tb.run()
+    cpu = time.process_time() - c0
+    wall = time.time() - t0
+    return tb.ntaps, tb.decimation, cpu, wall
+
+def main():
+    parser = OptionParser(option_class=eng_option)
+    parser.add_option("-r", "--rates", type="string", default="1e6,2.4e6,3.2e6,6e6,8e6,10e6", help="comma separated list of input sample rates")
+    parser.add_option("-s", "--seconds", type="eng_float", default=5, help="seconds of input to process per run")
+    (options, args) = parser.parse_args()
+
+    sys.stdout.write("%10s %6s %6s %8s %12s %12s %8s\n" % ("rate", "taps", "decim", "tap/out", "fir cpu/s", "fft cpu/s", "faster"))
+    for rate in [float(r) for r in options.rates.split(',')]:
+        ntaps, decim, fir_cpu, fir_wall = run_one('fir', rate, options.seconds)
+        ntaps, decim, fft_cpu, fft_wall = run_one('fft', rate, options.seconds)
+        faster = 'fft' if fft_cpu < fir_cpu else 'fir'
+        sys.stdout.write("%10d %6d %6d %8.1f %12.3f %12.3f %8s\n" % (rate, ntaps, decim, float(ntaps) / decim, fir_cpu / options.seconds, fft_cpu / options.seconds, faster))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+
+#
+# Device sample rate planner
+#
+# Reads a multi_rx config file and, for each device, prints the lowest
+# sample rate and the center frequency that cover the frequencies of its
+# channels and of the trunking systems they follow, along with the
+# per-channel translating filter cost at that rate.  Unlike multi_rx,
+# which only plans devices marked "plan": true, every device is planned.
+#
+# Example usage:
+# util/plan-devices.py -c p25_rtl_example.json
+#
+
+import os
+import sys
+import json
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import rate_planner
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-c", "--config-file", type="string", default=None, help="multi_rx config file name")
+    parser.add_option("-r", "--rates", type="string", default=None, help="comma separated list of allowed rates (overrides the device)")
+    (options, args) = parser.parse_args()
+    if options.config_file is None:
+        parser.print_help()
+        exit(1)
+
+    config = json.loads(open(options.config_file, encoding="utf-8-sig").read())
+    for dev_cfg in config['devices']:
+        dev_cfg['plan'] = True
+        if options.rates is not None:
+            dev_cfg['plan_rates'] = options.rates
+    plans = rate_planner.plan_devices(config, apply = False)
+
+    sys.stdout.write("%-12s %10s %12s %8s %10s %6s %6s %8s\n" % ("device", "rate", "frequency", "offset", "span", "decim", "taps", "MMAC/s"))
+    for name in plans:
+        p = plans[name]
+        sys.stdout.write("%-12s %10d %12d %8d %10d %6d %6d %8.2f\n" % (name, p['rate'], p['frequency'], p['offset'], p['span'], p['cost']['decim'], p['cost']['taps'], p['cost']['mmacs']))
+
+if __name__ == "__main__":
+    main()
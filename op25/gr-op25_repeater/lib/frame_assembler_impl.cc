@@ -35,6 +35,8 @@
 #include <string.h>
 #include <errno.h>
 #include <vector>
+#include <thread>
+#include <chrono>
 #include <sys/time.h>
 
 #include <nlohmann/json.hpp>
@@ -81,6 +83,11 @@ namespace gr {
             } else if (cmd == "crypt_behavior") {
 			    if (d_sync)
 			        d_sync->crypt_behavior(j["behavior"].get<int>());	
+			} else if (cmd == "set_sample_clock") {
+                if (j.find("ts") != j.end())
+                    logts.set_sample_clock(j["ts"].get<double>(), j["rate"].get<double>());
+                else
+                    logts.set_sample_rate(j["rate"].get<double>());
 			} else if (cmd == "dump_buffer") {
 			    if (d_sync)
                     d_sync->dump_buffer();
@@ -115,6 +122,7 @@ namespace gr {
 
         static const int MIN_IN = 1;	// mininum number of input streams
         static const int MAX_IN = 1;	// maximum number of input streams
+        static const int MAX_QUEUE_WAIT = 20;	// msec per work() call to wait for a full msg queue in sample clock mode
 
         /*
          * The private constructor
@@ -144,13 +152,32 @@ namespace gr {
             {
 
                 const uint8_t *in = (const uint8_t *) input_items[0];
+                int nconsumed = ninput_items[0];
 
-                if (d_sync) {
+                if (d_sync && logts.is_sample_clock()) {
+                    // batch replay: timestamps follow the symbol count, and rather than
+                    // dropping messages wait for python to drain the queue.  The wait is
+                    // bounded per call; symbols left over are decoded on the next call.
+                    uint64_t n_read = nitems_read(0);
+                    int waited = 0;
+                    for (int i=0; i<ninput_items[0]; i++) {
+                        while ((waited < MAX_QUEUE_WAIT) && d_msg_queue && d_msg_queue->full_p()) {
+                            std::this_thread::sleep_for(std::chrono::milliseconds(1));
+                            waited++;
+                        }
+                        if ((i > 0) && d_msg_queue && d_msg_queue->full_p()) {
+                            nconsumed = i;
+                            break;
+                        }
+                        logts.set_sample_count(n_read + i);
+                        d_sync->rx_sym(in[i]);
+                    }
+                } else if (d_sync) {
                     for (int i=0; i<ninput_items[0]; i++) {
                         d_sync->rx_sym(in[i]);
                     }
                 }
-                consume_each(ninput_items[0]);
+                consume_each(nconsumed);
                 // Tell runtime system how many output items we produced.
                 return 0;
             }
@@ -21,6 +21,7 @@
 #ifndef INCLUDED_LOG_TS_H
 #define INCLUDED_LOG_TS_H
 
+#include <stdint.h>
 #include <time.h>
 #include <sys/time.h>
 #include <string.h>
@@ -52,8 +53,16 @@ private:
 	double tstamp;
 	char log_tstring[40];
 
+	// optional sample clock: when enabled, get_ts() is derived from the
+	// number of symbols processed rather than from the wall clock so that
+	// file replay may run faster than realtime
+	double clock_base;
+	double clock_rate;
+	uint64_t clock_start;
+	uint64_t clock_count;
+
 public:
-	inline log_ts()
+	inline log_ts() : clock_base(0), clock_rate(0), clock_start(0), clock_count(0)
 	{
 		if (gettimeofday(&curr_time, 0) == 0)
 		{
@@ -106,6 +115,9 @@ public:
 
 	inline double get_ts()
 	{
+		if (clock_rate > 0)
+			return tstamp = clock_base + ((clock_count - clock_start) / clock_rate);
+
 		if (gettimeofday(&curr_time, 0) == 0)
 			tstamp = curr_time.tv_sec + (curr_time.tv_usec / 1e6);
 		else
@@ -114,6 +126,29 @@ public:
 		return tstamp;
 	}
 
+	inline void set_sample_clock(double base, double rate)
+	{
+		clock_base = base;
+		clock_rate = rate;
+		clock_start = clock_count;
+	}
+
+	inline void set_sample_rate(double rate)	// rebase running sample clock at new symbol rate
+	{
+		if ((clock_rate > 0) && (rate > 0))
+			set_sample_clock(get_ts(), rate);
+	}
+
+	inline void set_sample_count(uint64_t count)
+	{
+		clock_count = count;
+	}
+
+	inline bool is_sample_clock()
+	{
+		return (clock_rate > 0);
+	}
+
 	inline void mark_ts()
 	{
 		memcpy(&marker_time, &curr_time, sizeof(struct timeval));
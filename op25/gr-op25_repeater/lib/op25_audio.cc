@@ -30,6 +30,7 @@
 #include <stdint.h>
 #include <sys/types.h>
 #include <sys/stat.h>
+#include <sys/mman.h>
 #include <fcntl.h>
 #include <netdb.h>
 
@@ -75,7 +76,10 @@ op25_audio::op25_audio(const char* udp_host, int port, int debug) :
     d_write_port(port),
     d_audio_port(port),
     d_write_sock(0),
-    d_file_enabled(false)
+    d_file_enabled(false),
+    d_shm_enabled(false),
+    d_shm(NULL),
+    d_shm_size(0)
 {
     char ip[20];
     if (hostname_to_ip(udp_host, ip) == 0)
@@ -93,6 +97,7 @@ op25_audio::~op25_audio()
     if (d_file_enabled)
         close(d_write_sock);
     close_socket();
+    close_shm();
 }
 
 // constructor
@@ -102,11 +107,15 @@ op25_audio::op25_audio(const char* destination, int debug) :
     d_write_port(0),
     d_audio_port(0),
     d_write_sock(0),
-    d_file_enabled(false)
+    d_file_enabled(false),
+    d_shm_enabled(false),
+    d_shm(NULL),
+    d_shm_size(0)
 {
     static const int DEFAULT_UDP_PORT = 23456;
     static const char P_UDP[] = "udp://";
     static const char P_FILE[] = "file://";
+    static const char P_SHM[] = "shm://";
     int port = DEFAULT_UDP_PORT;
 
     if (memcmp(destination, P_UDP, strlen(P_UDP)) == 0) {
@@ -138,6 +147,8 @@ op25_audio::op25_audio(const char* destination, int debug) :
             return;
         }
         d_file_enabled = true;
+    } else if (memcmp(destination, P_SHM, strlen(P_SHM)) == 0) {
+        open_shm(destination+strlen(P_SHM));
     }
 }
 // open socket and set up data structures
@@ -168,6 +179,80 @@ void op25_audio::open_socket()
     d_udp_enabled = true;
 }
 
+// create (or reattach to) the shared memory audio ring
+void op25_audio::open_shm(const char* name)
+{
+    char shm_name[160];
+    snprintf(shm_name, sizeof(shm_name), "/op25-%s", name);
+    d_shm_size = OP25_SHM_HEADER_SIZE + OP25_SHM_CHANNELS * OP25_SHM_SLOTS * sizeof(op25_shm_slot);
+
+    int fd = shm_open(shm_name, O_CREAT | O_RDWR, 0644);
+    if (fd < 0) {
+        fprintf(stderr, "op25_audio::open_shm(%s): error: %d (%s)\n", shm_name, errno, strerror(errno));
+        return;
+    }
+    struct stat st;
+    bool reuse = (fstat(fd, &st) == 0) && ((size_t)st.st_size == d_shm_size);
+    if (!reuse && ftruncate(fd, d_shm_size) < 0) {
+        fprintf(stderr, "op25_audio::open_shm(%s): ftruncate error: %d (%s)\n", shm_name, errno, strerror(errno));
+        close(fd);
+        return;
+    }
+    void * p = mmap(NULL, d_shm_size, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+    close(fd);
+    if (p == MAP_FAILED) {
+        fprintf(stderr, "op25_audio::open_shm(%s): mmap error: %d (%s)\n", shm_name, errno, strerror(errno));
+        return;
+    }
+    d_shm = (uint8_t *) p;
+
+    op25_shm_header * hdr = (op25_shm_header *) d_shm;
+    if (!(reuse && hdr->magic == OP25_SHM_MAGIC && hdr->version == OP25_SHM_VERSION &&
+          hdr->channels == OP25_SHM_CHANNELS && hdr->slots == OP25_SHM_SLOTS && hdr->slot_size == sizeof(op25_shm_slot))) {
+        memset(d_shm, 0, d_shm_size);       // new ring; an existing one keeps its sequence so readers carry on
+        op25_shm_slot * slots = (op25_shm_slot *) (d_shm + OP25_SHM_HEADER_SIZE);
+        for (int i = 0; i < OP25_SHM_CHANNELS * OP25_SHM_SLOTS; i++)
+            slots[i].seq = OP25_SHM_BUSY;   // nothing published yet
+        hdr->version = OP25_SHM_VERSION;
+        hdr->channels = OP25_SHM_CHANNELS;
+        hdr->slots = OP25_SHM_SLOTS;
+        hdr->slot_size = sizeof(op25_shm_slot);
+        __atomic_store_n(&hdr->magic, OP25_SHM_MAGIC, __ATOMIC_RELEASE);
+    }
+    hdr->pid = getpid();
+
+    fprintf(stderr, "op25_audio::open_shm(): enabled shared memory ring %s, %d slots\n", shm_name, OP25_SHM_SLOTS);
+    d_shm_enabled = true;
+}
+
+void op25_audio::close_shm()
+{
+    if (!d_shm_enabled)
+        return;
+    munmap(d_shm, d_shm_size);      // the ring itself is kept for readers and the next writer
+    d_shm = NULL;
+    d_shm_enabled = false;
+}
+
+ssize_t op25_audio::shm_write(const void * buf, size_t len, int channel) const
+{
+    if (len > OP25_SHM_SLOT_DATA) {
+        if (d_debug >= 10)
+            fprintf(stderr, "op25_audio::shm_write(length %lu): payload too large\n", len);
+        return 0;
+    }
+    op25_shm_header * hdr = (op25_shm_header *) d_shm;
+    uint64_t seq = __atomic_fetch_add(&hdr->write_seq[channel], 1, __ATOMIC_ACQ_REL);   // other writers may share the ring
+    op25_shm_slot * slot = (op25_shm_slot *) (d_shm + OP25_SHM_HEADER_SIZE) + (channel * OP25_SHM_SLOTS + (seq % OP25_SHM_SLOTS));
+
+    __atomic_store_n(&slot->seq, OP25_SHM_BUSY, __ATOMIC_RELAXED);
+    __atomic_thread_fence(__ATOMIC_RELEASE);
+    memcpy(slot->data, buf, len);
+    slot->len = len;
+    __atomic_store_n(&slot->seq, seq, __ATOMIC_RELEASE);
+    return len;
+}
+
 // close socket
 void op25_audio::close_socket()
 {
@@ -192,6 +277,11 @@ ssize_t op25_audio::do_send(const void * buf, size_t len, int port, bool is_ctrl
                 fprintf(stderr, "op25_audio::do_send(length %lu): error(%d): %s\n", len, errno, strerror(errno));
                 rc = 0;
             }
+        } else if (d_shm_enabled) {
+            int channel = (port - d_audio_port) / 2;
+            if (channel < 0 || channel >= OP25_SHM_CHANNELS)
+                channel = 0;
+            rc = shm_write(buf, len, channel);
         } else if (d_file_enabled && !is_ctrl) {
             size_t amt_written = 0;
             for (;;) {
@@ -27,6 +27,40 @@
 #include <netinet/in.h>
 #include <arpa/inet.h>
 
+// Shared memory audio ring ("shm://<name>" destination, /dev/shm/op25-<name>).
+// One ring per audio channel (the audio port and port+2).  Every payload that
+// would have been sent as a udp datagram is stored in the next slot; readers
+// keep their own position, so any number of them may follow the same ring.
+// Several writers may share a ring (e.g. a channel's digital and analog audio):
+// each claims its sequence number with an atomic increment of write_seq, then
+// writes the slot as a seqlock: seq is OP25_SHM_BUSY while the data changes
+// and the claimed sequence number once the payload is complete.  Readers stop
+// at a slot whose seq is busy or older than expected until it is published.
+#define OP25_SHM_MAGIC       0x3532504f     // "OP25"
+#define OP25_SHM_VERSION     2
+#define OP25_SHM_CHANNELS    2
+#define OP25_SHM_SLOTS       256            // frames per channel (about 5 sec of audio)
+#define OP25_SHM_SLOT_DATA   512            // maximum payload per slot
+#define OP25_SHM_HEADER_SIZE 128
+#define OP25_SHM_BUSY        (~(uint64_t)0)
+
+struct op25_shm_slot {
+    uint64_t    seq;
+    uint32_t    len;
+    uint32_t    reserved;
+    uint8_t     data[OP25_SHM_SLOT_DATA];
+};
+
+struct op25_shm_header {
+    uint32_t    magic;
+    uint32_t    version;
+    uint32_t    channels;
+    uint32_t    slots;
+    uint32_t    slot_size;
+    uint32_t    pid;                        // last writer process attached
+    uint64_t    write_seq[OP25_SHM_CHANNELS];   // next sequence number to claim per channel
+};
+
 class op25_audio
 {
 public:
@@ -45,9 +79,15 @@ private:
     int         d_write_sock;
     bool        d_file_enabled;
     struct      sockaddr_in d_sock_addr;
+    bool        d_shm_enabled;
+    uint8_t *   d_shm;
+    size_t      d_shm_size;
 
     void open_socket();
     void close_socket();
+    void open_shm(const char* name);
+    void close_shm();
+    ssize_t shm_write(const void * bufp, size_t len, int channel) const;
     ssize_t do_send(const void * bufp, size_t len, int port, bool is_ctrl) const;
 
 public:
@@ -55,7 +95,7 @@ public:
     op25_audio(const char* destination, int debug);
     ~op25_audio();
 
-    inline bool enabled() const { return d_udp_enabled; }
+    inline bool enabled() const { return d_udp_enabled || d_shm_enabled; }
     inline void set_debug(int debug) { d_debug = debug; }
 
     ssize_t send_to(const void *buf, size_t len) const;